@@ -28,6 +28,17 @@ class MemoryConfig:
     embedding_provider: str = "openai"  # "openai" | "local"
     embedding_model: str = "text-embedding-3-small"
     embedding_dim: int = 1536
+    embedding_storage_format: str = "float32"  # "float32" | "float16" | "int8" (on-disk encoding)
+    embedding_cache_enabled: bool = True
+    embedding_cache_max_entries: int = 50000
+    
+    # Embedding pipeline config (indexing)
+    embedding_batch_size: int = 256  # Max texts per request
+    embedding_batch_tokens: int = 100000  # Max estimated tokens per request
+    embedding_concurrency: int = 4  # Requests in flight
+    embedding_rpm: int = 3000  # Requests per minute limit
+    embedding_tpm: int = 1000000  # Tokens per minute limit
+    embedding_max_retries: int = 5
     
     # Chunking config
     chunk_max_tokens: int = 500
@@ -37,6 +48,11 @@ class MemoryConfig:
     max_results: int = 10
     min_score: float = 0.1
     
+    # Vector index config
+    vector_index_mode: str = "auto"  # "exact" | "ivf" | "auto" (ivf once the index is large)
+    vector_ivf_threshold: int = 50000
+    vector_ivf_nprobe: int = 8
+    
     # Hybrid search weights
     vector_weight: float = 0.7
     keyword_weight: float = 0.3
@@ -47,6 +63,8 @@ class MemoryConfig:
     # Sync config
     enable_auto_sync: bool = True
     sync_on_search: bool = True
+    watch_enabled: bool = True  # Sync changed files in the background (watchdog, or stat polling)
+    watch_poll_interval: float = 2.0
     
     # Memory flush config (独立于模型 context window)
     flush_token_threshold: int = 50000  # 50K tokens 触发 flush
@@ -66,6 +84,10 @@ class MemoryConfig:
         index_dir.mkdir(parents=True, exist_ok=True)
         return index_dir / "index.db"
     
+    def get_embedding_cache_path(self) -> Path:
+        """Get SQLite database path for the persistent embedding cache"""
+        return self.get_db_path().parent / "embedding_cache.db"
+    
     def get_skills_dir(self) -> Path:
         """Get skills directory"""
         return self.get_workspace() / "skills"
@@ -5,7 +5,9 @@ Design:
 - sessions table: per-session metadata (channel_type, last_active, msg_count)
 - messages table: individual messages stored as JSON, append-only
 - Pruning: age-based only (sessions not updated within N days are deleted)
-- Thread-safe via a single in-process lock
+- Concurrency: reads use long-lived per-thread connections (WAL, no global
+  lock); writes are funnelled through a single writer thread that group-
+  commits whatever is queued in one transaction
 
 Storage path: ~/cow/sessions/conversations.db
 """
@@ -13,11 +15,13 @@ Storage path: ~/cow/sessions/conversations.db
 from __future__ import annotations
 
 import json
+import queue
 import sqlite3
 import threading
 import time
+from collections import OrderedDict
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional
 
 from common.log import logger
 
@@ -42,6 +46,7 @@ CREATE TABLE IF NOT EXISTS messages (
     role         TEXT    NOT NULL,
     content      TEXT    NOT NULL,
     created_at   INTEGER NOT NULL,
+    is_visible_turn INTEGER,
     UNIQUE (session_id, seq)
 );
 
@@ -57,8 +62,34 @@ _MIGRATION_ADD_CHANNEL_TYPE = """
 ALTER TABLE sessions ADD COLUMN channel_type TEXT NOT NULL DEFAULT '';
 """
 
+# Migration: per-message visible-turn flag (NULL = not yet backfilled).
+_MIGRATION_ADD_VISIBLE_TURN = """
+ALTER TABLE messages ADD COLUMN is_visible_turn INTEGER;
+"""
+
+# Covering index for finding the turn cutoff without touching message bodies.
+_VISIBLE_TURN_INDEX = """
+CREATE INDEX IF NOT EXISTS idx_messages_visible_turn
+    ON messages (session_id, is_visible_turn, seq);
+"""
+
+_BACKFILL_BATCH = 1000
+
 DEFAULT_MAX_AGE_DAYS: int = 30
 
+# Upper bound on write jobs folded into one group commit
+_MAX_GROUP_COMMIT = 256
+
+# Sessions whose next seq is kept in memory by the writer
+_SEQ_CACHE_SIZE = 10000
+
+# Retention pruning: bounds per delete transaction
+_PRUNE_CHUNK_SESSIONS = 100
+_PRUNE_CHUNK_MESSAGES = 5000
+
+# Pages released per incremental_vacuum step
+_VACUUM_CHUNK_PAGES = 2000
+
 
 def _is_visible_user_message(content: Any) -> bool:
     """
@@ -232,8 +263,30 @@ class ConversationStore:
 
     def __init__(self, db_path: Path):
         self._db_path = db_path
-        self._lock = threading.Lock()
+        self._local = threading.local()
+        # thread ident -> (thread, connection), so close() and dead-thread
+        # pruning can reach every reader connection
+        self._readers: Dict[int, tuple] = {}
+        self._readers_lock = threading.Lock()
+        self._write_queue: "queue.Queue[Optional[_WriteJob]]" = queue.Queue()
+        # session_id -> next seq; only touched on the writer thread
+        self._seq_cache: "OrderedDict[str, int]" = OrderedDict()
+        self._closed = False
+        self._visible_backfilled = True
+        self._cleanup_thread: Optional[threading.Thread] = None
+        self._cleanup_stop = threading.Event()
+        self.last_cleanup: Optional[Dict[str, Any]] = None
         self._init_db()
+        self._writer = threading.Thread(
+            target=self._writer_loop, name="conversation-store-writer", daemon=True
+        )
+        self._writer.start()
+        if not self._visible_backfilled:
+            threading.Thread(
+                target=self._backfill_visible_turns,
+                name="conversation-store-backfill",
+                daemon=True,
+            ).start()
 
     # ------------------------------------------------------------------
     # Public API
@@ -261,20 +314,65 @@ class ConversationStore:
         Returns:
             Chronologically ordered list of message dicts (role, content).
         """
-        with self._lock:
-            conn = self._connect()
+        if not self._visible_backfilled:
+            return self._load_messages_scan(session_id, max_turns)
+
+        conn = self._reader()
+        # Only the newest max_turns + 1 visible user messages are needed to
+        # tell whether the session has more than max_turns visible turns.
+        visible_turn_seqs = [
+            seq for (seq,) in conn.execute(
+                """
+                SELECT seq FROM messages
+                WHERE session_id = ? AND is_visible_turn = 1
+                ORDER BY seq DESC
+                LIMIT ?
+                """,
+                (session_id, max(max_turns, 0) + 1),
+            )
+        ]
+        # Same cut point as _load_messages_scan: with at most max_turns visible
+        # turns keep everything, otherwise start at the Nth newest visible user
+        # message.
+        # IMPORTANT: we start exactly at the cutoff (a visible user message),
+        # never mid-group, so tool_use / tool_result pairs are always complete.
+        if len(visible_turn_seqs) <= max_turns:
+            cutoff_seq = -1  # keep all
+        else:
+            cutoff_seq = visible_turn_seqs[max(max_turns, 1) - 1]
+        rows = conn.execute(
+            """
+            SELECT role, content
+            FROM messages
+            WHERE session_id = ? AND seq >= ?
+            ORDER BY seq ASC
+            """,
+            (session_id, cutoff_seq),
+        ).fetchall()
+
+        result = []
+        for role, raw_content in rows:
             try:
-                rows = conn.execute(
-                    """
-                    SELECT seq, role, content
-                    FROM messages
-                    WHERE session_id = ?
-                    ORDER BY seq DESC
-                    """,
-                    (session_id,),
-                ).fetchall()
-            finally:
-                conn.close()
+                content = json.loads(raw_content)
+            except Exception:
+                content = raw_content
+            result.append({"role": role, "content": content})
+        return result
+
+    def _load_messages_scan(self, session_id: str, max_turns: int) -> List[Dict[str, Any]]:
+        """
+        load_messages for databases whose visible-turn flags are still being
+        backfilled: scan the whole session and classify messages on the fly.
+        """
+        rows = self._reader().execute(
+            """
+            SELECT seq, role, content
+            FROM messages
+            WHERE session_id = ?
+            ORDER BY seq DESC
+            """,
+            (session_id,),
+        ).fetchall()
 
         if not rows:
             return []
@@ -293,17 +391,11 @@ class ConversationStore:
             if _is_visible_user_message(content):
                 visible_turn_seqs.append(seq)
 
-        # Determine the seq of the oldest visible user message we want to keep.
-        # If the total turns fit within max_turns, keep everything.
         if len(visible_turn_seqs) <= max_turns:
             cutoff_seq = None  # keep all
         else:
-            # The Nth visible user message (0-indexed) is the oldest we keep.
-            cutoff_seq = visible_turn_seqs[max_turns - 1]
+            cutoff_seq = visible_turn_seqs[max(max_turns, 1) - 1]
 
-        # Build result in chronological order, starting from cutoff.
-        # IMPORTANT: we start exactly at cutoff_seq (the visible user message),
-        # never mid-group, so tool_use / tool_result pairs are always complete.
         result = []
         for seq, role, raw_content in reversed(rows):
             if cutoff_seq is not None and seq < cutoff_seq:
@@ -337,82 +429,105 @@ class ConversationStore:
             return
 
         now = int(time.time())
-        with self._lock:
-            conn = self._connect()
-            try:
-                with conn:
-                    # INSERT OR IGNORE creates the row on first visit;
-                    # the UPDATE always refreshes last_active.
-                    # Avoids ON CONFLICT...DO UPDATE (requires SQLite >= 3.24).
-                    conn.execute(
+
+        rows = []
+        for msg in messages:
+            role = msg.get("role", "")
+            raw = msg.get("content", "")
+            visible = int(role == "user" and _is_visible_user_message(raw))
+            rows.append((role, json.dumps(raw, ensure_ascii=False), visible))
+
+        def write(conn: sqlite3.Connection) -> None:
+            # INSERT OR IGNORE creates the row on first visit.
+            # Avoids ON CONFLICT...DO UPDATE (requires SQLite >= 3.24).
+            conn.execute(
+                """
+                INSERT OR IGNORE INTO sessions
+                    (session_id, channel_type, created_at, last_active, msg_count)
+                VALUES (?, ?, ?, ?, 0)
+                """,
+                (session_id, channel_type, now, now),
+            )
+
+            # A cached seq can be stale if another process wrote to this
+            # session. On a collision the batch is rolled back, MAX(seq) is
+            # re-read and the same batch is inserted again; nothing is dropped.
+            for attempt in range(2):
+                start_seq = self._next_seq(conn, session_id)
+                conn.execute("SAVEPOINT append_messages")
+                try:
+                    conn.executemany(
                         """
-                        INSERT OR IGNORE INTO sessions
-                            (session_id, channel_type, created_at, last_active, msg_count)
-                        VALUES (?, ?, ?, ?, 0)
+                        INSERT INTO messages
+                            (session_id, seq, role, content, created_at, is_visible_turn)
+                        VALUES (?, ?, ?, ?, ?, ?)
                         """,
-                        (session_id, channel_type, now, now),
+                        [
+                            (session_id, start_seq + i, role, content, now, visible)
+                            for i, (role, content, visible) in enumerate(rows)
+                        ],
                     )
-                    conn.execute(
-                        "UPDATE sessions SET last_active = ? WHERE session_id = ?",
-                        (now, session_id),
+                except sqlite3.IntegrityError:
+                    conn.execute("ROLLBACK TO append_messages")
+                    conn.execute("RELEASE append_messages")
+                    self._seq_cache.pop(session_id, None)
+                    if attempt:
+                        raise
+                    logger.warning(
+                        f"[ConversationStore] Stale seq for session {session_id}, "
+                        f"retrying append of {len(rows)} messages"
                     )
+                    continue
+                conn.execute("RELEASE append_messages")
+                break
+            self._seq_cache[session_id] = start_seq + len(rows)
+
+            conn.execute(
+                """
+                UPDATE sessions
+                SET last_active = ?, msg_count = msg_count + ?
+                WHERE session_id = ?
+                """,
+                (now, len(rows), session_id),
+            )
 
-                    # Determine starting seq for the new batch.
-                    row = conn.execute(
-                        "SELECT COALESCE(MAX(seq), -1) FROM messages WHERE session_id = ?",
-                        (session_id,),
-                    ).fetchone()
-                    next_seq = row[0] + 1
-
-                    for msg in messages:
-                        role = msg.get("role", "")
-                        content = json.dumps(
-                            msg.get("content", ""), ensure_ascii=False
-                        )
-                        conn.execute(
-                            """
-                            INSERT OR IGNORE INTO messages
-                                (session_id, seq, role, content, created_at)
-                            VALUES (?, ?, ?, ?, ?)
-                            """,
-                            (session_id, next_seq, role, content, now),
-                        )
-                        next_seq += 1
-
-                    conn.execute(
-                        """
-                        UPDATE sessions
-                        SET msg_count = (
-                            SELECT COUNT(*) FROM messages WHERE session_id = ?
-                        )
-                        WHERE session_id = ?
-                        """,
-                        (session_id, session_id),
-                    )
-            finally:
-                conn.close()
+        self._write(write)
 
     def clear_session(self, session_id: str) -> None:
         """Delete all messages and the session record for a given session_id."""
-        with self._lock:
-            conn = self._connect()
-            try:
-                with conn:
-                    conn.execute(
-                        "DELETE FROM messages WHERE session_id = ?", (session_id,)
-                    )
-                    conn.execute(
-                        "DELETE FROM sessions WHERE session_id = ?", (session_id,)
-                    )
-            finally:
-                conn.close()
+        def write(conn: sqlite3.Connection) -> None:
+            conn.execute(
+                "DELETE FROM messages WHERE session_id = ?", (session_id,)
+            )
+            conn.execute(
+                "DELETE FROM sessions WHERE session_id = ?", (session_id,)
+            )
+            self._seq_cache.pop(session_id, None)
+
+        self._write(write)
 
-    def cleanup_old_sessions(self, max_age_days: Optional[int] = None) -> int:
+    def cleanup_old_sessions(
+        self,
+        max_age_days: Optional[int] = None,
+        chunk_sessions: int = _PRUNE_CHUNK_SESSIONS,
+        chunk_messages: int = _PRUNE_CHUNK_MESSAGES,
+        vacuum: bool = True,
+    ) -> int:
         """
         Delete sessions that have not been active within max_age_days.
 
+        Deletion is set-based and chunked: each chunk removes up to
+        chunk_sessions sessions (and at most roughly chunk_messages messages)
+        in its own short write transaction, so chat writes queued in between
+        are committed without waiting for the whole prune.
+
         Args:
             max_age_days: Override the default retention period.
+            chunk_sessions: Maximum sessions deleted per transaction.
+            chunk_messages: Soft cap on messages deleted per transaction
+                (a single larger session is still deleted atomically).
+            vacuum: Reclaim freed pages with incremental vacuum when the
+                database uses auto_vacuum=INCREMENTAL.
 
         Returns:
             Number of sessions deleted.
@@ -426,31 +541,84 @@ class ConversationStore:
             max_age = max_age_days or DEFAULT_MAX_AGE_DAYS
 
         cutoff = int(time.time()) - max_age * 86400
-        deleted = 0
-
-        with self._lock:
-            conn = self._connect()
-            try:
-                with conn:
-                    stale = conn.execute(
-                        "SELECT session_id FROM sessions WHERE last_active < ?",
-                        (cutoff,),
-                    ).fetchall()
-                    for (sid,) in stale:
-                        conn.execute(
-                            "DELETE FROM messages WHERE session_id = ?", (sid,)
-                        )
-                        conn.execute(
-                            "DELETE FROM sessions WHERE session_id = ?", (sid,)
-                        )
-                        deleted += 1
-            finally:
-                conn.close()
-
+        started = time.time()
+
+        def prune_chunk(conn: sqlite3.Connection) -> tuple:
+            # Served by idx_sessions_last_active
+            candidates = conn.execute(
+                """
+                SELECT session_id, msg_count FROM sessions
+                WHERE last_active < ?
+                ORDER BY last_active
+                LIMIT ?
+                """,
+                (cutoff, chunk_sessions),
+            ).fetchall()
+            ids: List[str] = []
+            budget = 0
+            for sid, msg_count in candidates:
+                if ids and budget + msg_count > chunk_messages:
+                    break
+                ids.append(sid)
+                budget += msg_count
+            if not ids:
+                return 0, 0
+            placeholders = ",".join("?" * len(ids))
+            messages = conn.execute(
+                f"DELETE FROM messages WHERE session_id IN ({placeholders})", ids
+            ).rowcount
+            conn.execute(
+                f"DELETE FROM sessions WHERE session_id IN ({placeholders})", ids
+            )
+            for sid in ids:
+                self._seq_cache.pop(sid, None)
+            return len(ids), messages
+
+        deleted = deleted_messages = 0
+        while not self._closed:
+            sessions, messages = self._write(prune_chunk)
+            if not sessions:
+                break
+            deleted += sessions
+            deleted_messages += messages
+
+        vacuumed = self._incremental_vacuum() if vacuum and deleted else 0
+
+        self.last_cleanup = {
+            "finished_at": int(time.time()),
+            "sessions_deleted": deleted,
+            "messages_deleted": deleted_messages,
+            "pages_vacuumed": vacuumed,
+            "duration_ms": int((time.time() - started) * 1000),
+        }
         if deleted:
-            logger.info(f"[ConversationStore] Pruned {deleted} expired sessions")
+            logger.info(
+                f"[ConversationStore] Pruned {deleted} expired sessions "
+                f"({deleted_messages} messages) in {self.last_cleanup['duration_ms']}ms"
+            )
         return deleted
 
+    def start_cleanup_scheduler(self, interval_hours: float = 24) -> None:
+        """
+        Run cleanup_old_sessions periodically on a daemon thread.
+
+        Results of the latest run are exposed via get_stats()["cleanup"].
+        """
+        if self._cleanup_thread is not None or interval_hours <= 0:
+            return
+
+        def loop() -> None:
+            while not self._cleanup_stop.wait(interval_hours * 3600):
+                try:
+                    self.cleanup_old_sessions()
+                except Exception as e:
+                    logger.warning(f"[ConversationStore] Scheduled cleanup failed: {e}")
+
+        self._cleanup_thread = threading.Thread(
+            target=loop, name="conversation-store-cleanup", daemon=True
+        )
+        self._cleanup_thread.start()
+
     def load_history_page(
         self,
         session_id: str,
@@ -489,20 +657,15 @@ class ConversationStore:
             }
         """
         page = max(1, page)
-        with self._lock:
-            conn = self._connect()
-            try:
-                rows = conn.execute(
-                    """
-                    SELECT role, content, created_at
-                    FROM messages
-                    WHERE session_id = ?
-                    ORDER BY seq ASC
-                    """,
-                    (session_id,),
-                ).fetchall()
-            finally:
-                conn.close()
+        rows = self._reader().execute(
+            """
+            SELECT role, content, created_at
+            FROM messages
+            WHERE session_id = ?
+            ORDER BY seq ASC
+            """,
+            (session_id,),
+        ).fetchall()
 
         visible = _group_into_display_turns(rows)
 
@@ -521,30 +684,43 @@ class ConversationStore:
 
     def get_stats(self) -> Dict[str, Any]:
         """Return basic stats keyed by channel_type, for monitoring."""
-        with self._lock:
-            conn = self._connect()
-            try:
-                total_sessions = conn.execute(
-                    "SELECT COUNT(*) FROM sessions"
-                ).fetchone()[0]
-                total_messages = conn.execute(
-                    "SELECT COUNT(*) FROM messages"
-                ).fetchone()[0]
-                by_channel = conn.execute(
-                    """
-                    SELECT channel_type, COUNT(*) as cnt
-                    FROM sessions
-                    GROUP BY channel_type
-                    ORDER BY cnt DESC
-                    """
-                ).fetchall()
-                return {
-                    "total_sessions": total_sessions,
-                    "total_messages": total_messages,
-                    "by_channel": {row[0] or "unknown": row[1] for row in by_channel},
-                }
-            finally:
-                conn.close()
+        conn = self._reader()
+        total_sessions = conn.execute(
+            "SELECT COUNT(*) FROM sessions"
+        ).fetchone()[0]
+        total_messages = conn.execute(
+            "SELECT COUNT(*) FROM messages"
+        ).fetchone()[0]
+        by_channel = conn.execute(
+            """
+            SELECT channel_type, COUNT(*) as cnt
+            FROM sessions
+            GROUP BY channel_type
+            ORDER BY cnt DESC
+            """
+        ).fetchall()
+        return {
+            "total_sessions": total_sessions,
+            "total_messages": total_messages,
+            "by_channel": {row[0] or "unknown": row[1] for row in by_channel},
+            "cleanup": self.last_cleanup,
+        }
+
+    def close(self) -> None:
+        """Stop the writer thread (after draining queued writes) and close connections."""
+        if self._closed:
+            return
+        self._closed = True
+        self._cleanup_stop.set()
+        self._write_queue.put(None)
+        self._writer.join(timeout=10)
+        with self._readers_lock:
+            for _, conn in self._readers.values():
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            self._readers.clear()
 
     # ------------------------------------------------------------------
     # Internal helpers
@@ -552,6 +728,16 @@ class ConversationStore:
 
     def _init_db(self) -> None:
         self._db_path.parent.mkdir(parents=True, exist_ok=True)
+        # auto_vacuum can only be chosen before the database is first written
+        # (here: before switching to WAL); existing databases keep their mode,
+        # converting them would take a full VACUUM.
+        if not self._db_path.exists() or self._db_path.stat().st_size == 0:
+            bootstrap = sqlite3.connect(str(self._db_path), timeout=10)
+            try:
+                bootstrap.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                bootstrap.execute("PRAGMA journal_mode=WAL")
+            finally:
+                bootstrap.close()
         conn = self._connect()
         try:
             conn.executescript(_DDL)
@@ -574,12 +760,214 @@ class ConversationStore:
             except Exception as e:
                 logger.warning(f"[ConversationStore] Migration failed: {e}")
 
+        msg_cols = {
+            row[1]
+            for row in conn.execute("PRAGMA table_info(messages)").fetchall()
+        }
+        if "is_visible_turn" not in msg_cols:
+            conn.execute(_MIGRATION_ADD_VISIBLE_TURN)
+            logger.info("[ConversationStore] Migrated: added is_visible_turn column")
+        conn.execute(_VISIBLE_TURN_INDEX)
+
+        # Rows written before the column existed are classified in the background
+        # (see _backfill_visible_turns); until then load_messages scans.
+        pending = conn.execute(
+            "SELECT 1 FROM messages WHERE is_visible_turn IS NULL LIMIT 1"
+        ).fetchone()
+        self._visible_backfilled = pending is None
+
+    def _incremental_vacuum(self) -> int:
+        """
+        Release free pages in small steps; no-op unless auto_vacuum=INCREMENTAL.
+
+        Runs on its own connection rather than the writer thread: the pragma
+        only completes when stepped to the end (executescript), which would
+        commit the writer's open group transaction. Each step holds the
+        write lock only briefly; the writer waits on busy_timeout meanwhile.
+        """
+        conn = self._connect()
+        released = 0
+        try:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                return 0
+            while not self._closed:
+                free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                if not free:
+                    break
+                conn.executescript(f"PRAGMA incremental_vacuum({_VACUUM_CHUNK_PAGES});")
+                released += min(free, _VACUUM_CHUNK_PAGES)
+        finally:
+            conn.close()
+        return released
+
+    def _backfill_visible_turns(self) -> None:
+        """Fill is_visible_turn for legacy rows, one short write job per batch."""
+
+        def step(conn: sqlite3.Connection, after_id: int) -> int:
+            rows = conn.execute(
+                """
+                SELECT id, role, content FROM messages
+                WHERE id > ? AND is_visible_turn IS NULL
+                ORDER BY id
+                LIMIT ?
+                """,
+                (after_id, _BACKFILL_BATCH),
+            ).fetchall()
+            updates = []
+            for msg_id, role, raw_content in rows:
+                visible = False
+                if role == "user":
+                    try:
+                        content = json.loads(raw_content)
+                    except Exception:
+                        content = raw_content
+                    visible = _is_visible_user_message(content)
+                updates.append((int(visible), msg_id))
+            conn.executemany(
+                "UPDATE messages SET is_visible_turn = ? WHERE id = ?", updates
+            )
+            return (rows[-1][0] if rows else -1), len(rows)
+
+        last_id, total = 0, 0
+        try:
+            while not self._closed:
+                next_id, count = self._write(lambda conn, after=last_id: step(conn, after))
+                total += count
+                if next_id < 0:
+                    self._visible_backfilled = True
+                    logger.info(
+                        f"[ConversationStore] Backfilled visible-turn flags ({total} rows)"
+                    )
+                    break
+                last_id = next_id
+        except Exception as e:
+            logger.warning(f"[ConversationStore] Visible-turn backfill stopped: {e}")
+
     def _connect(self) -> sqlite3.Connection:
-        conn = sqlite3.connect(str(self._db_path), timeout=10)
+        # Connections are long-lived, so sqlite3's per-connection statement
+        # cache keeps the prepared statements warm across calls.
+        conn = sqlite3.connect(
+            str(self._db_path),
+            timeout=10,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=256,
+        )
         conn.execute("PRAGMA journal_mode=WAL")
         conn.execute("PRAGMA synchronous=NORMAL")
         return conn
 
+    def _reader(self) -> sqlite3.Connection:
+        """Return this thread's read connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+        conn = self._connect()
+        self._local.conn = conn
+        with self._readers_lock:
+            # Close connections of threads that have exited
+            for ident, (thread, old_conn) in list(self._readers.items()):
+                if not thread.is_alive():
+                    try:
+                        old_conn.close()
+                    except Exception:
+                        pass
+                    del self._readers[ident]
+            self._readers[threading.get_ident()] = (threading.current_thread(), conn)
+        return conn
+
+    def _write(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Run fn(conn) on the writer thread and wait until it is committed."""
+        if self._closed:
+            raise RuntimeError("ConversationStore is closed")
+        job = _WriteJob(fn)
+        self._write_queue.put(job)
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def _next_seq(self, conn: sqlite3.Connection, session_id: str) -> int:
+        """Next seq for a session, from the writer's cache or MAX(seq) on a miss."""
+        seq = self._seq_cache.get(session_id)
+        if seq is not None:
+            self._seq_cache.move_to_end(session_id)
+            return seq
+        row = conn.execute(
+            "SELECT COALESCE(MAX(seq), -1) FROM messages WHERE session_id = ?",
+            (session_id,),
+        ).fetchone()
+        seq = row[0] + 1
+        self._seq_cache[session_id] = seq
+        if len(self._seq_cache) > _SEQ_CACHE_SIZE:
+            self._seq_cache.popitem(last=False)
+        return seq
+
+    def _writer_loop(self) -> None:
+        """
+        Single writer: drain the queue and group-commit each batch.
+
+        Every job runs inside its own SAVEPOINT so a failing job is rolled
+        back alone without discarding the other writes in the batch.
+        """
+        conn = self._connect()
+        stopping = False
+        try:
+            while not stopping:
+                job = self._write_queue.get()
+                if job is None:
+                    break
+                batch = [job]
+                while len(batch) < _MAX_GROUP_COMMIT:
+                    try:
+                        job = self._write_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if job is None:
+                        stopping = True
+                        break
+                    batch.append(job)
+                self._commit_batch(conn, batch)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _commit_batch(conn: sqlite3.Connection, batch: List["_WriteJob"]) -> None:
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for job in batch:
+                conn.execute("SAVEPOINT write_job")
+                try:
+                    job.result = job.fn(conn)
+                    conn.execute("RELEASE write_job")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write_job")
+                    conn.execute("RELEASE write_job")
+                    job.error = e
+            conn.execute("COMMIT")
+        except Exception as e:
+            logger.error(f"[ConversationStore] Group commit failed: {e}")
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for job in batch:
+                if job.error is None:
+                    job.error = e
+        finally:
+            for job in batch:
+                job.done.set()
+
+
+class _WriteJob:
+    """A unit of work for the writer thread."""
+
+    __slots__ = ("fn", "done", "result", "error")
+
+    def __init__(self, fn: Callable[[sqlite3.Connection], Any]):
+        self.fn = fn
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
 
 # ---------------------------------------------------------------------------
 # Singleton
@@ -615,4 +1003,11 @@ def get_conversation_store() -> ConversationStore:
 
         _store_instance = ConversationStore(db_path)
         logger.debug(f"[ConversationStore] Using shared DB at: {db_path}")
+
+        try:
+            from config import conf
+            interval = conf().get("conversation_cleanup_interval_hours", 24)
+        except Exception:
+            interval = 24
+        _store_instance.start_cleanup_scheduler(interval)
         return _store_instance
@@ -5,8 +5,25 @@ Supports OpenAI and local embedding models
 """
 
 import hashlib
+import sqlite3
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import List, Optional
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+class EmbeddingAPIError(ValueError):
+    """Embedding API request failed; retryable for rate limits and server errors"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        return self.status_code == 429 or (self.status_code is not None and self.status_code >= 500)
 
 
 class EmbeddingProvider(ABC):
@@ -75,12 +92,18 @@ class OpenAIEmbeddingProvider(EmbeddingProvider):
         except requests.exceptions.Timeout as e:
             raise TimeoutError(f"OpenAI API request timed out after 10s. Please check your network connection. Error: {str(e)}")
         except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 401:
-                raise ValueError(f"Invalid OpenAI API key. Please check your 'open_ai_api_key' in config.json")
-            elif e.response.status_code == 429:
-                raise ValueError(f"OpenAI API rate limit exceeded. Please try again later.")
+            status = e.response.status_code
+            if status == 401:
+                raise EmbeddingAPIError(f"Invalid OpenAI API key. Please check your 'open_ai_api_key' in config.json", status)
+            elif status == 429:
+                retry_after = e.response.headers.get("Retry-After")
+                try:
+                    retry_after = float(retry_after) if retry_after else None
+                except ValueError:
+                    retry_after = None
+                raise EmbeddingAPIError(f"OpenAI API rate limit exceeded. Please try again later.", status, retry_after)
             else:
-                raise ValueError(f"OpenAI API request failed: {e.response.status_code} - {e.response.text}")
+                raise EmbeddingAPIError(f"OpenAI API request failed: {status} - {e.response.text}", status)
 
     def embed(self, text: str) -> List[float]:
         """Generate embedding for text"""
@@ -104,30 +127,191 @@ class OpenAIEmbeddingProvider(EmbeddingProvider):
 
 
 class EmbeddingCache:
-    """Cache for embeddings to avoid recomputation"""
+    """
+    Persistent, size-bounded cache for embeddings
 
-    def __init__(self):
-        self.cache = {}
+    Entries are keyed by a hash of (provider, model, text) and stored in a
+    SQLite table as float32 blobs. When the cache grows past max_entries the
+    least recently used entries are evicted.
+    """
+
+    def __init__(self, db_path: Optional[Path] = None, max_entries: int = 50000):
+        """
+        Initialize embedding cache
+
+        Args:
+            db_path: SQLite file for the cache (in-memory if not provided)
+            max_entries: Maximum number of cached embeddings
+        """
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(str(db_path) if db_path else ":memory:", check_same_thread=False)
+        if db_path:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                key TEXT PRIMARY KEY,
+                embedding BLOB NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self.conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_embedding_cache_access
+            ON embedding_cache(last_access)
+        """)
+        self.conn.commit()
+        self._count = self.conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
 
     def get(self, text: str, provider: str, model: str) -> Optional[List[float]]:
         """Get cached embedding"""
-        key = self._compute_key(text, provider, model)
-        return self.cache.get(key)
-    
+        return self.get_many([text], provider, model)[0]
+
     def put(self, text: str, provider: str, model: str, embedding: List[float]):
         """Cache embedding"""
-        key = self._compute_key(text, provider, model)
-        self.cache[key] = embedding
-    
+        self.put_many([text], provider, model, [embedding])
+
+    def get_many(self, texts: List[str], provider: str, model: str) -> List[Optional[List[float]]]:
+        """Look up several texts at once; missing entries are None"""
+        if not texts:
+            return []
+        from agent.memory.storage import decode_embedding
+
+        keys = [self._compute_key(text, provider, model) for text in texts]
+        found = {}
+        with self._lock:
+            unique = list(set(keys))
+            for start in range(0, len(unique), 500):
+                part = unique[start:start + 500]
+                placeholders = ','.join('?' * len(part))
+                for key, blob in self.conn.execute(f"""
+                    SELECT key, embedding FROM embedding_cache WHERE key IN ({placeholders})
+                """, part):
+                    found[key] = blob
+            if found:
+                now = time.time()
+                self.conn.executemany("""
+                    UPDATE embedding_cache SET last_access = ? WHERE key = ?
+                """, [(now, key) for key in found])
+                self.conn.commit()
+
+            results = []
+            for key in keys:
+                blob = found.get(key)
+                if blob is None:
+                    self.misses += 1
+                    results.append(None)
+                else:
+                    self.hits += 1
+                    embedding = decode_embedding(blob)
+                    results.append(embedding if isinstance(embedding, list) else embedding.tolist())
+            return results
+
+    def put_many(self, texts: List[str], provider: str, model: str, embeddings: List[List[float]]):
+        """Cache several embeddings at once"""
+        from agent.memory.storage import encode_embedding
+
+        now = time.time()
+        rows = {
+            self._compute_key(text, provider, model): encode_embedding(embedding)
+            for text, embedding in zip(texts, embeddings)
+            if embedding
+        }
+        if not rows:
+            return
+        with self._lock:
+            existing = 0
+            keys = list(rows)
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                placeholders = ','.join('?' * len(part))
+                existing += self.conn.execute(f"""
+                    SELECT COUNT(*) FROM embedding_cache WHERE key IN ({placeholders})
+                """, part).fetchone()[0]
+            self.conn.executemany("""
+                INSERT OR REPLACE INTO embedding_cache (key, embedding, last_access)
+                VALUES (?, ?, ?)
+            """, [(key, blob, now) for key, blob in rows.items()])
+            self.conn.commit()
+            self._count += len(rows) - existing
+            if self._count > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        """Drop least recently used entries down to 90% of capacity"""
+        excess = self._count - int(self.max_entries * 0.9)
+        self.conn.execute("""
+            DELETE FROM embedding_cache WHERE key IN (
+                SELECT key FROM embedding_cache ORDER BY last_access LIMIT ?
+            )
+        """, (excess,))
+        self.conn.commit()
+        self.evictions += excess
+        self._count -= excess
+
+    def get_stats(self) -> Dict[str, int]:
+        """Get cache statistics"""
+        return {
+            'entries': self._count,
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
     @staticmethod
     def _compute_key(text: str, provider: str, model: str) -> str:
         """Compute cache key"""
         content = f"{provider}:{model}:{text}"
-        return hashlib.md5(content.encode('utf-8')).hexdigest()
-    
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
     def clear(self):
         """Clear cache"""
-        self.cache.clear()
+        with self._lock:
+            self.conn.execute("DELETE FROM embedding_cache")
+            self.conn.commit()
+            self._count = 0
+
+    def close(self):
+        """Close cache database"""
+        with self._lock:
+            if self.conn:
+                self.conn.close()
+                self.conn = None
+
+
+class CachedEmbeddingProvider(EmbeddingProvider):
+    """Embedding provider wrapper that consults an EmbeddingCache first"""
+
+    def __init__(self, provider: EmbeddingProvider, cache: EmbeddingCache, provider_name: str, model: str):
+        self.provider = provider
+        self.cache = cache
+        self.provider_name = provider_name
+        self.model = model
+
+    def embed(self, text: str) -> List[float]:
+        """Generate embedding for text, reusing a cached one when possible"""
+        return self.embed_batch([text])[0]
+
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Generate embeddings, only calling the provider for uncached texts"""
+        if not texts:
+            return []
+        results = self.cache.get_many(texts, self.provider_name, self.model)
+        missing = list(dict.fromkeys(text for text, emb in zip(texts, results) if emb is None))
+        if missing:
+            embedded = dict(zip(missing, self.provider.embed_batch(missing)))
+            self.cache.put_many(missing, self.provider_name, self.model, [embedded[t] for t in missing])
+            results = [emb if emb is not None else embedded[text] for text, emb in zip(texts, results)]
+        return results
+
+    @property
+    def dimensions(self) -> int:
+        return self.provider.dimensions
 
 
 def create_embedding_provider(
@@ -0,0 +1,190 @@
+"""
+Batched, concurrent embedding pipeline for memory indexing
+
+Coalesces texts from many files into request-sized batches, runs several
+requests concurrently under requests/tokens-per-minute limits, retries
+transient failures with exponential backoff, and yields results batch by
+batch so they can be saved as soon as they arrive.
+"""
+
+from __future__ import annotations
+import asyncio
+import random
+import time
+from typing import Any, AsyncIterator, List, Optional, Sequence, Tuple
+
+from agent.memory.embedding import EmbeddingProvider, EmbeddingAPIError
+from common.log import logger
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 chars per token, same as TextChunker)"""
+    return len(text) // 4 + 1
+
+
+class RateLimiter:
+    """
+    Async requests-per-minute and tokens-per-minute limiter
+
+    Continuous token bucket: allowances refill proportionally to elapsed
+    time, starting full, so short bursts up to one minute's quota pass
+    immediately.
+    """
+
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last
+        self._last = now
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    async def acquire(self, tokens: int):
+        """Wait until one request carrying `tokens` tokens is allowed"""
+        tokens = min(tokens, self.tpm)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._requests >= 1 and self._tokens >= tokens:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return
+                wait = max(
+                    (1 - self._requests) * 60 / self.rpm,
+                    (tokens - self._tokens) * 60 / self.tpm
+                )
+                await asyncio.sleep(wait)
+
+
+class EmbeddingPipeline:
+    """
+    Embed many texts with batching, concurrency, rate limiting and retries
+
+    Usage:
+        pipeline = EmbeddingPipeline(provider, concurrency=4)
+        async for items, embeddings in pipeline.stream(items, texts):
+            save(items, embeddings)
+    """
+
+    def __init__(
+        self,
+        provider: EmbeddingProvider,
+        max_batch_size: int = 256,
+        max_batch_tokens: int = 100000,
+        concurrency: int = 4,
+        rpm: int = 3000,
+        tpm: int = 1000000,
+        max_retries: int = 5,
+        backoff_base: float = 1.0
+    ):
+        """
+        Initialize embedding pipeline
+
+        Args:
+            provider: Embedding provider (its embed_batch is run in worker threads)
+            max_batch_size: Maximum texts per request
+            max_batch_tokens: Maximum estimated tokens per request
+            concurrency: Maximum requests in flight
+            rpm: Requests per minute limit
+            tpm: Tokens per minute limit
+            max_retries: Retries per batch for transient errors
+            backoff_base: Base delay in seconds for exponential backoff
+        """
+        self.provider = provider
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.concurrency = concurrency
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+
+        self.requests = 0
+        self.retries = 0
+
+    def make_batches(self, texts: Sequence[str]) -> List[List[int]]:
+        """Group text indices into batches bounded by count and estimated tokens"""
+        batches = []
+        current: List[int] = []
+        current_tokens = 0
+        for i, text in enumerate(texts):
+            tokens = estimate_tokens(text)
+            if current and (len(current) >= self.max_batch_size
+                            or current_tokens + tokens > self.max_batch_tokens):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    async def stream(
+        self,
+        items: Sequence[Any],
+        texts: Sequence[str]
+    ) -> AsyncIterator[Tuple[List[Any], List[List[float]]]]:
+        """
+        Embed texts and yield (items, embeddings) per batch as batches finish
+
+        Args:
+            items: Caller objects, one per text, handed back with their embeddings
+            texts: Texts to embed
+
+        Raises:
+            The last error of a batch that still fails after all retries
+        """
+        if not texts:
+            return
+
+        limiter = RateLimiter(self.rpm, self.tpm)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(batch: List[int]):
+            batch_texts = [texts[i] for i in batch]
+            async with semaphore:
+                embeddings = await self._embed_with_retry(batch_texts, limiter)
+            return [items[i] for i in batch], embeddings
+
+        tasks = [asyncio.ensure_future(run(batch)) for batch in self.make_batches(texts)]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield await finished
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def embed_all(self, texts: Sequence[str]) -> List[List[float]]:
+        """Embed texts and return embeddings in input order"""
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        async for indices, embeddings in self.stream(range(len(texts)), texts):
+            for i, embedding in zip(indices, embeddings):
+                results[i] = embedding
+        return results
+
+    async def _embed_with_retry(self, texts: List[str], limiter: RateLimiter) -> List[List[float]]:
+        tokens = sum(estimate_tokens(t) for t in texts)
+        attempt = 0
+        while True:
+            await limiter.acquire(tokens)
+            self.requests += 1
+            try:
+                return await asyncio.to_thread(self.provider.embed_batch, texts)
+            except (ConnectionError, TimeoutError, EmbeddingAPIError) as e:
+                retryable = not isinstance(e, EmbeddingAPIError) or e.retryable
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                delay = self.backoff_base * (2 ** attempt) * (0.5 + random.random())
+                if isinstance(e, EmbeddingAPIError) and e.retry_after:
+                    delay = max(delay, e.retry_after)
+                attempt += 1
+                self.retries += 1
+                logger.debug(f"[EmbeddingPipeline] Retry {attempt}/{self.max_retries} in {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
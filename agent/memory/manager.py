@@ -5,6 +5,8 @@ Provides high-level interface for memory operations
 """
 
 import os
+import asyncio
+import threading
 from typing import List, Optional, Dict, Any
 from pathlib import Path
 import hashlib
@@ -12,8 +14,12 @@ from datetime import datetime, timedelta
 
 from agent.memory.config import MemoryConfig, get_default_memory_config
 from agent.memory.storage import MemoryStorage, MemoryChunk, SearchResult
+from agent.memory.vector_index import VectorIndex
 from agent.memory.chunker import TextChunker
-from agent.memory.embedding import create_embedding_provider, EmbeddingProvider
+from agent.memory.embedding import (
+    create_embedding_provider, EmbeddingProvider, EmbeddingCache, CachedEmbeddingProvider
+)
+from agent.memory.embedding_pipeline import EmbeddingPipeline
 from agent.memory.summarizer import MemoryFlushManager, create_memory_files_if_needed
 
 
@@ -42,7 +48,11 @@ class MemoryManager:
         
         # Initialize storage
         db_path = self.config.get_db_path()
-        self.storage = MemoryStorage(db_path)
+        self.storage = MemoryStorage(db_path, vector_index=VectorIndex(
+            mode=self.config.vector_index_mode,
+            ivf_threshold=self.config.vector_ivf_threshold,
+            nprobe=self.config.vector_ivf_nprobe
+        ), embedding_format=self.config.embedding_storage_format)
         
         # Initialize chunker
         self.chunker = TextChunker(
@@ -74,6 +84,34 @@ class MemoryManager:
                 logger.warning(f"[MemoryManager] Embedding provider initialization failed: {e}")
                 logger.info(f"[MemoryManager] Memory will work with keyword search only (no vector search)")
         
+        # Wrap provider with persistent cache so unchanged chunks and repeated
+        # queries are not re-embedded
+        self.embedding_cache = None
+        if self.embedding_provider and self.config.embedding_cache_enabled:
+            self.embedding_cache = EmbeddingCache(
+                db_path=self.config.get_embedding_cache_path(),
+                max_entries=self.config.embedding_cache_max_entries
+            )
+            self.embedding_provider = CachedEmbeddingProvider(
+                self.embedding_provider,
+                self.embedding_cache,
+                provider_name=self.config.embedding_provider,
+                model=getattr(self.embedding_provider, 'model', self.config.embedding_model)
+            )
+        
+        # Batched, concurrent embedding for indexing
+        self.embedding_pipeline = None
+        if self.embedding_provider:
+            self.embedding_pipeline = EmbeddingPipeline(
+                self.embedding_provider,
+                max_batch_size=self.config.embedding_batch_size,
+                max_batch_tokens=self.config.embedding_batch_tokens,
+                concurrency=self.config.embedding_concurrency,
+                rpm=self.config.embedding_rpm,
+                tpm=self.config.embedding_tpm,
+                max_retries=self.config.embedding_max_retries
+            )
+        
         # Initialize memory flush manager
         workspace_dir = self.config.get_workspace()
         self.flush_manager = MemoryFlushManager(
@@ -85,6 +123,26 @@ class MemoryManager:
         self._init_workspace()
         
         self._dirty = False
+        self.watcher = None
+        # Serializes full syncs and watcher-driven syncs on the shared connection
+        self._sync_lock = threading.Lock()
+    
+    @property
+    def watcher_running(self) -> bool:
+        return self.watcher is not None and self.watcher.running
+    
+    def start_watcher(self):
+        """
+        Start background sync of changed memory files
+        
+        Uses filesystem events via watchdog when installed, otherwise polls
+        file stats. No-op if watching is disabled in config.
+        """
+        if not self.config.watch_enabled or self.watcher_running:
+            return
+        from agent.memory.watcher import MemoryWatcher
+        self.watcher = MemoryWatcher(self, poll_interval=self.config.watch_poll_interval)
+        self.watcher.start()
     
     def _init_workspace(self):
         """Initialize workspace directories"""
@@ -101,7 +159,8 @@ class MemoryManager:
         user_id: Optional[str] = None,
         max_results: Optional[int] = None,
         min_score: Optional[float] = None,
-        include_shared: bool = True
+        include_shared: bool = True,
+        sync: bool = True
     ) -> List[SearchResult]:
         """
         Search memory with hybrid search (vector + keyword)
@@ -112,6 +171,7 @@ class MemoryManager:
             max_results: Maximum results to return
             min_score: Minimum score threshold
             include_shared: Include shared memories
+            sync: Sync a dirty index before searching (if sync_on_search is enabled)
             
         Returns:
             List of search results sorted by relevance
@@ -129,8 +189,8 @@ class MemoryManager:
         if not scopes:
             return []
         
-        # Sync if needed
-        if self.config.sync_on_search and self._dirty:
+        # Sync if needed (with a running watcher, changed files are synced in the background)
+        if sync and self.config.sync_on_search and self._dirty and not self.watcher_running:
             await self.sync()
         
         # Perform vector search (if embedding provider available)
@@ -254,89 +314,165 @@ class MemoryManager:
         Args:
             force: Force full reindex
         """
+        await asyncio.to_thread(self._run_locked, self._sync, force)
+    
+    async def sync_paths(self, paths: List[Path]):
+        """
+        Synchronize only the given memory files
+        
+        Used by the file watcher. Paths that no longer exist are removed
+        from the index.
+        
+        Args:
+            paths: Absolute paths of changed files
+        """
+        await asyncio.to_thread(self._run_locked, self._sync_paths, paths)
+    
+    def _run_locked(self, body, *args):
+        """
+        Run an async sync body on a private event loop while holding the sync lock
+        
+        Syncs are serialized with a threading lock because they come from
+        different threads and loops (watcher, tools, agent init). The lock is
+        only ever waited on in a worker thread, so a second sync or a search
+        on the caller's loop never blocks that loop.
+        """
+        with self._sync_lock:
+            return asyncio.run(body(*args))
+    
+    async def _sync(self, force: bool = False):
         memory_dir = self.config.get_memory_dir()
         workspace_dir = self.config.get_workspace()
         
+        plans = []
+        
         # Scan MEMORY.md (workspace root)
         memory_file = Path(workspace_dir) / "MEMORY.md"
         if memory_file.exists():
-            await self._sync_file(memory_file, "memory", "shared", None)
+            plans.append(self._plan_file_sync(memory_file, "memory", "shared", None, force))
         
         # Scan memory directory (including daily summaries)
         if memory_dir.exists():
             for file_path in memory_dir.rglob("*.md"):
-                # Determine scope and user_id from path
-                rel_path = file_path.relative_to(workspace_dir)
-                parts = rel_path.parts
-                
-                # Check if it's in daily summary directory
-                if "daily" in parts:
-                    # Daily summary files
-                    if "users" in parts or len(parts) > 3:
-                        # User-scoped daily summary: memory/daily/{user_id}/2024-01-29.md
-                        user_idx = parts.index("daily") + 1
-                        user_id = parts[user_idx] if user_idx < len(parts) else None
-                        scope = "user"
-                    else:
-                        # Shared daily summary: memory/daily/2024-01-29.md
-                        user_id = None
-                        scope = "shared"
-                elif "users" in parts:
-                    # User-scoped memory
-                    user_idx = parts.index("users") + 1
-                    user_id = parts[user_idx] if user_idx < len(parts) else None
-                    scope = "user"
-                else:
-                    # Shared memory
-                    user_id = None
-                    scope = "shared"
-                
-                await self._sync_file(file_path, "memory", scope, user_id)
+                scope, user_id = self._resolve_scope(file_path)
+                plans.append(self._plan_file_sync(file_path, "memory", scope, user_id, force))
+        
+        # Embed changed chunks of all files together
+        await self._apply_sync_plans([plan for plan in plans if plan])
         
         self._dirty = False
     
+    async def _sync_paths(self, paths: List[Path]):
+        workspace_dir = self.config.get_workspace()
+        workspace_resolved = workspace_dir.resolve()
+        plans = []
+        for path in paths:
+            try:
+                rel_path = Path(path).resolve().relative_to(workspace_resolved)
+            except ValueError:
+                continue
+            file_path = workspace_dir / rel_path
+            if file_path.exists():
+                if rel_path == Path("MEMORY.md"):
+                    scope, user_id = "shared", None
+                else:
+                    scope, user_id = self._resolve_scope(file_path)
+                plans.append(self._plan_file_sync(file_path, "memory", scope, user_id))
+            else:
+                self.storage.delete_by_path(str(rel_path))
+                self.storage.delete_file_metadata(str(rel_path))
+        await self._apply_sync_plans([plan for plan in plans if plan])
+    
+    def _resolve_scope(self, file_path: Path):
+        """Determine (scope, user_id) of a file under the memory directory"""
+        rel_path = file_path.relative_to(self.config.get_workspace())
+        parts = rel_path.parts
+        
+        # Check if it's in daily summary directory
+        if "daily" in parts:
+            # Daily summary files
+            if "users" in parts or len(parts) > 3:
+                # User-scoped daily summary: memory/daily/{user_id}/2024-01-29.md
+                user_idx = parts.index("daily") + 1
+                user_id = parts[user_idx] if user_idx < len(parts) else None
+                return "user", user_id
+            # Shared daily summary: memory/daily/2024-01-29.md
+            return "shared", None
+        if "users" in parts:
+            # User-scoped memory
+            user_idx = parts.index("users") + 1
+            user_id = parts[user_idx] if user_idx < len(parts) else None
+            return "user", user_id
+        # Shared memory
+        return "shared", None
+    
     async def _sync_file(
         self,
         file_path: Path,
         source: str,
         scope: str,
-        user_id: Optional[str]
+        user_id: Optional[str],
+        force: bool = False
     ):
-        """Sync a single file"""
-        # Compute file hash
-        content = file_path.read_text(encoding='utf-8')
-        file_hash = MemoryStorage.compute_hash(content)
+        """Sync a single file incrementally"""
+        plan = self._plan_file_sync(file_path, source, scope, user_id, force)
+        if plan:
+            await self._apply_sync_plans([plan])
+    
+    def _plan_file_sync(
+        self,
+        file_path: Path,
+        source: str,
+        scope: str,
+        user_id: Optional[str],
+        force: bool = False
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Work out what has to change in the index for a file
+        
+        Files whose mtime and size match the files table are skipped without
+        being read. Changed files are diffed chunk by chunk: unchanged chunks
+        are kept as-is, stale chunks are scheduled for deletion, and new
+        chunks reuse stored embeddings of identical text where possible.
         
-        # Get relative path
+        Returns:
+            Sync plan, or None if the file is unchanged
+        """
         workspace_dir = self.config.get_workspace()
         rel_path = str(file_path.relative_to(workspace_dir))
         
-        # Check if file changed
-        stored_hash = self.storage.get_file_hash(rel_path)
-        if stored_hash == file_hash:
-            return  # No changes
+        stat = file_path.stat()
+        stored = self.storage.get_file_metadata(rel_path)
+        if (not force and stored
+                and stored['mtime'] == stat.st_mtime_ns and stored['size'] == stat.st_size):
+            return None  # Untouched since last sync
         
-        # Delete old chunks
-        self.storage.delete_by_path(rel_path)
+        content = file_path.read_text(encoding='utf-8')
+        file_hash = MemoryStorage.compute_hash(content)
+        plan = {
+            'path': rel_path,
+            'source': source,
+            'hash': file_hash,
+            'mtime': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'stale_ids': [],
+            'chunks': []
+        }
+        if not force and stored and stored['hash'] == file_hash:
+            return plan  # Touched but identical, only refresh metadata
         
-        # Chunk and embed
         chunks = self.chunker.chunk_text(content)
-        if not chunks:
-            return
+        existing = self.storage.get_chunk_hashes(rel_path)
         
-        texts = [chunk.text for chunk in chunks]
-        if self.embedding_provider:
-            embeddings = self.embedding_provider.embed_batch(texts)
-        else:
-            embeddings = [None] * len(texts)
-        
-        # Create memory chunks
-        memory_chunks = []
-        for chunk, embedding in zip(chunks, embeddings):
+        # Diff chunks against what is already indexed
+        keep_ids = set()
+        for chunk in chunks:
             chunk_id = self._generate_chunk_id(rel_path, chunk.start_line, chunk.end_line)
             chunk_hash = MemoryStorage.compute_hash(chunk.text)
-            
-            memory_chunks.append(MemoryChunk(
+            keep_ids.add(chunk_id)
+            if not force and existing.get(chunk_id) == chunk_hash:
+                continue
+            plan['chunks'].append(MemoryChunk(
                 id=chunk_id,
                 user_id=user_id,
                 scope=scope,
@@ -345,23 +481,61 @@ class MemoryManager:
                 start_line=chunk.start_line,
                 end_line=chunk.end_line,
                 text=chunk.text,
-                embedding=embedding,
+                embedding=None,
                 hash=chunk_hash,
                 metadata=None
             ))
+        plan['stale_ids'] = [cid for cid in existing if cid not in keep_ids]
         
-        # Save
-        self.storage.save_chunks_batch(memory_chunks)
+        # Reuse embeddings of identical chunk text (e.g. shifted lines)
+        if self.embedding_provider and plan['chunks'] and not force:
+            reusable = self.storage.get_embeddings_by_hash(
+                rel_path, list({c.hash for c in plan['chunks']})
+            )
+            for chunk in plan['chunks']:
+                chunk.embedding = reusable.get(chunk.hash)
+        return plan
+    
+    async def _apply_sync_plans(self, plans: List[Dict[str, Any]]):
+        """
+        Apply sync plans of one or more files
         
-        # Update file metadata
-        stat = file_path.stat()
-        self.storage.update_file_metadata(
-            path=rel_path,
-            source=source,
-            file_hash=file_hash,
-            mtime=int(stat.st_mtime),
-            size=stat.st_size
-        )
+        Chunks needing embeddings are pooled across all files and embedded by
+        the pipeline; each finished batch is saved right away. File metadata
+        is only updated once all of a sync's chunks are stored, so an
+        interrupted sync is picked up again next time.
+        """
+        pending: Dict[str, List[MemoryChunk]] = {}  # chunk hash -> chunks awaiting embedding
+        for plan in plans:
+            self.storage.delete_chunks(plan['stale_ids'])
+            ready = []
+            for chunk in plan['chunks']:
+                if chunk.embedding is None and self.embedding_pipeline:
+                    pending.setdefault(chunk.hash, []).append(chunk)
+                else:
+                    ready.append(chunk)
+            if ready:
+                self.storage.save_chunks_batch(ready)
+        
+        if pending:
+            hashes = list(pending)
+            texts = [pending[h][0].text for h in hashes]
+            async for batch_hashes, embeddings in self.embedding_pipeline.stream(hashes, texts):
+                batch = []
+                for chunk_hash, embedding in zip(batch_hashes, embeddings):
+                    for chunk in pending[chunk_hash]:
+                        chunk.embedding = embedding
+                        batch.append(chunk)
+                self.storage.save_chunks_batch(batch)
+        
+        for plan in plans:
+            self.storage.update_file_metadata(
+                path=plan['path'],
+                source=plan['source'],
+                file_hash=plan['hash'],
+                mtime=plan['mtime'],
+                size=plan['size']
+            )
     
     def should_flush_memory(
         self,
@@ -550,16 +724,32 @@ class MemoryManager:
             'embedding_enabled': self.embedding_provider is not None,
             'embedding_provider': self.config.embedding_provider if self.embedding_provider else 'disabled',
             'embedding_model': self.config.embedding_model if self.embedding_provider else 'N/A',
-            'search_mode': 'hybrid (vector + keyword)' if self.embedding_provider else 'keyword only (FTS5)'
+            'search_mode': 'hybrid (vector + keyword)' if self.embedding_provider else 'keyword only (FTS5)',
+            'embedding_cache': self.embedding_cache.get_stats() if self.embedding_cache else None,
+            'watcher': self.watcher.get_stats() if self.watcher else None
         }
     
     def mark_dirty(self):
         """Mark memory as dirty (needs sync)"""
         self._dirty = True
     
+    def for_session(self) -> "SessionMemoryManager":
+        """
+        Get a per-agent view sharing this manager's storage and index
+        
+        Each view keeps its own flush state (turn count, last flush tokens),
+        so agents of different sessions don't trigger or suppress each
+        other's memory flush.
+        """
+        return SessionMemoryManager(self)
+    
     def close(self):
         """Close memory manager and release resources"""
+        if self.watcher:
+            self.watcher.stop()
         self.storage.close()
+        if self.embedding_cache:
+            self.embedding_cache.close()
     
     # Helper methods
     
@@ -620,3 +810,56 @@ class MemoryManager:
         # Sort by score
         merged_results.sort(key=lambda r: r.score, reverse=True)
         return merged_results
+
+
+class SessionMemoryManager:
+    """
+    Per-agent view of a shared MemoryManager
+    
+    Search, sync, storage and configuration are delegated to the shared
+    manager; memory flush tracking is per view. close() is a no-op, the
+    shared manager is closed by its owner.
+    """
+    
+    def __init__(self, manager: MemoryManager):
+        self.manager = manager
+        self.flush_manager = MemoryFlushManager(
+            workspace_dir=manager.config.get_workspace(),
+            llm_model=manager.flush_manager.llm_model
+        )
+    
+    def __getattr__(self, name):
+        return getattr(self.manager, name)
+    
+    def should_flush_memory(self, current_tokens: int = 0) -> bool:
+        """Check if this agent's memory flush should be triggered"""
+        return self.flush_manager.should_flush(
+            current_tokens=current_tokens,
+            token_threshold=self.manager.config.flush_token_threshold,
+            turn_threshold=self.manager.config.flush_turn_threshold
+        )
+    
+    def increment_turn(self):
+        """增加本会话的对话轮数计数"""
+        self.flush_manager.increment_turn()
+    
+    async def execute_memory_flush(
+        self,
+        agent_executor,
+        current_tokens: int,
+        user_id: Optional[str] = None,
+        **executor_kwargs
+    ) -> bool:
+        """Execute memory flush with this agent's flush state"""
+        success = await self.flush_manager.execute_flush(
+            agent_executor=agent_executor,
+            current_tokens=current_tokens,
+            user_id=user_id,
+            **executor_kwargs
+        )
+        if success:
+            self.manager.mark_dirty()
+        return success
+    
+    def close(self):
+        """Shared resources stay open for other sessions"""
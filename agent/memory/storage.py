@@ -8,10 +8,102 @@ from __future__ import annotations
 import sqlite3
 import json
 import hashlib
+import struct
+import threading
+import functools
+from array import array
 from typing import List, Dict, Optional, Any
 from pathlib import Path
 from dataclasses import dataclass
 
+from agent.memory.vector_index import VectorIndex, NUMPY_AVAILABLE
+
+if NUMPY_AVAILABLE:
+    import numpy as np
+
+
+# Schema version stored in PRAGMA user_version.
+# 1: embeddings stored as JSON text
+# 2: embeddings stored as binary blobs (see encode_embedding)
+SCHEMA_VERSION = 2
+
+# Binary embedding layout: 4-byte header (magic, format, 2 reserved) + payload.
+# The header keeps the float payload 4-byte aligned for numpy.frombuffer.
+_EMBEDDING_MAGIC = 0xE5
+_EMBEDDING_FORMATS = {"float32": 1, "float16": 2, "int8": 3}
+
+
+def _synchronized(method):
+    """Serialize use of the shared connection across threads (searches, watcher syncs)"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._conn_lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def encode_embedding(embedding, fmt: str = "float32") -> bytes:
+    """
+    Encode an embedding as a compact binary blob
+
+    Args:
+        embedding: Sequence of floats
+        fmt: "float32", "float16" or "int8" (symmetric quantization with a
+             per-vector float32 scale)
+    """
+    code = _EMBEDDING_FORMATS[fmt]
+    header = bytes((_EMBEDDING_MAGIC, code, 0, 0))
+    if fmt == "float32":
+        if NUMPY_AVAILABLE:
+            return header + np.asarray(embedding, dtype='<f4').tobytes()
+        values = array('f', embedding)
+        return header + values.tobytes()
+    if fmt == "float16":
+        if NUMPY_AVAILABLE:
+            return header + np.asarray(embedding, dtype='<f2').tobytes()
+        return header + struct.pack(f'<{len(embedding)}e', *embedding)
+
+    peak = max((abs(x) for x in embedding), default=0.0)
+    scale = peak / 127.0 if peak > 0 else 1.0
+    if NUMPY_AVAILABLE:
+        quantized = np.clip(np.rint(np.asarray(embedding, dtype=np.float32) / scale), -127, 127)
+        payload = quantized.astype(np.int8).tobytes()
+    else:
+        payload = array('b', (max(-127, min(127, round(x / scale))) for x in embedding)).tobytes()
+    return header + struct.pack('<f', scale) + payload
+
+
+def decode_embedding(value):
+    """
+    Decode a stored embedding (binary blob or legacy JSON text)
+
+    Returns a numpy float32 array when numpy is available (a zero-copy view
+    for float32 blobs), otherwise a list of floats.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return json.loads(value)
+
+    buf = memoryview(value)
+    if len(buf) < 4 or buf[0] != _EMBEDDING_MAGIC:
+        raise ValueError("Unrecognized embedding encoding")
+    code = buf[1]
+    if code == _EMBEDDING_FORMATS["float32"]:
+        if NUMPY_AVAILABLE:
+            return np.frombuffer(buf, dtype='<f4', offset=4)
+        return array('f', bytes(buf[4:])).tolist()
+    if code == _EMBEDDING_FORMATS["float16"]:
+        if NUMPY_AVAILABLE:
+            return np.frombuffer(buf, dtype='<f2', offset=4).astype(np.float32)
+        return list(struct.unpack(f'<{(len(buf) - 4) // 2}e', buf[4:]))
+    if code == _EMBEDDING_FORMATS["int8"]:
+        scale = struct.unpack_from('<f', buf, 4)[0]
+        if NUMPY_AVAILABLE:
+            return np.frombuffer(buf, dtype=np.int8, offset=8).astype(np.float32) * scale
+        return [q * scale for q in array('b', bytes(buf[8:]))]
+    raise ValueError(f"Unknown embedding format code: {code}")
+
 
 @dataclass
 class MemoryChunk:
@@ -44,11 +136,28 @@ class SearchResult:
 class MemoryStorage:
     """SQLite-based storage with FTS5 for keyword search"""
     
-    def __init__(self, db_path: Path):
+    def __init__(
+        self,
+        db_path: Path,
+        vector_index: Optional[VectorIndex] = None,
+        embedding_format: str = "float32"
+    ):
+        if embedding_format not in _EMBEDDING_FORMATS:
+            raise ValueError(f"Unknown embedding format: {embedding_format}")
         self.db_path = db_path
         self.conn: Optional[sqlite3.Connection] = None
+        # Guards self.conn and the lazy vector index load; reentrant because
+        # search_vector loads the index while holding it
+        self._conn_lock = threading.RLock()
         self.fts5_available = False  # Track FTS5 availability
+        self.embedding_format = embedding_format
+        # In-memory vector index, loaded lazily from the chunks table on first vector search
+        self.vector_index = vector_index or VectorIndex()
+        self._vector_index_loaded = False
+        self._migration_thread: Optional[threading.Thread] = None
+        self._migration_stop = threading.Event()
         self._init_db()
+        self._start_embedding_migration()
     
     def _check_fts5_support(self) -> bool:
         """Check if SQLite has FTS5 support"""
@@ -120,7 +229,7 @@ class MemoryStorage:
                 start_line INTEGER NOT NULL,
                 end_line INTEGER NOT NULL,
                 text TEXT NOT NULL,
-                embedding TEXT,
+                embedding BLOB,
                 hash TEXT NOT NULL,
                 metadata TEXT,
                 created_at INTEGER DEFAULT (strftime('%s', 'now')),
@@ -197,6 +306,7 @@ class MemoryStorage:
         
         self.conn.commit()
     
+    @_synchronized
     def save_chunk(self, chunk: MemoryChunk):
         """Save a memory chunk"""
         self.conn.execute("""
@@ -212,12 +322,14 @@ class MemoryStorage:
             chunk.start_line,
             chunk.end_line,
             chunk.text,
-            json.dumps(chunk.embedding) if chunk.embedding else None,
+            self._encode(chunk.embedding),
             chunk.hash,
             json.dumps(chunk.metadata) if chunk.metadata else None
         ))
         self.conn.commit()
+        self._index_chunks([chunk])
     
+    @_synchronized
     def save_chunks_batch(self, chunks: List[MemoryChunk]):
         """Save multiple chunks in a batch"""
         self.conn.executemany("""
@@ -228,14 +340,16 @@ class MemoryStorage:
             (
                 c.id, c.user_id, c.scope, c.source, c.path,
                 c.start_line, c.end_line, c.text,
-                json.dumps(c.embedding) if c.embedding else None,
+                self._encode(c.embedding),
                 c.hash,
                 json.dumps(c.metadata) if c.metadata else None
             )
             for c in chunks
         ])
         self.conn.commit()
+        self._index_chunks(chunks)
     
+    @_synchronized
     def get_chunk(self, chunk_id: str) -> Optional[MemoryChunk]:
         """Get a chunk by ID"""
         row = self.conn.execute("""
@@ -247,6 +361,7 @@ class MemoryStorage:
         
         return self._row_to_chunk(row)
     
+    @_synchronized
     def search_vector(
         self,
         query_embedding: List[float],
@@ -255,47 +370,24 @@ class MemoryStorage:
         limit: int = 10
     ) -> List[SearchResult]:
         """
-        Vector similarity search using in-memory cosine similarity
-        (sqlite-vec can be added later for better performance)
+        Vector similarity search using the in-memory vector index
         """
         if scopes is None:
             scopes = ["shared"]
             if user_id:
                 scopes.append("user")
         
-        # Build query
-        scope_placeholders = ','.join('?' * len(scopes))
-        params = scopes
-        
-        if user_id:
-            query = f"""
-                SELECT * FROM chunks 
-                WHERE scope IN ({scope_placeholders})
-                AND (scope = 'shared' OR user_id = ?)
-                AND embedding IS NOT NULL
-            """
-            params.append(user_id)
-        else:
-            query = f"""
-                SELECT * FROM chunks 
-                WHERE scope IN ({scope_placeholders})
-                AND embedding IS NOT NULL
-            """
-        
-        rows = self.conn.execute(query, params).fetchall()
-        
-        # Calculate cosine similarity
-        results = []
-        for row in rows:
-            embedding = json.loads(row['embedding'])
-            similarity = self._cosine_similarity(query_embedding, embedding)
-            
-            if similarity > 0:
-                results.append((similarity, row))
+        self._ensure_vector_index()
+        hits = self.vector_index.search(query_embedding, scopes, user_id, limit)
+        if not hits:
+            return []
         
-        # Sort by similarity and limit
-        results.sort(key=lambda x: x[0], reverse=True)
-        results = results[:limit]
+        placeholders = ','.join('?' * len(hits))
+        rows = self.conn.execute(f"""
+            SELECT id, path, start_line, end_line, text, source, user_id
+            FROM chunks WHERE id IN ({placeholders})
+        """, [chunk_id for chunk_id, _ in hits]).fetchall()
+        rows_by_id = {row['id']: row for row in rows}
         
         return [
             SearchResult(
@@ -307,9 +399,11 @@ class MemoryStorage:
                 source=row['source'],
                 user_id=row['user_id']
             )
-            for score, row in results
+            for chunk_id, score in hits
+            if (row := rows_by_id.get(chunk_id)) is not None
         ]
     
+    @_synchronized
     def search_keyword(
         self,
         query: str,
@@ -458,13 +552,59 @@ class MemoryStorage:
         except Exception:
             return []
     
+    @_synchronized
     def delete_by_path(self, path: str):
         """Delete all chunks from a file"""
         self.conn.execute("""
             DELETE FROM chunks WHERE path = ?
         """, (path,))
         self.conn.commit()
+        self.vector_index.remove_path(path)
+    
+    @_synchronized
+    def delete_chunks(self, chunk_ids: List[str]):
+        """Delete chunks by ID"""
+        if not chunk_ids:
+            return
+        self.conn.executemany("""
+            DELETE FROM chunks WHERE id = ?
+        """, [(chunk_id,) for chunk_id in chunk_ids])
+        self.conn.commit()
+        self.vector_index.remove_ids(chunk_ids)
+    
+    @_synchronized
+    def get_chunk_hashes(self, path: str) -> Dict[str, str]:
+        """Get {chunk_id: chunk_hash} for all chunks of a file"""
+        rows = self.conn.execute("""
+            SELECT id, hash FROM chunks WHERE path = ?
+        """, (path,)).fetchall()
+        return {row['id']: row['hash'] for row in rows}
+    
+    @_synchronized
+    def get_embeddings_by_hash(self, path: str, hashes: List[str]) -> Dict[str, List[float]]:
+        """Get stored embeddings of a file's chunks keyed by chunk hash"""
+        hashes = list(hashes)
+        embeddings = {}
+        for start in range(0, len(hashes), 500):
+            part = hashes[start:start + 500]
+            placeholders = ','.join('?' * len(part))
+            rows = self.conn.execute(f"""
+                SELECT hash, embedding FROM chunks
+                WHERE path = ? AND hash IN ({placeholders}) AND embedding IS NOT NULL
+            """, [path] + part).fetchall()
+            for row in rows:
+                embeddings[row['hash']] = self._decode_list(row['embedding'])
+        return embeddings
+    
+    @_synchronized
+    def get_file_metadata(self, path: str) -> Optional[Dict[str, Any]]:
+        """Get stored file hash, mtime and size"""
+        row = self.conn.execute("""
+            SELECT hash, mtime, size FROM files WHERE path = ?
+        """, (path,)).fetchone()
+        return dict(row) if row else None
     
+    @_synchronized
     def get_file_hash(self, path: str) -> Optional[str]:
         """Get stored file hash"""
         row = self.conn.execute("""
@@ -472,6 +612,7 @@ class MemoryStorage:
         """, (path,)).fetchone()
         return row['hash'] if row else None
     
+    @_synchronized
     def update_file_metadata(self, path: str, source: str, file_hash: str, mtime: int, size: int):
         """Update file metadata"""
         self.conn.execute("""
@@ -480,6 +621,15 @@ class MemoryStorage:
         """, (path, source, file_hash, mtime, size))
         self.conn.commit()
     
+    @_synchronized
+    def delete_file_metadata(self, path: str):
+        """Delete file metadata"""
+        self.conn.execute("""
+            DELETE FROM files WHERE path = ?
+        """, (path,))
+        self.conn.commit()
+    
+    @_synchronized
     def get_stats(self) -> Dict[str, int]:
         """Get storage statistics"""
         chunks_count = self.conn.execute("""
@@ -495,8 +645,10 @@ class MemoryStorage:
             'files': files_count
         }
     
+    @_synchronized
     def close(self):
         """Close database connection"""
+        self._migration_stop.set()
         if self.conn:
             try:
                 self.conn.commit()  # Ensure all changes are committed
@@ -514,6 +666,106 @@ class MemoryStorage:
     
     # Helper methods
     
+    def _encode(self, embedding) -> Optional[bytes]:
+        """Encode an embedding for the chunks.embedding column"""
+        if embedding is None or len(embedding) == 0:
+            return None
+        return encode_embedding(embedding, self.embedding_format)
+    
+    @staticmethod
+    def _decode_list(value) -> Optional[List[float]]:
+        """Decode a stored embedding into a plain list"""
+        embedding = decode_embedding(value)
+        if embedding is not None and not isinstance(embedding, list):
+            embedding = embedding.tolist()
+        return embedding
+    
+    def _start_embedding_migration(self):
+        """Rewrite legacy JSON embeddings as binary blobs in the background"""
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+        legacy = self.conn.execute("""
+            SELECT 1 FROM chunks WHERE typeof(embedding) = 'text' LIMIT 1
+        """).fetchone()
+        if not legacy:
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self.conn.commit()
+            return
+        
+        self._migration_thread = threading.Thread(
+            target=self._migrate_embeddings,
+            name="memory-embedding-migration",
+            daemon=True
+        )
+        self._migration_thread.start()
+    
+    def _migrate_embeddings(self, batch_size: int = 500):
+        """
+        Convert JSON embeddings in small batches on a dedicated connection
+        
+        Each batch is its own short transaction, so searches (which decode
+        both encodings) never wait on the migration.
+        """
+        from common.log import logger
+        conn = None
+        migrated = 0
+        try:
+            conn = sqlite3.connect(str(self.db_path))
+            conn.execute("PRAGMA busy_timeout=5000")
+            while not self._migration_stop.is_set():
+                rows = conn.execute("""
+                    SELECT rowid, embedding FROM chunks
+                    WHERE typeof(embedding) = 'text'
+                    LIMIT ?
+                """, (batch_size,)).fetchall()
+                if not rows:
+                    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+                    conn.commit()
+                    logger.info(f"[MemoryStorage] Migrated {migrated} embeddings to binary format")
+                    break
+                conn.executemany("""
+                    UPDATE chunks SET embedding = ? WHERE rowid = ?
+                """, [
+                    (encode_embedding(json.loads(raw), self.embedding_format), rowid)
+                    for rowid, raw in rows
+                ])
+                conn.commit()
+                migrated += len(rows)
+        except Exception as e:
+            logger.warning(f"[MemoryStorage] Embedding migration stopped: {e}")
+        finally:
+            if conn:
+                conn.close()
+    
+    @_synchronized
+    def _ensure_vector_index(self):
+        """Load all stored embeddings into the vector index (once)"""
+        if self._vector_index_loaded:
+            return
+        cursor = self.conn.execute("""
+            SELECT id, path, scope, user_id, embedding FROM chunks
+            WHERE embedding IS NOT NULL
+        """)
+        while True:
+            rows = cursor.fetchmany(5000)
+            if not rows:
+                break
+            self.vector_index.add(
+                (row['id'], row['path'], row['scope'], row['user_id'], decode_embedding(row['embedding']))
+                for row in rows
+            )
+        self._vector_index_loaded = True
+    
+    def _index_chunks(self, chunks: List[MemoryChunk]):
+        """Keep the vector index in sync with saved chunks"""
+        if not self._vector_index_loaded:
+            return  # Picked up by the initial load
+        self.vector_index.add(
+            (c.id, c.path, c.scope, c.user_id, c.embedding)
+            for c in chunks
+        )
+    
     def _row_to_chunk(self, row) -> MemoryChunk:
         """Convert database row to MemoryChunk"""
         return MemoryChunk(
@@ -525,7 +777,7 @@ class MemoryStorage:
             start_line=row['start_line'],
             end_line=row['end_line'],
             text=row['text'],
-            embedding=json.loads(row['embedding']) if row['embedding'] else None,
+            embedding=self._decode_list(row['embedding']),
             hash=row['hash'],
             metadata=json.loads(row['metadata']) if row['metadata'] else None
         )
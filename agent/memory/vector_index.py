@@ -0,0 +1,354 @@
+"""
+In-memory vector index for memory search
+
+Embeddings are kept L2-normalized in a contiguous float32 matrix so scoring a
+query is a single matrix-vector product. Large stores can switch to an
+IVF (inverted file) approximate mode that only scores the closest clusters.
+Falls back to pure Python when numpy is not installed.
+"""
+
+from __future__ import annotations
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from common.log import logger
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+
+# (chunk_id, path, scope, user_id, embedding as list or float32 array)
+IndexEntry = Tuple[str, str, str, Optional[str], Sequence[float]]
+
+
+class VectorIndex:
+    """
+    Cosine similarity index over chunk embeddings
+
+    Supports incremental add/remove so it can be kept in sync with the
+    SQLite chunks table without rebuilding.
+    """
+
+    def __init__(
+        self,
+        mode: str = "auto",
+        ivf_threshold: int = 50000,
+        nprobe: int = 8
+    ):
+        """
+        Initialize vector index
+
+        Args:
+            mode: "exact" (brute force), "ivf" (approximate) or "auto"
+                  (exact until the index reaches ivf_threshold vectors)
+            ivf_threshold: Vector count at which "auto" switches to IVF
+            nprobe: Number of IVF clusters scanned per query
+        """
+        if mode not in ("auto", "exact", "ivf"):
+            raise ValueError(f"Unknown vector index mode: {mode}")
+        self.mode = mode
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.dim: Optional[int] = None
+        self._size = 0
+        self._ids: List[str] = []
+        self._pos: Dict[str, int] = {}
+        self._paths: Dict[str, Set[str]] = {}
+        self._row_paths: List[str] = []
+
+        # Scope and user_id are interned to small ints for vectorized filtering
+        self._scope_codes: Dict[str, int] = {}
+        self._user_codes: Dict[Optional[str], int] = {None: 0}
+
+        if NUMPY_AVAILABLE:
+            self._matrix = None
+            self._scopes = np.zeros(0, dtype=np.int32)
+            self._users = np.zeros(0, dtype=np.int32)
+            self._assign = np.zeros(0, dtype=np.int32)
+        else:
+            self._rows: List[List[float]] = []
+            self._scopes: List[int] = []
+            self._users: List[int] = []
+
+        # IVF state
+        self._centroids = None
+        self._trained_size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def approximate(self) -> bool:
+        """Whether queries currently go through the IVF path"""
+        if not NUMPY_AVAILABLE or self.mode == "exact":
+            return False
+        if self.mode == "ivf":
+            return True
+        return self._size >= self.ivf_threshold
+
+    def add(self, entries: Iterable[IndexEntry]):
+        """Add or replace vectors"""
+        with self._lock:
+            for chunk_id, path, scope, user_id, embedding in entries:
+                if embedding is None or len(embedding) == 0:
+                    self._remove_id(chunk_id)
+                    continue
+                if self.dim is None:
+                    self.dim = len(embedding)
+                elif len(embedding) != self.dim:
+                    # The embedding model changed: stored vectors can no longer be
+                    # compared with new queries, so start over with the new dimension
+                    logger.warning(
+                        f"[VectorIndex] Embedding dimension changed {self.dim} -> {len(embedding)}, "
+                        f"dropping {self._size} indexed vectors; re-sync memory to re-embed them"
+                    )
+                    self._reset()
+                    self.dim = len(embedding)
+
+                row = self._pos.get(chunk_id)
+                if row is None:
+                    row = self._append_row(chunk_id)
+                elif self._row_paths[row] != path:
+                    self._paths[self._row_paths[row]].discard(chunk_id)
+
+                self._row_paths[row] = path
+                self._paths.setdefault(path, set()).add(chunk_id)
+                self._set_row(row, embedding, self._scope_code(scope), self._user_code(user_id))
+
+    def remove_ids(self, chunk_ids: Iterable[str]):
+        """Remove vectors by chunk id"""
+        with self._lock:
+            for chunk_id in chunk_ids:
+                self._remove_id(chunk_id)
+
+    def remove_path(self, path: str):
+        """Remove all vectors belonging to a file"""
+        with self._lock:
+            for chunk_id in list(self._paths.pop(path, ())):
+                self._remove_id(chunk_id)
+
+    def clear(self):
+        """Drop all vectors"""
+        with self._lock:
+            self._reset()
+
+    def search(
+        self,
+        query: List[float],
+        scopes: List[str],
+        user_id: Optional[str] = None,
+        limit: int = 10
+    ) -> List[Tuple[str, float]]:
+        """
+        Find the most similar chunks
+
+        Args:
+            query: Query embedding
+            scopes: Allowed scopes
+            user_id: If set, non-shared chunks must belong to this user
+            limit: Maximum results
+
+        Returns:
+            List of (chunk_id, cosine similarity) with positive similarity,
+            best first
+        """
+        with self._lock:
+            if self._size == 0 or query is None or len(query) != self.dim:
+                return []
+            if NUMPY_AVAILABLE:
+                return self._search_numpy(query, scopes, user_id, limit)
+            return self._search_python(query, scopes, user_id, limit)
+
+    # Storage helpers
+
+    def _scope_code(self, scope: str) -> int:
+        return self._scope_codes.setdefault(scope, len(self._scope_codes))
+
+    def _user_code(self, user_id: Optional[str]) -> int:
+        return self._user_codes.setdefault(user_id, len(self._user_codes))
+
+    def _append_row(self, chunk_id: str) -> int:
+        row = self._size
+        if NUMPY_AVAILABLE:
+            capacity = 0 if self._matrix is None else self._matrix.shape[0]
+            if row >= capacity:
+                self._grow(max(1024, capacity * 2))
+        else:
+            self._rows.append([])
+            self._scopes.append(0)
+            self._users.append(0)
+        self._ids.append(chunk_id)
+        self._row_paths.append("")
+        self._pos[chunk_id] = row
+        self._size += 1
+        return row
+
+    def _grow(self, capacity: int):
+        matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        scopes = np.zeros(capacity, dtype=np.int32)
+        users = np.zeros(capacity, dtype=np.int32)
+        assign = np.zeros(capacity, dtype=np.int32)
+        if self._matrix is not None:
+            n = self._size
+            matrix[:n] = self._matrix[:n]
+            scopes[:n] = self._scopes[:n]
+            users[:n] = self._users[:n]
+            assign[:n] = self._assign[:n]
+        self._matrix, self._scopes, self._users, self._assign = matrix, scopes, users, assign
+
+    def _set_row(self, row: int, embedding: List[float], scope: int, user: int):
+        if NUMPY_AVAILABLE:
+            vec = np.asarray(embedding, dtype=np.float32)
+            norm = float(np.linalg.norm(vec))
+            self._matrix[row] = vec / norm if norm > 0 else 0.0
+            if self._centroids is not None:
+                self._assign[row] = int(np.argmax(self._centroids @ self._matrix[row]))
+        else:
+            norm = sum(x * x for x in embedding) ** 0.5
+            self._rows[row] = [x / norm for x in embedding] if norm > 0 else [0.0] * len(embedding)
+        self._scopes[row] = scope
+        self._users[row] = user
+
+    def _remove_id(self, chunk_id: str):
+        """Swap-remove a row so the matrix stays contiguous"""
+        row = self._pos.pop(chunk_id, None)
+        if row is None:
+            return
+        path_ids = self._paths.get(self._row_paths[row])
+        if path_ids is not None:
+            path_ids.discard(chunk_id)
+            if not path_ids:
+                del self._paths[self._row_paths[row]]
+
+        last = self._size - 1
+        if row != last:
+            moved_id = self._ids[last]
+            self._ids[row] = moved_id
+            self._row_paths[row] = self._row_paths[last]
+            self._pos[moved_id] = row
+            if NUMPY_AVAILABLE:
+                self._matrix[row] = self._matrix[last]
+                self._scopes[row] = self._scopes[last]
+                self._users[row] = self._users[last]
+                self._assign[row] = self._assign[last]
+            else:
+                self._rows[row] = self._rows[last]
+                self._scopes[row] = self._scopes[last]
+                self._users[row] = self._users[last]
+
+        self._ids.pop()
+        self._row_paths.pop()
+        if not NUMPY_AVAILABLE:
+            self._rows.pop()
+            self._scopes.pop()
+            self._users.pop()
+        self._size -= 1
+
+    # Search helpers
+
+    def _filter_codes(self, scopes: List[str], user_id: Optional[str]):
+        """Translate scope/user filters to interned codes (None = no match possible)"""
+        scope_codes = [self._scope_codes[s] for s in scopes if s in self._scope_codes]
+        shared_code = self._scope_codes.get("shared", -1)
+        user_code = self._user_codes.get(user_id, -1) if user_id else None
+        return scope_codes, shared_code, user_code
+
+    def _search_numpy(self, query, scopes, user_id, limit):
+        n = self._size
+        scope_codes, shared_code, user_code = self._filter_codes(scopes, user_id)
+        if not scope_codes:
+            return []
+
+        mask = np.isin(self._scopes[:n], scope_codes)
+        if user_code is not None:
+            mask &= (self._scopes[:n] == shared_code) | (self._users[:n] == user_code)
+
+        q = np.asarray(query, dtype=np.float32)
+        norm = float(np.linalg.norm(q))
+        if norm == 0:
+            return []
+        q = q / norm  # query may be the caller's float32 array, don't modify it
+
+        if self.approximate:
+            self._maybe_train()
+            probe = np.argsort(-(self._centroids @ q))[:self.nprobe]
+            mask &= np.isin(self._assign[:n], probe)
+
+        candidates = np.flatnonzero(mask)
+        if candidates.size == 0:
+            return []
+        if candidates.size == n:
+            scores = self._matrix[:n] @ q
+            rows = np.arange(n)
+        else:
+            scores = self._matrix[candidates] @ q
+            rows = candidates
+
+        k = min(limit, scores.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            (self._ids[int(rows[i])], float(scores[i]))
+            for i in top
+            if scores[i] > 0
+        ]
+
+    def _search_python(self, query, scopes, user_id, limit):
+        scope_codes, shared_code, user_code = self._filter_codes(scopes, user_id)
+        if not scope_codes:
+            return []
+        norm = sum(x * x for x in query) ** 0.5
+        if norm == 0:
+            return []
+        scope_set = set(scope_codes)
+
+        results = []
+        for row in range(self._size):
+            scope = self._scopes[row]
+            if scope not in scope_set:
+                continue
+            if user_code is not None and scope != shared_code and self._users[row] != user_code:
+                continue
+            score = sum(a * b for a, b in zip(query, self._rows[row])) / norm
+            if score > 0:
+                results.append((score, self._ids[row]))
+
+        results.sort(key=lambda x: x[0], reverse=True)
+        return [(chunk_id, score) for score, chunk_id in results[:limit]]
+
+    def _maybe_train(self, iterations: int = 8, sample_size: int = 65536):
+        """(Re)train IVF centroids with spherical k-means when the index has doubled"""
+        n = self._size
+        if self._centroids is not None and n < self._trained_size * 2:
+            return
+
+        nlist = max(1, int(n ** 0.5))
+        rng = np.random.default_rng(0)
+        sample_rows = rng.choice(n, size=min(n, sample_size), replace=False)
+        sample = self._matrix[sample_rows]
+        centroids = sample[rng.choice(sample.shape[0], size=min(nlist, sample.shape[0]), replace=False)].copy()
+
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(centroids.shape[0]):
+                members = sample[labels == c]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    norm = float(np.linalg.norm(centroid))
+                    if norm > 0:
+                        centroids[c] = centroid / norm
+
+        self._centroids = centroids
+        # Assign all rows in blocks to bound temporary memory
+        for start in range(0, n, 65536):
+            end = min(n, start + 65536)
+            self._assign[start:end] = np.argmax(self._matrix[start:end] @ centroids.T, axis=1)
+        self._trained_size = n
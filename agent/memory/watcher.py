@@ -0,0 +1,201 @@
+"""
+File watcher for memory sync
+
+Keeps a set of dirty memory file paths fed by filesystem events (watchdog /
+inotify) or, when watchdog is not installed, by a lightweight stat poller.
+A background worker syncs only those paths, so searches never have to scan
+the whole memory directory.
+"""
+
+from __future__ import annotations
+import asyncio
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple, TYPE_CHECKING
+
+from common.log import logger
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+    WATCHDOG_AVAILABLE = True
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+    WATCHDOG_AVAILABLE = False
+
+if TYPE_CHECKING:
+    from agent.memory.manager import MemoryManager
+
+
+class _EventHandler(FileSystemEventHandler):
+    """Forward watchdog events for markdown files to the watcher"""
+
+    def __init__(self, watcher: "MemoryWatcher"):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+        for attr in ("src_path", "dest_path"):
+            path = getattr(event, attr, None)
+            if path:
+                self.watcher.notify(Path(path))
+
+
+class MemoryWatcher:
+    """
+    Change feed that syncs dirty memory files in the background
+    """
+
+    def __init__(self, manager: "MemoryManager", poll_interval: float = 2.0, debounce: float = 0.5):
+        """
+        Initialize memory watcher
+
+        Args:
+            manager: Memory manager whose files are watched
+            poll_interval: Seconds between scans when falling back to polling
+            debounce: Seconds to wait after a change before syncing, so bursts
+                      of writes to the same file are synced once
+        """
+        self.manager = manager
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.backend = "watchdog" if WATCHDOG_AVAILABLE else "polling"
+
+        self._workspace = manager.config.get_workspace().resolve()
+        self._memory_dir = manager.config.get_memory_dir().resolve()
+        self._pending: Dict[Path, float] = {}  # path -> first time seen dirty
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._observer = None
+        self._threads = []
+
+        self.synced_paths = 0
+        self.errors = 0
+        self.last_sync_at: Optional[float] = None
+        self.last_sync_lag = 0.0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._threads) and not self._stop.is_set()
+
+    def start(self):
+        """Start watching and the background sync worker"""
+        if self.running:
+            return
+        self._stop.clear()
+        if WATCHDOG_AVAILABLE:
+            self._observer = Observer()
+            handler = _EventHandler(self)
+            self._observer.schedule(handler, str(self._workspace), recursive=False)
+            self._observer.schedule(handler, str(self._memory_dir), recursive=True)
+            self._observer.daemon = True
+            self._observer.start()
+        else:
+            self._spawn(self._poll_loop, "memory-watch-poll")
+        self._spawn(self._worker_loop, "memory-watch-sync")
+        logger.debug(f"[MemoryWatcher] Watching {self._workspace} ({self.backend})")
+
+    def stop(self):
+        """Stop watching; pending paths are left for the next full sync"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._observer:
+            self._observer.stop()
+            self._observer = None
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=5)
+        self._threads = []
+
+    def notify(self, path: Path):
+        """Mark a path dirty if it is a watched memory file"""
+        path = Path(path)
+        if not self._is_memory_file(path):
+            return
+        with self._lock:
+            self._pending.setdefault(path, time.time())
+        self._wakeup.set()
+
+    def get_stats(self) -> Dict[str, object]:
+        """Get pending paths and sync lag"""
+        with self._lock:
+            pending = len(self._pending)
+            oldest = min(self._pending.values()) if self._pending else None
+        return {
+            'backend': self.backend,
+            'running': self.running,
+            'pending_paths': pending,
+            'sync_lag': round(time.time() - oldest, 3) if oldest else 0.0,
+            'last_sync_lag': round(self.last_sync_lag, 3),
+            'last_sync_at': self.last_sync_at,
+            'synced_paths': self.synced_paths,
+            'errors': self.errors
+        }
+
+    # Internal
+
+    def _spawn(self, target, name: str):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _is_memory_file(self, path: Path) -> bool:
+        if path.suffix != ".md":
+            return False
+        if path.parent == self._workspace:
+            return path.name == "MEMORY.md"
+        return self._memory_dir in path.parents
+
+    def _worker_loop(self):
+        while not self._stop.is_set():
+            self._wakeup.wait()
+            if self._stop.is_set():
+                break
+            self._wakeup.clear()
+            # Let bursts of writes settle
+            if self._stop.wait(self.debounce):
+                break
+
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                continue
+            try:
+                asyncio.run(self.manager.sync_paths(list(batch)))
+                self.synced_paths += len(batch)
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"[MemoryWatcher] Sync failed: {e}")
+            now = time.time()
+            self.last_sync_at = now
+            self.last_sync_lag = now - min(batch.values())
+
+    def _poll_loop(self):
+        snapshot = self._scan()
+        while not self._stop.wait(self.poll_interval):
+            current = self._scan()
+            for path, sig in current.items():
+                if snapshot.get(path) != sig:
+                    self.notify(path)
+            for path in snapshot.keys() - current.keys():
+                self.notify(path)
+            snapshot = current
+
+    def _scan(self) -> Dict[Path, Tuple[int, int]]:
+        """Stat (without reading) every watched file"""
+        result = {}
+        candidates = [self._workspace / "MEMORY.md"]
+        if self._memory_dir.exists():
+            candidates.extend(self._memory_dir.rglob("*.md"))
+        for path in candidates:
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            result[path] = (stat.st_mtime_ns, stat.st_size)
+        return result
@@ -7,6 +7,7 @@ from common.log import logger
 from agent.protocol.models import LLMRequest, LLMModel
 from agent.protocol.agent_stream import AgentStreamExecutor
 from agent.protocol.result import AgentAction, AgentActionType, ToolResult, AgentResult
+from agent.protocol.tokenizer import count_message_tokens, count_text_tokens
 from agent.tools.base_tool import BaseTool, ToolStage
 
 
@@ -276,68 +277,32 @@ class Agent:
         reserve = int(context_window * 0.1)
         return max(10000, min(200000, reserve))
 
+    def _get_model_name(self):
+        if self.model and hasattr(self.model, 'model'):
+            return self.model.model
+        return None
+
     def _estimate_message_tokens(self, message: dict) -> int:
         """
         Estimate token count for a message.
 
-        Uses chars/3 for Chinese-heavy content and chars/4 for ASCII-heavy content,
+        Uses the model's tokenizer backend (see agent.protocol.tokenizer),
         plus per-block overhead for tool_use / tool_result structures.
+        Counts are memoized per content block.
 
         :param message: Message dict with 'role' and 'content'
         :return: Estimated token count
         """
-        content = message.get('content', '')
-        if isinstance(content, str):
-            return max(1, self._estimate_text_tokens(content))
-        elif isinstance(content, list):
-            total_tokens = 0
-            for part in content:
-                if not isinstance(part, dict):
-                    continue
-                block_type = part.get('type', '')
-                if block_type == 'text':
-                    total_tokens += self._estimate_text_tokens(part.get('text', ''))
-                elif block_type == 'image':
-                    total_tokens += 1200
-                elif block_type == 'tool_use':
-                    # tool_use has id + name + input (JSON-encoded)
-                    total_tokens += 50  # overhead for structure
-                    input_data = part.get('input', {})
-                    if isinstance(input_data, dict):
-                        import json
-                        input_str = json.dumps(input_data, ensure_ascii=False)
-                        total_tokens += self._estimate_text_tokens(input_str)
-                elif block_type == 'tool_result':
-                    # tool_result has tool_use_id + content
-                    total_tokens += 30  # overhead for structure
-                    result_content = part.get('content', '')
-                    if isinstance(result_content, str):
-                        total_tokens += self._estimate_text_tokens(result_content)
-                else:
-                    # Unknown block type, estimate conservatively
-                    total_tokens += 10
-            return max(1, total_tokens)
-        return 1
+        return count_message_tokens(message, self._get_model_name())
 
-    @staticmethod
-    def _estimate_text_tokens(text: str) -> int:
+    def _estimate_text_tokens(self, text: str) -> int:
         """
-        Estimate token count for a text string.
-
-        Chinese / CJK characters typically use ~1.5 tokens each,
-        while ASCII uses ~0.25 tokens per char (4 chars/token).
-        We use a weighted average based on the character mix.
+        Estimate token count for a text string with the model's tokenizer backend.
 
         :param text: Input text
         :return: Estimated token count
         """
-        if not text:
-            return 0
-        # Count non-ASCII characters (CJK, emoji, etc.)
-        non_ascii = sum(1 for c in text if ord(c) > 127)
-        ascii_count = len(text) - non_ascii
-        # CJK chars: ~1.5 tokens each; ASCII: ~0.25 tokens per char
-        return int(non_ascii * 1.5 + ascii_count * 0.25) + 1
+        return count_text_tokens(text, self._get_model_name())
 
     def _find_tool(self, tool_name: str):
         """Find and return a tool with the specified name"""
@@ -4,12 +4,33 @@ Agent Stream Execution Module - Multi-turn reasoning based on tool-call
 Provides streaming output, event system, and complete tool-call loop
 """
 import json
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Optional, Callable, Tuple
 
+from agent.protocol.context_window import ContextTurn, ContextWindow
 from agent.protocol.models import LLMRequest, LLMModel
 from agent.tools.base_tool import BaseTool, ToolResult
 from common.log import logger
+from common.prompt_cache import normalize_usage
+from config import conf
+
+_tool_pool: Optional[ThreadPoolExecutor] = None
+_tool_pool_lock = threading.Lock()
+
+
+def _get_tool_pool() -> Optional[ThreadPoolExecutor]:
+    """Process-wide pool for parallel-safe tool calls, None when parallel execution is disabled"""
+    global _tool_pool
+    if _tool_pool is None:
+        workers = conf().get("agent_parallel_tool_workers", 8)
+        if workers <= 1:
+            return None
+        with _tool_pool_lock:
+            if _tool_pool is None:
+                _tool_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="agent-tool")
+    return _tool_pool
 
 
 class AgentStreamExecutor:
@@ -65,18 +86,43 @@ class AgentStreamExecutor:
         # Track files to send (populated by read tool)
         self.files_to_send = []  # List of file metadata dicts
 
+        # Provider-reported usage summed over this run, incl. prompt cache hits
+        self.usage_totals = {"calls": 0, "input_tokens": 0, "cached_tokens": 0,
+                             "cache_creation_tokens": 0, "output_tokens": 0}
+
+        # Turn index / token totals maintained incrementally across LLM calls
+        self.context_window = ContextWindow(lambda message: self.agent._estimate_message_tokens(message))
+
+        # Parallel tool calls emit events and record results from worker threads
+        self._event_lock = threading.Lock()
+        self._history_lock = threading.Lock()
+
     def _emit_event(self, event_type: str, data: dict = None):
         """Emit event"""
         if self.on_event:
             try:
-                self.on_event({
-                    "type": event_type,
-                    "timestamp": time.time(),
-                    "data": data or {}
-                })
+                with self._event_lock:
+                    self.on_event({
+                        "type": event_type,
+                        "timestamp": time.time(),
+                        "data": data or {}
+                    })
             except Exception as e:
                 logger.error(f"Event callback error: {e}")
     
+    def _record_usage(self, usage: dict):
+        """Record provider usage, splitting input tokens into cache hits and misses"""
+        usage = normalize_usage(usage)
+        if self.agent:
+            self.agent.last_usage = usage
+        self.usage_totals["calls"] += 1
+        for key, value in usage.items():
+            self.usage_totals[key] += value
+        logger.debug(
+            f"[Agent] Usage: input={usage['input_tokens']} (cached={usage['cached_tokens']}, "
+            f"cache_write={usage['cache_creation_tokens']}), output={usage['output_tokens']}"
+        )
+
     def _filter_think_tags(self, text: str) -> str:
         """
         Remove <think> and </think> tags but keep the content inside.
@@ -161,10 +207,11 @@ class AgentStreamExecutor:
     def _record_tool_result(self, tool_name: str, args: dict, success: bool):
         """Record tool execution result for failure tracking"""
         args_hash = self._hash_args(args)
-        self.tool_failure_history.append((tool_name, args_hash, success))
-        # Keep only last 50 records to avoid memory bloat
-        if len(self.tool_failure_history) > 50:
-            self.tool_failure_history = self.tool_failure_history[-50:]
+        with self._history_lock:
+            self.tool_failure_history.append((tool_name, args_hash, success))
+            # Keep only last 50 records to avoid memory bloat
+            if len(self.tool_failure_history) > 50:
+                self.tool_failure_history = self.tool_failure_history[-50:]
 
     def run_stream(self, user_message: str) -> str:
         """
@@ -292,8 +339,7 @@ class AgentStreamExecutor:
                 tool_result_blocks = []
 
                 try:
-                    for tool_call in tool_calls:
-                        result = self._execute_tool(tool_call)
+                    for tool_call, result in self._execute_tools(tool_calls):
                         tool_results.append(result)
                         
                         # Debug: Check if tool is being called repeatedly with same args
@@ -471,6 +517,13 @@ class AgentStreamExecutor:
 
         finally:
             logger.info(f"[Agent] 🏁 完成 ({turn}轮)")
+            if self.usage_totals["input_tokens"]:
+                totals = self.usage_totals
+                logger.info(
+                    f"[Agent] Prompt cache: {totals['cached_tokens']}/{totals['input_tokens']} input tokens "
+                    f"cached over {totals['calls']} calls "
+                    f"({totals['cached_tokens'] * 100 // totals['input_tokens']}%)"
+                )
             self._emit_event("agent_end", {"final_response": final_response})
 
             # 每轮对话结束后增加计数（用户消息+AI回复=1轮）
@@ -493,12 +546,16 @@ class AgentStreamExecutor:
         Returns:
             (response_text, tool_calls)
         """
+        prepare_start = time.perf_counter()
+
         # Validate and fix message history first
         self._validate_and_fix_messages()
         
         # Trim messages if needed (using agent's context management)
         self._trim_messages()
 
+        self.context_window.record_prepare(time.perf_counter() - prepare_start)
+
         # Prepare messages
         messages = self._prepare_messages()
         logger.info(f"Sending {len(messages)} messages to LLM")
@@ -529,6 +586,7 @@ class AgentStreamExecutor:
         full_content = ""
         tool_calls_buffer = {}  # {index: {id, name, arguments}}
         stop_reason = None  # Track why the stream stopped
+        call_usage = None  # Latest usage reported in the stream
 
         try:
             stream = self.model.call_stream(request)
@@ -573,6 +631,10 @@ class AgentStreamExecutor:
                         # Raise exception with full error message for retry logic
                         raise Exception(f"{error_msg} (Status: {status_code}, Code: {error_code}, Type: {error_type})")
 
+                # Usage usually arrives in a final chunk with empty choices
+                if isinstance(chunk, dict) and chunk.get("usage"):
+                    call_usage = chunk["usage"]
+
                 # Parse chunk
                 if isinstance(chunk, dict) and chunk.get("choices"):
                     choice = chunk["choices"][0]
@@ -619,6 +681,9 @@ class AgentStreamExecutor:
                                 if "arguments" in func:
                                     tool_calls_buffer[index]["arguments"] += func["arguments"]
 
+            if call_usage:
+                self._record_usage(call_usage)
+
         except Exception as e:
             error_str = str(e)
             error_str_lower = error_str.lower()
@@ -793,12 +858,46 @@ class AgentStreamExecutor:
 
         return full_content, tool_calls
 
-    def _execute_tool(self, tool_call: Dict) -> Dict[str, Any]:
+    def _is_parallel_safe(self, tool_call: Dict) -> bool:
+        if "_parse_error" in tool_call:
+            return False
+        tool = self.tools.get(tool_call["name"])
+        return bool(tool and getattr(tool, "parallel_safe", False))
+
+    def _execute_tools(self, tool_calls: List[Dict]):
+        """
+        Execute the tool calls of one turn, yielding (tool_call, result) in call order
+
+        Consecutive calls to parallel-safe tools (read, ls, web_search, ...) run
+        concurrently on a shared pool and emit their events as each finishes.
+        Any other call runs alone, after everything before it has finished, and
+        only once the caller asks for it, so writes/edits/bash keep their order
+        and are skipped if the caller stops early.
+        """
+        i = 0
+        while i < len(tool_calls):
+            j = i
+            while j < len(tool_calls) and self._is_parallel_safe(tool_calls[j]):
+                j += 1
+            pool = _get_tool_pool() if j - i > 1 else None
+            if pool:
+                batch = tool_calls[i:j]
+                logger.debug(f"[Agent] Running {len(batch)} tool calls in parallel")
+                futures = [pool.submit(self._execute_tool, tool_call, True) for tool_call in batch]
+                for tool_call, future in zip(batch, futures):
+                    yield tool_call, future.result()
+                i = j
+            else:
+                yield tool_calls[i], self._execute_tool(tool_calls[i])
+                i += 1
+
+    def _execute_tool(self, tool_call: Dict, in_parallel: bool = False) -> Dict[str, Any]:
         """
         Execute tool
         
         Args:
             tool_call: {"id": str, "name": str, "arguments": dict}
+            in_parallel: Whether the call runs concurrently with other calls of the turn
             
         Returns:
             Tool execution result
@@ -855,6 +954,7 @@ class AgentStreamExecutor:
             # Set tool context
             tool.model = self.model
             tool.context = self.agent
+            tool.in_parallel = in_parallel
 
             # Execute tool
             start_time = time.time()
@@ -975,65 +1075,6 @@ class AgentStreamExecutor:
         
         return turns
     
-    def _estimate_turn_tokens(self, turn: Dict) -> int:
-        """估算一个轮次的 tokens"""
-        return sum(
-            self.agent._estimate_message_tokens(msg) 
-            for msg in turn['messages']
-        )
-
-    def _truncate_historical_tool_results(self):
-        """
-        Truncate tool_result content in historical messages to reduce context size.
-
-        Current turn results are kept at 30K chars (truncated at creation time).
-        Historical turn results are further truncated to 10K chars here.
-        This runs before token-based trimming so that we first shrink oversized
-        results, potentially avoiding the need to drop entire turns.
-        """
-        MAX_HISTORY_RESULT_CHARS = 20000
-
-        if len(self.messages) < 2:
-            return
-
-        # Find where the last user text message starts (= current turn boundary)
-        # We skip the current turn's messages to preserve their full content
-        current_turn_start = len(self.messages)
-        for i in range(len(self.messages) - 1, -1, -1):
-            msg = self.messages[i]
-            if msg.get("role") == "user":
-                content = msg.get("content", [])
-                if isinstance(content, list) and any(
-                    isinstance(b, dict) and b.get("type") == "text" for b in content
-                ):
-                    current_turn_start = i
-                    break
-                elif isinstance(content, str):
-                    current_turn_start = i
-                    break
-
-        truncated_count = 0
-        for i in range(current_turn_start):
-            msg = self.messages[i]
-            if msg.get("role") != "user":
-                continue
-            content = msg.get("content", [])
-            if not isinstance(content, list):
-                continue
-
-            for block in content:
-                if not isinstance(block, dict) or block.get("type") != "tool_result":
-                    continue
-                result_str = block.get("content", "")
-                if isinstance(result_str, str) and len(result_str) > MAX_HISTORY_RESULT_CHARS:
-                    original_len = len(result_str)
-                    block["content"] = result_str[:MAX_HISTORY_RESULT_CHARS] + \
-                        f"\n\n[Historical output truncated: {original_len} -> {MAX_HISTORY_RESULT_CHARS} chars]"
-                    truncated_count += 1
-
-        if truncated_count > 0:
-            logger.info(f"📎 Truncated {truncated_count} historical tool result(s) to {MAX_HISTORY_RESULT_CHARS} chars")
-
     def _aggressive_trim_for_overflow(self) -> bool:
         """
         Aggressively trim context when a real overflow error is returned by the API.
@@ -1118,6 +1159,7 @@ class AgentStreamExecutor:
                 new_messages.extend(turn["messages"])
             removed = len(turns) - 5
             self.messages[:] = new_messages
+            self.context_window.invalidate()
             logger.info(
                 f"🔧 Aggressive trim: removed {removed} old turns, "
                 f"truncated {truncated} large blocks, "
@@ -1126,6 +1168,7 @@ class AgentStreamExecutor:
             return True
 
         if truncated > 0:
+            self.context_window.invalidate()
             logger.info(
                 f"🔧 Aggressive trim: truncated {truncated} large blocks "
                 f"(no turns removed, only {len(turns)} turn(s) left)"
@@ -1144,23 +1187,28 @@ class AgentStreamExecutor:
         1. 不会在对话中间截断
         2. 工具调用链（tool_use + tool_result）保持完整
         3. 每轮对话都是完整的（用户消息 + AI回复 + 工具调用）
+
+        轮次划分、每轮 tokens 和历史工具结果截断由 ContextWindow 增量维护，
+        每次调用只处理上次之后新增的消息
         """
         if not self.messages or not self.agent:
             return
 
-        # Step 0: Truncate large tool results in historical turns (30K -> 10K)
-        self._truncate_historical_tool_results()
-
-        # Step 1: 识别完整轮次
-        turns = self._identify_complete_turns()
+        # Step 1: 增量同步轮次（新消息归入轮次，刚成为历史的轮次截断其工具结果）
+        self.context_window.sync(self.messages)
+        turns = self.context_window.turns
         
         if not turns:
             return
         
         # Step 2: 轮次限制 - 保留最近 N 轮
+        current_tokens = self.context_window.total_tokens
+        turns_removed = False
         if len(turns) > self.max_context_turns:
             removed_turns = len(turns) - self.max_context_turns
+            current_tokens -= sum(turn.tokens for turn in turns[:removed_turns])
             turns = turns[-self.max_context_turns:]  # 保留最近的轮次
+            turns_removed = True
             
             logger.info(
                 f"💾 上下文轮次超限: {len(turns) + removed_turns} > {self.max_context_turns}，"
@@ -1183,21 +1231,11 @@ class AgentStreamExecutor:
         system_tokens = self.agent._estimate_message_tokens({"role": "system", "content": self.system_prompt})
         available_tokens = max_tokens - system_tokens
 
-        # Calculate current tokens
-        current_tokens = sum(self._estimate_turn_tokens(turn) for turn in turns)
-        
-        # If under limit, reconstruct messages and return
+        # If under limit, reconstruct messages only when turns were dropped
         if current_tokens + system_tokens <= max_tokens:
-            # Reconstruct message list from turns
-            new_messages = []
-            for turn in turns:
-                new_messages.extend(turn['messages'])
-            
-            old_count = len(self.messages)
-            self.messages = new_messages
-            
-            # Log if we removed messages due to turn limit
-            if old_count > len(self.messages):
+            if turns_removed:
+                old_count = len(self.messages)
+                self.messages = self.context_window.reset_to(turns)
                 logger.info(f"   重建消息列表: {old_count} -> {len(self.messages)} 条消息")
             return
 
@@ -1208,12 +1246,12 @@ class AgentStreamExecutor:
         )
 
         # 从最新轮次开始，反向累加（保持完整轮次）
-        kept_turns = []
+        kept_turns: List[ContextTurn] = []
         accumulated_tokens = 0
         min_turns = 3  # 尽量保留至少 3 轮，但不强制（避免超出 token 限制）
         
         for i, turn in enumerate(reversed(turns)):
-            turn_tokens = self._estimate_turn_tokens(turn)
+            turn_tokens = turn.tokens
             turns_from_end = i + 1
             
             # 检查是否超出限制
@@ -1235,13 +1273,9 @@ class AgentStreamExecutor:
                 break
         
         # 重建消息列表
-        new_messages = []
-        for turn in kept_turns:
-            new_messages.extend(turn['messages'])
-        
         old_count = len(self.messages)
         old_turn_count = len(turns)
-        self.messages = new_messages
+        self.messages = self.context_window.reset_to(kept_turns)
         new_count = len(self.messages)
         new_turn_count = len(kept_turns)
         
@@ -0,0 +1,200 @@
+"""
+Incremental context window bookkeeping for AgentStreamExecutor
+
+Keeps turn boundaries, per-turn token totals and historical tool_result
+truncation up to date as messages are appended, so preparing the context
+before each LLM call only touches messages added since the previous call.
+"""
+
+from typing import Any, Callable, Dict, List
+
+from common.log import logger
+
+# Tool results in historical turns are cut down to this many chars
+MAX_HISTORY_RESULT_CHARS = 20000
+
+
+class ContextTurn:
+    """
+    One complete turn: a user query followed by AI replies, tool_use and tool_result messages
+    """
+
+    __slots__ = ("messages", "tokens", "historical")
+
+    def __init__(self):
+        self.messages: List[Dict[str, Any]] = []
+        self.tokens = 0
+        self.historical = False  # a later user query exists, tool results already truncated
+
+
+def is_user_query(message: Dict[str, Any]) -> bool:
+    """A user message carrying text (rather than only tool results) starts a new turn"""
+    if message.get("role") != "user":
+        return False
+    content = message.get("content", [])
+    if isinstance(content, str):
+        return True
+    if isinstance(content, list):
+        return any(isinstance(block, dict) and block.get("type") == "text" for block in content)
+    return False
+
+
+class ContextWindow:
+    """
+    Turn index over an executor's message list, maintained incrementally
+
+    The executor appends to (and occasionally pops from) the tail of its
+    message list; sync() folds in just those changes. Any other edit to
+    indexed messages (e.g. in-place truncation) must be followed by invalidate().
+    """
+
+    def __init__(self, estimate_tokens: Callable[[Dict[str, Any]], int]):
+        """
+        :param estimate_tokens: Token estimator for a single message
+        """
+        self._estimate_tokens = estimate_tokens
+        self.turns: List[ContextTurn] = []
+        self.total_tokens = 0
+        self._indexed: List[Dict[str, Any]] = []  # messages already folded into turns
+
+        # Stats
+        self.prepare_calls = 0
+        self.prepare_seconds_total = 0.0
+        self.prepare_seconds_last = 0.0
+        self.prepare_seconds_max = 0.0
+        self.messages_indexed = 0
+        self.rebuilds = 0
+        self._synced_last = 0
+
+    def sync(self, messages: List[Dict[str, Any]]) -> None:
+        """
+        Bring the index in line with messages, processing only the changed tail
+
+        :param messages: The executor's current message list
+        """
+        indexed = self._indexed
+        common = min(len(indexed), len(messages))
+        if common and messages[common - 1] is not indexed[common - 1]:
+            # the history was replaced or edited, not just extended
+            self._rebuild(messages)
+            return
+        if len(messages) < len(indexed):
+            self._rollback(len(messages))
+        new_messages = messages[len(self._indexed):]
+        for message in new_messages:
+            self._append(message)
+        self._synced_last = len(new_messages)
+
+    def invalidate(self) -> None:
+        """Drop the index; the next sync() rebuilds it from scratch"""
+        self.turns = []
+        self._indexed = []
+        self.total_tokens = 0
+
+    def reset_to(self, turns: List[ContextTurn]) -> List[Dict[str, Any]]:
+        """
+        Keep only the given turns (e.g. after trimming) and return their flattened messages
+
+        :param turns: Turns to keep, in order
+        :return: New message list matching the index
+        """
+        messages = []
+        for turn in turns:
+            messages.extend(turn.messages)
+        self.turns = list(turns)
+        self._indexed = list(messages)
+        self.total_tokens = sum(turn.tokens for turn in self.turns)
+        return messages
+
+    def record_prepare(self, seconds: float) -> None:
+        """Record time spent preparing context for one LLM call"""
+        self.prepare_calls += 1
+        self.prepare_seconds_total += seconds
+        self.prepare_seconds_last = seconds
+        self.prepare_seconds_max = max(self.prepare_seconds_max, seconds)
+        logger.debug(
+            f"[Agent] Context prepared in {seconds * 1000:.2f}ms "
+            f"(+{self._synced_last} msgs, {len(self.turns)} turns, ~{self.total_tokens} tokens)"
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        calls = self.prepare_calls
+        return {
+            "prepare_calls": calls,
+            "prepare_ms_total": round(self.prepare_seconds_total * 1000, 3),
+            "prepare_ms_avg": round(self.prepare_seconds_total * 1000 / calls, 3) if calls else 0.0,
+            "prepare_ms_last": round(self.prepare_seconds_last * 1000, 3),
+            "prepare_ms_max": round(self.prepare_seconds_max * 1000, 3),
+            "messages_indexed": self.messages_indexed,
+            "rebuilds": self.rebuilds,
+            "turns": len(self.turns),
+            "tokens": self.total_tokens,
+        }
+
+    def _rebuild(self, messages: List[Dict[str, Any]]) -> None:
+        self.invalidate()
+        self.rebuilds += 1
+        for message in messages:
+            self._append(message)
+        self._synced_last = len(messages)
+
+    def _append(self, message: Dict[str, Any]) -> None:
+        if not self.turns or is_user_query(message):
+            if self.turns:
+                self._mark_historical(self.turns[-1])
+            self.turns.append(ContextTurn())
+        turn = self.turns[-1]
+        tokens = self._estimate_tokens(message)
+        turn.messages.append(message)
+        turn.tokens += tokens
+        self.total_tokens += tokens
+        self._indexed.append(message)
+        self.messages_indexed += 1
+
+    def _rollback(self, length: int) -> None:
+        """Forget indexed messages beyond length (they were popped from the tail)"""
+        while len(self._indexed) > length:
+            self._indexed.pop()
+            turn = self.turns[-1]
+            turn.messages.pop()
+            if not turn.messages:
+                self.turns.pop()
+                self.total_tokens -= turn.tokens
+        if self.turns:
+            self._recount(self.turns[-1])
+
+    def _recount(self, turn: ContextTurn) -> None:
+        tokens = sum(self._estimate_tokens(message) for message in turn.messages)
+        self.total_tokens += tokens - turn.tokens
+        turn.tokens = tokens
+
+    def _mark_historical(self, turn: ContextTurn) -> None:
+        """
+        Truncate oversized tool results once a turn is no longer the current one
+
+        Current turn results are kept at up to 50K chars (truncated at creation time);
+        historical ones are cut to MAX_HISTORY_RESULT_CHARS so that oversized results
+        shrink before whole turns have to be dropped.
+        """
+        if turn.historical:
+            return
+        turn.historical = True
+        truncated_count = 0
+        for message in turn.messages:
+            if message.get("role") != "user":
+                continue
+            content = message.get("content", [])
+            if not isinstance(content, list):
+                continue
+            for block in content:
+                if not isinstance(block, dict) or block.get("type") != "tool_result":
+                    continue
+                result_str = block.get("content", "")
+                if isinstance(result_str, str) and len(result_str) > MAX_HISTORY_RESULT_CHARS:
+                    original_len = len(result_str)
+                    block["content"] = result_str[:MAX_HISTORY_RESULT_CHARS] + \
+                        f"\n\n[Historical output truncated: {original_len} -> {MAX_HISTORY_RESULT_CHARS} chars]"
+                    truncated_count += 1
+        if truncated_count > 0:
+            self._recount(turn)
+            logger.info(f"📎 Truncated {truncated_count} historical tool result(s) to {MAX_HISTORY_RESULT_CHARS} chars")
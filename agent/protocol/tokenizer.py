@@ -0,0 +1,273 @@
+"""
+Token counting for agent context budgeting.
+
+Each model family gets a tokenizer backend:
+- OpenAI models (gpt-*, o1/o3/o4): tiktoken, when installed and its encoding can be loaded
+- Qwen models: the local Qwen tokenizer shipped with dashscope
+- Everything else: a byte-class estimator
+
+Backends are resolved once per model name. Message counts are memoized per
+content block, so re-estimating a growing history only tokenizes new content.
+"""
+
+import functools
+import json
+import threading
+from typing import Any, Dict, Optional
+
+from common.log import logger
+from common.ttl_cache import TTLCache
+
+# Fixed overheads for non-text content blocks
+IMAGE_BLOCK_TOKENS = 1200
+TOOL_USE_OVERHEAD_TOKENS = 50
+TOOL_RESULT_OVERHEAD_TOKENS = 30
+UNKNOWN_BLOCK_TOKENS = 10
+
+# Strings shorter than this are cheaper to count than to look up
+_MEMO_MIN_CHARS = 64
+
+_text_cache = TTLCache(max_items=20000, max_bytes=64 * 1024 * 1024, ttl=0)
+_block_cache = TTLCache(max_items=5000, ttl=0)
+
+
+class Tokenizer:
+    """Base class for tokenizer backends"""
+
+    name = "base"
+
+    def count(self, text: str) -> int:
+        raise NotImplementedError
+
+
+class EstimateTokenizer(Tokenizer):
+    """
+    Estimate tokens from byte classes of the UTF-8 encoded text.
+
+    One bytes.translate maps every byte to its class, then bytes.count tallies
+    each class, so the whole estimate runs in C. Weights were fitted against a
+    real BPE tokenizer on code, markdown, JSON and Chinese text.
+    """
+
+    name = "estimate"
+
+    # class -> tokens per byte of that class
+    _WEIGHTS = (
+        (b"L", 0.22),  # ASCII letters, ~4.5 chars per token
+        (b"D", 0.5),  # digits, grouped 1-3 per token depending on the model
+        (b"S", 0.02),  # spaces and tabs, mostly merged into neighbouring tokens
+        (b"N", 1.0),  # newlines
+        (b"P", 0.42),  # ASCII punctuation
+        (b"2", 0.7),  # lead byte of 2-byte chars (Latin ext, Cyrillic, ...)
+        (b"3", 1.0),  # lead byte of 3-byte chars (CJK)
+        (b"4", 2.0),  # lead byte of 4-byte chars (emoji)
+    )
+
+    @staticmethod
+    def _build_class_table() -> bytes:
+        table = bytearray(256)
+        for b in range(256):
+            if b < 128:
+                ch = chr(b)
+                if ch.isalpha():
+                    cls = "L"
+                elif ch.isdigit():
+                    cls = "D"
+                elif ch == "\n":
+                    cls = "N"
+                elif ch in " \t\r\x0b\x0c":
+                    cls = "S"
+                else:
+                    cls = "P"
+            elif b < 0xC0:
+                cls = "x"  # continuation byte
+            elif b < 0xE0:
+                cls = "2"
+            elif b < 0xF0:
+                cls = "3"
+            else:
+                cls = "4"
+            table[b] = ord(cls)
+        return bytes(table)
+
+    def __init__(self):
+        self._table = self._build_class_table()
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        classes = text.encode("utf-8", "surrogatepass").translate(self._table)
+        return int(sum(classes.count(cls) * weight for cls, weight in self._WEIGHTS)) + 1
+
+
+class TiktokenTokenizer(Tokenizer):
+    """Exact counts for OpenAI models via tiktoken"""
+
+    name = "tiktoken"
+
+    def __init__(self, encoding):
+        self._encoding = encoding
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        return len(self._encoding.encode_ordinary(text))
+
+
+class QwenTokenizer(Tokenizer):
+    """Exact counts for Qwen models via the tokenizer bundled with dashscope"""
+
+    name = "qwen"
+
+    def __init__(self, tokenizer, fallback: Tokenizer):
+        self._tokenizer = tokenizer
+        self._fallback = fallback
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        try:
+            return len(self._tokenizer.encode(text))
+        except Exception:
+            # e.g. text containing special tokens
+            return self._fallback.count(text)
+
+
+_estimator = EstimateTokenizer()
+_backend_lock = threading.Lock()
+_failed_backends = set()
+
+
+def _is_openai_model(model: str) -> bool:
+    return model.startswith(("gpt-", "chatgpt-", "o1", "o3", "o4"))
+
+
+def _load_tiktoken(model: str) -> Optional[Tokenizer]:
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+        return TiktokenTokenizer(encoding)
+    except Exception as e:
+        # the BPE file is downloaded on first use and may be unreachable
+        logger.warning(f"[Tokenizer] failed to load tiktoken encoding for {model}, using estimate: {e}")
+        return None
+
+
+def _load_qwen(model: str) -> Optional[Tokenizer]:
+    try:
+        from dashscope import get_tokenizer as get_qwen_tokenizer
+        return QwenTokenizer(get_qwen_tokenizer("qwen-turbo"), _estimator)
+    except Exception as e:
+        logger.warning(f"[Tokenizer] failed to load qwen tokenizer for {model}, using estimate: {e}")
+        return None
+
+
+@functools.lru_cache(maxsize=128)
+def get_tokenizer(model: Optional[str] = None) -> Tokenizer:
+    """
+    Get the tokenizer backend for a model, resolved once per model name.
+
+    :param model: Model name, None for the estimator
+    :return: Tokenizer backend
+    """
+    if not model:
+        return _estimator
+    model = model.lower()
+    if _is_openai_model(model):
+        kind, loader = "tiktoken", _load_tiktoken
+    elif "qwen" in model:
+        kind, loader = "qwen", _load_qwen
+    else:
+        return _estimator
+    with _backend_lock:
+        # a failed load is not retried for other models of the same family
+        if kind in _failed_backends:
+            return _estimator
+        tokenizer = loader(model)
+        if tokenizer is None:
+            _failed_backends.add(kind)
+            return _estimator
+    logger.debug(f"[Tokenizer] using {tokenizer.name} for model {model}")
+    return tokenizer
+
+
+def count_text_tokens(text: str, model: Optional[str] = None) -> int:
+    """
+    Count tokens of a text string.
+
+    :param text: Input text
+    :param model: Model name used to pick the tokenizer backend
+    :return: Token count
+    """
+    if not text:
+        return 0
+    tokenizer = get_tokenizer(model)
+    if len(text) < _MEMO_MIN_CHARS:
+        return tokenizer.count(text)
+    # str caches its hash, so repeated lookups of the same string are O(1)
+    key = (tokenizer.name, text)
+    tokens = _text_cache.get(key)
+    if tokens is None:
+        tokens = tokenizer.count(text)
+        _text_cache.put(key, tokens, size=len(text))
+    return tokens
+
+
+def _count_tool_use_tokens(block: Dict[str, Any], model: Optional[str]) -> int:
+    input_data = block.get("input", {})
+    if not isinstance(input_data, dict):
+        return TOOL_USE_OVERHEAD_TOKENS
+    # Serializing the input is the expensive part, so memoize per block.
+    # Inputs may be edited in place (e.g. truncated), so the cached entry keeps
+    # the input values and is only reused while every one of them is unchanged.
+    values = tuple(input_data.values())
+    key = (get_tokenizer(model).name, id(block))
+    cached = _block_cache.get(key)
+    if (cached is not None and cached[0] is block and cached[1] is input_data
+            and len(cached[2]) == len(values) and all(a is b for a, b in zip(cached[2], values))):
+        return cached[3]
+    tokens = TOOL_USE_OVERHEAD_TOKENS + count_text_tokens(json.dumps(input_data, ensure_ascii=False), model)
+    # the entry references the block itself, so its id cannot be reused while cached
+    _block_cache.put(key, (block, input_data, values, tokens), size=0)
+    return tokens
+
+
+def count_message_tokens(message: Dict[str, Any], model: Optional[str] = None) -> int:
+    """
+    Count tokens of a message, including overhead for tool_use / tool_result / image blocks.
+
+    :param message: Message dict with 'role' and 'content'
+    :param model: Model name used to pick the tokenizer backend
+    :return: Token count, at least 1
+    """
+    content = message.get("content", "")
+    if isinstance(content, str):
+        return max(1, count_text_tokens(content, model))
+    if not isinstance(content, list):
+        return 1
+    total_tokens = 0
+    for part in content:
+        if not isinstance(part, dict):
+            continue
+        block_type = part.get("type", "")
+        if block_type == "text":
+            total_tokens += count_text_tokens(part.get("text", ""), model)
+        elif block_type == "image":
+            total_tokens += IMAGE_BLOCK_TOKENS
+        elif block_type == "tool_use":
+            total_tokens += _count_tool_use_tokens(part, model)
+        elif block_type == "tool_result":
+            total_tokens += TOOL_RESULT_OVERHEAD_TOKENS
+            result_content = part.get("content", "")
+            if isinstance(result_content, str):
+                total_tokens += count_text_tokens(result_content, model)
+        else:
+            # Unknown block type, estimate conservatively
+            total_tokens += UNKNOWN_BLOCK_TOKENS
+    return max(1, total_tokens)
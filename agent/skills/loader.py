@@ -62,7 +62,8 @@ class SkillLoader:
         diagnostics = []
         
         try:
-            entries = os.listdir(dir_path)
+            # 排序保证技能顺序稳定，系统提示词前缀不变才能命中提示词缓存
+            entries = sorted(os.listdir(dir_path))
         except Exception as e:
             diagnostics.append(f"Failed to list directory {dir_path}: {e}")
             return LoadSkillsResult(skills=skills, diagnostics=diagnostics)
@@ -38,6 +38,10 @@ class BaseTool:
     description: str = "Base tool"
     params: dict = {}  # Store JSON Schema
     model: Optional[Any] = None  # LLM model instance, type depends on bot implementation
+    # Side-effect-free tools may run concurrently with other parallel-safe calls in the same turn
+    parallel_safe: bool = False
+    # Set by the agent while the call runs alongside other calls of the same turn
+    in_parallel: bool = False
 
     @classmethod
     def get_json_schema(cls) -> dict:
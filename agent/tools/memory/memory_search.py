@@ -12,6 +12,7 @@ class MemorySearchTool(BaseTool):
     """Tool for searching agent memory"""
     
     name: str = "memory_search"
+    parallel_safe: bool = True
     description: str = (
         "Search agent's long-term memory using semantic and keyword search. "
         "Use this to recall past conversations, preferences, and knowledge."
@@ -70,13 +71,15 @@ class MemorySearchTool(BaseTool):
             return ToolResult.fail("Error: query parameter is required")
         
         try:
-            # Run async search in sync context
+            # Run async search in sync context. Parallel calls only read the
+            # index; a dirty index is synced by the next sequential search.
             results = asyncio.run(self.memory_manager.search(
                 query=query,
                 user_id=self.user_id,
                 max_results=max_results,
                 min_score=min_score,
-                include_shared=True
+                include_shared=True,
+                sync=not self.in_parallel
             ))
             
             if not results:
@@ -56,6 +56,14 @@ class ChannelManager:
     def get_channel(self, channel_name: str):
         return self._channels.get(channel_name)
 
+    def get_pool_stats(self) -> dict:
+        """Handler pool metrics (queue depth, wait time, rejections) per channel"""
+        return {
+            name: ch.get_pool_stats()
+            for name, ch in list(self._channels.items())
+            if hasattr(ch, "get_pool_stats")
+        }
+
     def start(self, channel_names: list, first_start: bool = False):
         """
         Create and start one or more channels in sub-threads.
@@ -1,30 +1,65 @@
 # encoding:utf-8
-import io
+import functools
+import hashlib
 import os
 import mimetypes
+import shutil
 import threading
 import json
 import time
+import uuid
 from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Any
 
 import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 from urllib.parse import urlparse, unquote
 
 from bot.bot import Bot
-from lib.dify.dify_client import DifyClient, ChatClient
+from lib.dify.dify_client import DifyClient, ChatClient, get_dify_session
 from bot.dify.dify_session import DifySession, DifySessionManager
 from bridge.context import ContextType, Context
 from bridge.reply import Reply, ReplyType
 from common.log import logger
 from common import const, memory
-from common.utils import parse_markdown_text, print_red
+from common.utils import fsize, parse_markdown_text, print_red
+from common.expired_dict import ExpiredDict
 from common.tmp_dir import TmpDir
+from common.ttl_cache import TTLCache
 from config import conf
 
 UNKNOWN_ERROR_MSG = "我暂时遇到了一些问题，请您稍后重试~"
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class DownloadTooLarge(Exception):
+    """下载内容超过 dify_download_max_size"""
+
+
+class _PendingUpload:
+    """已提交到线程池的附件上传"""
+    __slots__ = ("path", "task", "future")
+
+    def __init__(self, path, task, future):
+        self.path = path
+        self.task = task
+        self.future = future
+
+    def result(self):
+        # 调用方本身可能就在同一个线程池里：任务还没开始就取消并在当前线程执行，避免线程池占满时互相等待
+        if self.future.cancel():
+            return self.task()
+        return self.future.result()
+
+
+class _PendingDownload:
+    """进行中的下载，供同一URL的并发调用等待"""
+    __slots__ = ("done", "file_path", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.file_path = None
+        self.error = None
+
 
 class DifyBot(Bot):
     def __init__(self):
@@ -32,13 +67,25 @@ class DifyBot(Bot):
         self.sessions = DifySessionManager(DifySession, model=conf().get("model", const.DIFY))
         # 性能优化：使用线程池处理并发请求
         self.executor = ThreadPoolExecutor(max_workers=conf().get("dify_max_workers", 10))
-        # 请求缓存和重试机制
-        self.request_cache = {}
+        # 请求缓存（TTL + LRU，线程安全）和重试机制
+        self.request_cache = TTLCache(
+            max_items=conf().get("dify_cache_max_items", 1000),
+            max_bytes=conf().get("dify_cache_max_bytes", 50 * 1024 * 1024),
+            ttl=conf().get("dify_cache_ttl", 300),
+        )
         self.retry_config = {
             'max_retries': conf().get("dify_max_retries", 3),
             'retry_delay': conf().get("dify_retry_delay", 1.0),
             'timeout': conf().get("dify_timeout", 300)  # 默认300秒(5分钟)，给AI充足思考时间
         }
+        # 进行中的媒体下载 {url: _PendingDownload}，用于合并同一URL的并发下载
+        self._downloads = {}
+        self._downloads_lock = threading.Lock()
+        # 已提交、等待随提问一起发送的附件上传 {session_id: [_PendingUpload]}
+        self._pending_uploads = ExpiredDict(60 * 3)
+        self._uploads_lock = threading.Lock()
+        # 按内容哈希记忆的upload_file_id，重复发送的图片不再上传
+        self._upload_ids = TTLCache(max_items=2000, ttl=12 * 3600)
 
     def reply(self, query, context: Context=None):
         # acquire reply content
@@ -66,27 +113,11 @@ class DifyBot(Bot):
                 load_config()
                 return Reply(ReplyType.INFO, "配置已更新")
 
-            # TODO: 适配除微信以外的其他channel
-            channel_type = conf().get("channel_type", "wx")
-            user = None
-            if channel_type in ["wx", "wework", "gewechat"]:
-                user = context["msg"].other_user_nickname if context.get("msg") else "default"
-            elif channel_type in ["wechatcom_app", "wechatcom_aibot", "wechatmp", "wechatmp_service", "wechatcom_service", "web"]:
-                # 对于群聊，使用群ID（保持上下文连续）；对于单聊，使用对方ID
-                msg = context.get("msg")
-                if msg:
-                    # 企业微信智能机器人群聊：使用群ID作为user，保持群内上下文连续
-                    # 其他场景：群聊使用实际发送者ID，单聊使用对方ID
-                    if channel_type == "wechatcom_aibot" and context.get("isgroup", False):
-                        user = msg.other_user_id  # 群ID
-                    else:
-                        user = msg.actual_user_id if context.get("isgroup", False) else msg.other_user_id
-                else:
-                    user = "default"
-            else:
+            user = self._get_dify_user(context)
+            if user is None:
+                channel_type = conf().get("channel_type", "wx")
                 return Reply(ReplyType.ERROR, f"unsupported channel type: {channel_type}, now dify only support wx, wechatcom_app, wechatcom_aibot, wechatmp, wechatmp_service channel")
             logger.debug(f"[DIFY] dify_user={user}, isgroup={context.get('isgroup', False)}")
-            user = user if user else "default" # 防止用户名为None，当被邀请进的群未设置群名称时用户名为None
             session = self.sessions.get_session(session_id, user)
             if context.get("isgroup", False):
                 # 群聊：根据是否是共享会话群来决定是否设置用户信息
@@ -121,6 +152,29 @@ class DifyBot(Bot):
             reply = Reply(ReplyType.ERROR, "Bot不支持处理{}类型的消息".format(context.type))
             return reply
 
+    def _get_dify_user(self, context: Context) -> Optional[str]:
+        """根据channel确定Dify的user，不支持的channel返回None"""
+        # TODO: 适配除微信以外的其他channel
+        channel_type = conf().get("channel_type", "wx")
+        user = None
+        if channel_type in ["wx", "wework", "gewechat"]:
+            user = context["msg"].other_user_nickname if context.get("msg") else "default"
+        elif channel_type in ["wechatcom_app", "wechatcom_aibot", "wechatmp", "wechatmp_service", "wechatcom_service", "web"]:
+            # 对于群聊，使用群ID（保持上下文连续）；对于单聊，使用对方ID
+            msg = context.get("msg")
+            if msg:
+                # 企业微信智能机器人群聊：使用群ID作为user，保持群内上下文连续
+                # 其他场景：群聊使用实际发送者ID，单聊使用对方ID
+                if channel_type == "wechatcom_aibot" and context.get("isgroup", False):
+                    user = msg.other_user_id  # 群ID
+                else:
+                    user = msg.actual_user_id if context.get("isgroup", False) else msg.other_user_id
+            else:
+                user = "default"
+        else:
+            return None
+        return user if user else "default" # 防止用户名为None，当被邀请进的群未设置群名称时用户名为None
+
     # TODO: delete this function
     def _get_payload(self, query, session: DifySession, response_mode):
         # 输入的变量参考 wechat-assistant-pro：https://github.com/leochen-g/wechat-assistant-pro/issues/76
@@ -158,11 +212,10 @@ class DifyBot(Bot):
 
             # 性能优化：使用缓存避免重复请求
             cache_key = self._generate_cache_key(query, session, context)
-            if cache_key in self.request_cache:
-                cached_result = self.request_cache[cache_key]
-                if time.time() - cached_result['timestamp'] < 300:  # 5分钟缓存
-                    logger.info(f"[DIFY] Using cached response for query: {query[:50]}...")
-                    return cached_result['result'], cached_result['error']
+            cached_result = self.request_cache.get(cache_key) if cache_key else None
+            if cached_result is not None:
+                logger.info(f"[DIFY] Using cached response for query: {query[:50]}...")
+                return cached_result
 
             dify_app_type = self._get_dify_conf(context, "dify_app_type", 'chatbot')
 
@@ -186,13 +239,7 @@ class DifyBot(Bot):
 
             # 缓存结果
             if cache_key and result:
-                self.request_cache[cache_key] = {
-                    'result': result,
-                    'error': error,
-                    'timestamp': time.time()
-                }
-                # 清理过期缓存
-                self._cleanup_cache()
+                self.request_cache.put(cache_key, (result, error), tag=context.get("session_id"))
 
             return result, error
 
@@ -363,34 +410,28 @@ class DifyBot(Bot):
             return False
 
     def _download_file(self, url):
-        """下载图片、音频和文档文件，其他文件返回None"""
+        """下载图片、音频和文档文件到临时目录，返回文件路径；其他文件返回None"""
         if not self._is_downloadable_file(url):
             logger.info(f"[DIFY] File type not supported for download: {url}")
             return None
 
+        # 从路径中提取文件名
+        file_name = unquote(urlparse(url).path).split('/')[-1] or "download_file"
+        file_path = os.path.join(TmpDir().path(), file_name)
         try:
             logger.info(f"[DIFY] Starting file download from {url}")
-            response = requests.get(url, timeout=self.retry_config['timeout'])
-            response.raise_for_status()
-            parsed_url = urlparse(url)
-            url_path = unquote(parsed_url.path)
-            # 从路径中提取文件名
-            file_name = url_path.split('/')[-1]
-            if not file_name:
-                file_name = "download_file"
-            logger.info(f"[DIFY] Saving file as {file_name}")
-            file_path = os.path.join(TmpDir().path(), file_name)
-            with open(file_path, 'wb') as file:
-                file.write(response.content)
-            file_size = os.path.getsize(file_path)
-            logger.info(f"[DIFY] File downloaded successfully: {file_path}, size: {file_size} bytes")
+            self._stream_download(url, file_path)
+            logger.info(f"[DIFY] File downloaded successfully: {file_path}, size: {os.path.getsize(file_path)} bytes")
             return file_path
         except Exception as e:
             logger.error(f"[DIFY] Error downloading file from {url}: {e}")
             return None
 
     def _download_image(self, url):
-        """下载图片并返回BytesIO对象，支持重试机制和防盗链处理"""
+        """
+        下载图片，返回已打开的只读文件对象（channel可直接seek/read或上传），
+        支持重试机制和防盗链处理
+        """
         max_attempts = 3
 
         # 不同的请求头策略，用于绕过防盗链
@@ -414,6 +455,10 @@ class DifyBot(Bot):
             }
         ]
 
+        # 以URL哈希命名，同一图片的并发下载落到同一个文件上
+        ext = os.path.splitext(unquote(urlparse(url).path))[1][:10] or ".img"
+        file_path = os.path.join(TmpDir().path(), "dify_img_" + hashlib.sha1(url.encode('utf-8')).hexdigest()[:16] + ext)
+
         for attempt in range(max_attempts):
             # 选择请求头策略
             headers = headers_strategies[attempt % len(headers_strategies)]
@@ -421,45 +466,77 @@ class DifyBot(Bot):
             try:
                 logger.info(f"[DIFY] Starting image download from {url} (attempt {attempt + 1}/{max_attempts})")
                 logger.debug(f"[DIFY] Using headers: {headers}")
+                self._stream_download(url, file_path, headers=headers)
+                logger.info(f"[DIFY] Image download success, size={os.path.getsize(file_path)}, img_url={url}")
+                return open(file_path, 'rb')
 
-                pic_res = requests.get(url, headers=headers, stream=True, timeout=self.retry_config['timeout'])
-                pic_res.raise_for_status()
-
-                image_storage = io.BytesIO()
-                size = 0
-                for block in pic_res.iter_content(1024):
-                    size += len(block)
-                    image_storage.write(block)
-
-                logger.info(f"[DIFY] Image download success, size={size}, img_url={url}")
-                image_storage.seek(0)
-                return image_storage
-
+            except DownloadTooLarge as e:
+                # 超出大小限制，换请求头重试也没有意义
+                logger.warning(f"[DIFY] Image download aborted: {e}")
+                return None
             except Exception as e:
                 logger.warning(f"[DIFY] Image download attempt {attempt + 1} failed with headers strategy {attempt % len(headers_strategies) + 1}: {e}")
                 if attempt == max_attempts - 1:
                     logger.error(f"[DIFY] All {max_attempts} attempts failed for image download from {url}")
                     return None
                 # 短暂等待后重试
-                import time
                 time.sleep(1)
         return None
 
-    def _download_image(self, url):
+    def _stream_download(self, url: str, file_path: str, headers: Optional[dict] = None) -> str:
+        """
+        流式下载到 file_path：边收边写盘，不把整个响应读进内存
+
+        - 先按 Content-Length、再按已接收字节数检查 dify_download_max_size，超出立即中止
+        - 写入临时文件，完成后原子替换，其他线程不会读到半个文件
+        - 同一URL的并发下载只发起一次请求，其余调用等待并共享结果
+        """
+        with self._downloads_lock:
+            pending = self._downloads.get(url)
+            leader = pending is None
+            if leader:
+                pending = self._downloads[url] = _PendingDownload()
+        if not leader:
+            pending.done.wait()
+            if pending.error:
+                raise pending.error
+            if pending.file_path != file_path:
+                shutil.copyfile(pending.file_path, file_path)
+            return file_path
+
         try:
-            pic_res = requests.get(url, stream=True)
-            pic_res.raise_for_status()
-            image_storage = io.BytesIO()
-            size = 0
-            for block in pic_res.iter_content(1024):
-                size += len(block)
-                image_storage.write(block)
-            logger.debug(f"[WX] download image success, size={size}, img_url={url}")
-            image_storage.seek(0)
-            return image_storage
+            self._fetch_to_file(url, file_path, headers)
+            pending.file_path = file_path
+            return file_path
         except Exception as e:
-            logger.error(f"Error downloading {url}: {e}")
-        return None
+            pending.error = e
+            raise
+        finally:
+            with self._downloads_lock:
+                self._downloads.pop(url, None)
+            pending.done.set()
+
+    def _fetch_to_file(self, url: str, file_path: str, headers: Optional[dict] = None):
+        max_size = conf().get("dify_download_max_size", 100 * 1024 * 1024)
+        tmp_path = f"{file_path}.{uuid.uuid4().hex[:8]}.part"
+        with get_dify_session().get(url, headers=headers, stream=True, timeout=self.retry_config['timeout']) as response:
+            response.raise_for_status()
+            content_length = int(response.headers.get('Content-Length') or 0)
+            if max_size and content_length > max_size:
+                raise DownloadTooLarge(f"{url} is {content_length} bytes, limit is {max_size}")
+            size = 0
+            try:
+                with open(tmp_path, 'wb') as file:
+                    for block in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        size += len(block)
+                        if max_size and size > max_size:
+                            raise DownloadTooLarge(f"{url} exceeds limit of {max_size} bytes")
+                        file.write(block)
+                os.replace(tmp_path, file_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
 
     def _optimize_query(self, query: str) -> str:
         """优化用户输入,避免触发内容过滤
@@ -539,7 +616,7 @@ class DifyBot(Bot):
                     current_query = optimized_query
                     continue
 
-                msgs, conversation_id = self._handle_sse_response(response)
+                msgs, conversation_id = self._handle_sse_response(response, context)
                 
                 # 如果查询经过了优化并且成功了,记录这个成功案例
                 if current_query != original_query:
@@ -657,52 +734,93 @@ class DifyBot(Bot):
         reply = Reply(ReplyType.TEXT, rsp_data['data']['outputs']['text'])
         return reply, None
 
+    def prefetch_attachment(self, context: Context, path: str, msg=None):
+        """
+        用户发来图片时立即在线程池中上传到Dify，不必等到提问时再串行上传
+        提问时由 _get_upload_files 收集该会话所有已上传/上传中的文件
+        """
+        if not path or not self._get_dify_conf(context, "image_recognition", False):
+            return
+        user = self._get_dify_user(context)
+        if user is None:
+            return
+        session_id = context["session_id"]
+        pending = self._submit_upload(path, msg, user, context)
+        with self._uploads_lock:
+            uploads = self._pending_uploads.get(session_id) or []
+            uploads.append(pending)
+            self._pending_uploads[session_id] = uploads
+        logger.info(f"[DIFY] Prefetching upload for session {session_id}: {path}")
+
     def _get_upload_files(self, session: DifySession, context: Context):
+        """收集会话中缓存的附件（可能已在后台上传），并行等待上传完成，返回Dify files参数"""
+        if not self._get_dify_conf(context, "image_recognition", False):
+            return None
         session_id = session.get_session_id()
+        with self._uploads_lock:
+            uploads = self._pending_uploads.get(session_id) or []
+            self._pending_uploads[session_id] = None
+
+        # 没有经过 prefetch_attachment 的图片（如插件写入的缓存），此时再提交上传
         img_cache = memory.USER_IMAGE_CACHE.get(session_id)
-        if not img_cache or not self._get_dify_conf(context, "image_recognition", False):
+        if img_cache:
+            # 清理图片缓存
+            memory.USER_IMAGE_CACHE[session_id] = None
+            path = img_cache.get("path")
+            if path and path not in [upload.path for upload in uploads]:
+                uploads.append(self._submit_upload(path, img_cache.get("msg"), session.get_user(), context))
+
+        if not uploads:
             return None
-
-        logger.info(f"[DIFY] Processing image upload for session: {session_id}")
-
-        # 清理图片缓存
-        memory.USER_IMAGE_CACHE[session_id] = None
+        logger.info(f"[DIFY] Processing {len(uploads)} file upload(s) for session: {session_id}")
+
+        files = []
+        for upload in uploads:
+            file_id = upload.result()
+            if file_id:
+                files.append({
+                    "type": "image",
+                    "transfer_method": "local_file",
+                    "upload_file_id": file_id
+                })
+        return files or None
+
+    def _submit_upload(self, path: str, msg, user: str, context: Context) -> "_PendingUpload":
         api_key = self._get_dify_conf(context, "dify_api_key", '')
         api_base = self._get_dify_conf(context, "dify_api_base", "https://api.dify.ai/v1")
+        task = functools.partial(self._upload_file, path, msg, user, api_key, api_base)
+        return _PendingUpload(path, task, self.executor.submit(task))
 
+    def _upload_file(self, path: str, msg, user: str, api_key: str, api_base: str) -> Optional[str]:
+        """上传单个文件，返回upload_file_id；相同内容（按哈希）只上传一次"""
         if not api_key:
             logger.error("[DIFY] No API key configured for image upload")
             return None
 
-        dify_client = DifyClient(api_key, api_base)
-        msg = img_cache.get("msg")
-        path = img_cache.get("path")
-
-        if not path:
-            logger.error(f"[DIFY] No image path in cache")
-            return None
-
         # 确保图片文件已下载
         if msg and hasattr(msg, 'prepare'):
             logger.info(f"[DIFY] Preparing image download...")
             msg.prepare()
 
         # 等待文件下载完成，最多等待10秒
-        import time
-        max_wait = 10
-        wait_time = 0
-        while not os.path.exists(path) and wait_time < max_wait:
-            logger.info(f"[DIFY] Waiting for image download... ({wait_time}s)")
-            time.sleep(1)
-            wait_time += 1
-
+        deadline = time.monotonic() + 10
+        while not os.path.exists(path) and time.monotonic() < deadline:
+            time.sleep(0.05)
         if not os.path.exists(path):
             logger.error(f"[DIFY] Image file not found after waiting: {path}")
             return None
 
-        logger.info(f"[DIFY] Image file ready: {path}")
-
         try:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as file:
+                for block in iter(lambda: file.read(DOWNLOAD_CHUNK_SIZE), b''):
+                    digest.update(block)
+            memo_key = (api_base, api_key, user, digest.hexdigest())
+            file_id = self._upload_ids.get(memo_key)
+            if file_id:
+                logger.info(f"[DIFY] Reusing uploaded file {file_id} for {path}")
+                return file_id
+
             with open(path, 'rb') as file:
                 file_name = os.path.basename(path)
                 file_type, _ = mimetypes.guess_type(file_name)
@@ -714,26 +832,17 @@ class DifyBot(Bot):
                 files = {
                     'file': (file_name, file, file_type)
                 }
-                response = dify_client.file_upload(user=session.get_user(), files=files)
+                response = DifyClient(api_key, api_base).file_upload(user=user, files=files)
 
             if response.status_code != 200 and response.status_code != 201:
                 error_info = f"[DIFY] File upload failed - status: {response.status_code}, response: {response.text}"
                 logger.warning(error_info)
                 return None
 
-            try:
-                file_upload_data = response.json()
-                logger.info(f"[DIFY] File uploaded successfully: {file_upload_data}")
-                return [
-                    {
-                        "type": "image",
-                        "transfer_method": "local_file",
-                        "upload_file_id": file_upload_data['id']
-                    }
-                ]
-            except Exception as e:
-                logger.error(f"[DIFY] Failed to parse upload response: {e}")
-                return None
+            file_upload_data = response.json()
+            logger.info(f"[DIFY] File uploaded successfully: {file_upload_data}")
+            self._upload_ids.put(memo_key, file_upload_data['id'], size=len(file_upload_data['id']))
+            return file_upload_data['id']
 
         except Exception as e:
             logger.error(f"[DIFY] Exception during file upload: {e}")
@@ -779,35 +888,43 @@ class DifyBot(Bot):
             logger.warning("Received an empty SSE event.")
             return None
 
-    # TODO: 异步返回events
-    def _handle_sse_response(self, response: requests.Response):
-        events = []
-        for line in response.iter_lines():
+    def _iter_sse_events(self, response: requests.Response):
+        """
+        增量解析SSE流，每收到一个完整事件就立即产出，不等待整个响应结束
+        """
+        # chunk_size=None: 数据到达即返回，避免默认512字节分块把小事件憋在缓冲区里
+        for line in response.iter_lines(chunk_size=None):
             if line:
-                decoded_line = line.decode('utf-8')
-                event = self._parse_sse_event(decoded_line)
+                event = self._parse_sse_event(line.decode('utf-8'))
                 if event:
-                    events.append(event)
+                    yield event
 
-        merged_message = []
+    def _iter_sse_messages(self, response: requests.Response):
+        """
+        把Dify流式事件转换成消息片段，边收边产出：
+        - {'type': 'delta', 'content': str, 'conversation_id': str}  文本增量
+        - {'type': 'agent_message', 'content': str}  一段完整文本（遇到思考、文件或结束时切分）
+        - {'type': 'agent_thought', 'content': dict}
+        - {'type': 'message_file', 'content': dict}
+        """
         accumulated_agent_message = ''
-        conversation_id = None
-        for event in events:
+        for event in self._iter_sse_events(response):
             event_name = event['event']
             if event_name == 'agent_message' or event_name == 'message':
-                accumulated_agent_message += event['answer']
-                logger.debug("[DIFY] accumulated_agent_message: {}".format(accumulated_agent_message))
-                # 保存conversation_id
-                if not conversation_id:
-                    conversation_id = event['conversation_id']
+                answer = event.get('answer', '')
+                accumulated_agent_message += answer
+                yield {'type': 'delta', 'content': answer, 'conversation_id': event.get('conversation_id')}
             elif event_name == 'agent_thought':
-                self._append_agent_message(accumulated_agent_message, merged_message)
-                accumulated_agent_message = ''
+                if accumulated_agent_message:
+                    yield {'type': 'agent_message', 'content': accumulated_agent_message}
+                    accumulated_agent_message = ''
                 logger.debug("[DIFY] agent_thought: {}".format(event))
+                yield {'type': 'agent_thought', 'content': event}
             elif event_name == 'message_file':
-                self._append_agent_message(accumulated_agent_message, merged_message)
-                accumulated_agent_message = ''
-                self._append_message_file(event, merged_message)
+                if accumulated_agent_message:
+                    yield {'type': 'agent_message', 'content': accumulated_agent_message}
+                    accumulated_agent_message = ''
+                yield {'type': 'message_file', 'content': event}
             elif event_name == 'message_replace':
                 # TODO: handle message_replace
                 pass
@@ -815,9 +932,10 @@ class DifyBot(Bot):
                 logger.error("[DIFY] error: {}".format(event))
                 raise Exception(event)
             elif event_name == 'message_end':
-                self._append_agent_message(accumulated_agent_message, merged_message)
-                logger.debug("[DIFY] message_end usage: {}".format(event['metadata']['usage']))
-                break
+                if accumulated_agent_message:
+                    yield {'type': 'agent_message', 'content': accumulated_agent_message}
+                logger.debug("[DIFY] message_end usage: {}".format(event.get('metadata', {}).get('usage')))
+                return
             elif event_name == 'node_finished':
                 # 工作流节点完成事件，记录但不处理
                 logger.debug("[DIFY] node_finished: {}".format(event.get('data', {}).get('node_type', 'unknown')))
@@ -827,11 +945,45 @@ class DifyBot(Bot):
             else:
                 logger.warning("[DIFY] unknown event: {}".format(event))
 
+    def _handle_sse_response(self, response: requests.Response, context: Context = None):
+        """
+        消费流式响应，返回 (merged_message, conversation_id)
+
+        如果channel在context中注入了 on_event 回调（web SSE、企业微信智能机器人流式消息、飞书卡片），
+        文本增量会在到达时立即转发，用户无需等待整段回复生成完毕
+        """
+        on_event = context.get("on_event") if context else None
+        merged_message = []
+        conversation_id = None
+        try:
+            for item in self._iter_sse_messages(response):
+                item_type = item['type']
+                if item_type == 'delta':
+                    # 保存conversation_id
+                    if not conversation_id:
+                        conversation_id = item['conversation_id']
+                    if on_event and item['content']:
+                        self._emit_stream_event(on_event, "message_update", {"delta": item['content']})
+                elif item_type == 'agent_message':
+                    self._append_agent_message(item['content'], merged_message)
+                elif item_type == 'message_file':
+                    self._append_message_file(item['content'], merged_message)
+        finally:
+            # message_end 之后不再读取剩余数据，及时归还连接
+            response.close()
+
         if not conversation_id:
             raise Exception("conversation_id not found")
 
         return merged_message, conversation_id
 
+    def _emit_stream_event(self, on_event, event_type: str, data: dict):
+        """转发流式事件给channel，回调异常不影响回复生成"""
+        try:
+            on_event({"type": event_type, "data": data})
+        except Exception as e:
+            logger.warning(f"[DIFY] stream callback failed: {e}")
+
     def _append_agent_message(self, accumulated_agent_message,  merged_message):
         if accumulated_agent_message:
             merged_message.append({
@@ -887,41 +1039,14 @@ class DifyBot(Bot):
         except Exception:
             return None
 
-    def _cleanup_cache(self):
-        """清理过期缓存"""
-        try:
-            current_time = time.time()
-            expired_keys = [
-                key for key, value in self.request_cache.items()
-                if current_time - value['timestamp'] > 300
-            ]
-            for key in expired_keys:
-                del self.request_cache[key]
-
-            # 限制缓存大小
-            if len(self.request_cache) > 1000:
-                # 删除最旧的一半缓存
-                sorted_items = sorted(
-                    self.request_cache.items(),
-                    key=lambda x: x[1]['timestamp']
-                )
-                for key, _ in sorted_items[:500]:
-                    del self.request_cache[key]
-        except Exception as e:
-            logger.warning(f"[DIFY] Cache cleanup failed: {e}")
-
     def _clear_user_cache(self, session_id: str):
         """清除特定用户的缓存"""
-        try:
-            keys_to_remove = [
-                key for key in self.request_cache.keys()
-                if session_id in key
-            ]
-            for key in keys_to_remove:
-                del self.request_cache[key]
-            logger.info(f"[DIFY] Cleared {len(keys_to_remove)} cache entries for session: {session_id}")
-        except Exception as e:
-            logger.warning(f"[DIFY] Failed to clear user cache: {e}")
+        removed = self.request_cache.invalidate_tag(session_id)
+        logger.info(f"[DIFY] Cleared {removed} cache entries for session: {session_id}")
+
+    def get_cache_stats(self) -> dict:
+        """请求缓存的命中、淘汰等统计"""
+        return self.request_cache.get_stats()
 
     def _handle_request_with_retry(self, dify_app_type: str, query: str, session: DifySession, context: Context):
         """简化的请求处理：避免重复请求Dify"""
@@ -995,82 +1120,45 @@ class DifyBot(Bot):
 
 
 
-    def _create_optimized_session(self):
-        """创建优化的HTTP会话，提升连接稳定性"""
-        session = requests.Session()
-
-        # 配置重试策略
-        retry_strategy = Retry(
-            total=3,  # 总重试次数
-            backoff_factor=1,  # 退避因子
-            status_forcelist=[429, 500, 502, 503, 504],  # 需要重试的状态码
-            allowed_methods=["HEAD", "GET", "POST"]  # 允许重试的方法
-        )
-
-        # 配置HTTP适配器
-        adapter = HTTPAdapter(
-            max_retries=retry_strategy,
-            pool_connections=20,  # 连接池大小
-            pool_maxsize=20,  # 最大连接数
-            pool_block=False  # 非阻塞
-        )
-
-        # 为HTTP和HTTPS设置适配器
-        session.mount("http://", adapter)
-        session.mount("https://", adapter)
-
-        # 设置超时 - 给AI充足的思考时间
-        session.timeout = (60, 300)  # (连接超时60秒, 读取超时300秒/5分钟)
-
-        return session
-
     def _handle_chatbot_optimized(self, query: str, session: DifySession, context: Context):
         """优化版本的chatbot处理，使用streaming响应提升稳定性"""
         logger.info("[DIFY] 🤖 ChatBot模式：使用streaming响应（提升稳定性）")
         api_key = self._get_dify_conf(context, "dify_api_key", '')
         api_base = self._get_dify_conf(context, "dify_api_base", "https://api.dify.ai/v1")
 
-        # 使用优化的HTTP会话，提升连接稳定性
-        with self._create_optimized_session() as session_http:
-            session_http.headers.update({
-                'Authorization': f'Bearer {api_key}',
-                'Content-Type': 'application/json'
-            })
-            logger.info("[DIFY] 🔗 使用优化的连接池配置")
+        timeout = self._get_timeout_for_query(query, context)
+        chat_client = ChatClient(api_key, api_base, timeout)
+        response_mode = 'streaming'  # 改为streaming，提升稳定性
+        payload = self._get_payload(query, session, response_mode)
+        files = self._get_upload_files(session, context)
 
-            timeout = self._get_timeout_for_query(query, context)
-            chat_client = ChatClient(api_key, api_base, timeout)
-            response_mode = 'streaming'  # 改为streaming，提升稳定性
-            payload = self._get_payload(query, session, response_mode)
-            files = self._get_upload_files(session, context)
-
-            # 设置超时和重试
-            response = chat_client.create_chat_message(
-                inputs=payload['inputs'],
-                query=payload['query'],
-                user=payload['user'],
-                response_mode=payload['response_mode'],
-                conversation_id=payload['conversation_id'],
-                files=files
-            )
-
-            if response.status_code != 200:
-                error_info = f"[DIFY] payload={payload} response text={response.text} status_code={response.status_code}"
-                logger.warning(error_info)
-                friendly_error_msg = self._handle_error_response(response.text, response.status_code)
-                return None, friendly_error_msg
+        # 设置超时和重试
+        response = chat_client.create_chat_message(
+            inputs=payload['inputs'],
+            query=payload['query'],
+            user=payload['user'],
+            response_mode=payload['response_mode'],
+            conversation_id=payload['conversation_id'],
+            files=files
+        )
 
-            # 使用streaming响应处理，与Agent模式相同
-            msgs, conversation_id = self._handle_sse_response(response)
+        if response.status_code != 200:
+            error_info = f"[DIFY] payload={payload} response text={response.text} status_code={response.status_code}"
+            logger.warning(error_info)
+            friendly_error_msg = self._handle_error_response(response.text, response.status_code)
+            return None, friendly_error_msg
 
-            # 检查空回复
-            if not msgs:
-                logger.warning("[DIFY] Received empty streaming response from Dify")
-                return None, "抱歉，我暂时无法回答您的问题，请稍后再试。"
+        # 使用streaming响应处理，与Agent模式相同
+        msgs, conversation_id = self._handle_sse_response(response, context)
 
-            logger.info("[DIFY] ✅ ChatBot streaming模式成功")
-            # 处理流式响应（包含媒体内容解析）
-            return self._process_streaming_messages(msgs, context, session, conversation_id)
+        # 检查空回复
+        if not msgs:
+            logger.warning("[DIFY] Received empty streaming response from Dify")
+            return None, "抱歉，我暂时无法回答您的问题，请稍后再试。"
+
+        logger.info("[DIFY] ✅ ChatBot streaming模式成功")
+        # 处理流式响应（包含媒体内容解析）
+        return self._process_streaming_messages(msgs, context, session, conversation_id)
 
     def _handle_agent_optimized(self, query: str, session: DifySession, context: Context):
         """优化版本的agent处理，使用流式响应提升性能和媒体内容支持"""
@@ -1099,7 +1187,7 @@ class DifyBot(Bot):
             friendly_error_msg = self._handle_error_response(response.text, response.status_code)
             return None, friendly_error_msg
 
-        msgs, conversation_id = self._handle_sse_response(response)
+        msgs, conversation_id = self._handle_sse_response(response, context)
 
         # 检查空回复
         if not msgs:
@@ -1249,7 +1337,7 @@ class DifyBot(Bot):
             logger.info(f"[DIFY] 📥 步骤1: 开始下载图片...")
             image = self._download_image(image_url)
             if image:
-                logger.info(f"[DIFY] ✅ 步骤1: 图片下载成功，大小: {len(image.getvalue())} bytes")
+                logger.info(f"[DIFY] ✅ 步骤1: 图片下载成功，大小: {fsize(image)} bytes")
                 logger.info(f"[DIFY] 🎯 创建IMAGE类型回复，将由企业微信channel处理上传")
                 return Reply(ReplyType.IMAGE, image)
             else:
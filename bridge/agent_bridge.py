@@ -6,6 +6,7 @@ import os
 from typing import Optional, List
 
 from agent.protocol import Agent, LLMModel, LLMRequest
+from bridge.agent_cache import AgentCache
 from bridge.agent_event_handler import AgentEventHandler
 from bridge.agent_initializer import AgentInitializer
 from bridge.bridge import Bridge
@@ -225,14 +226,22 @@ class AgentBridge:
     """
     
     def __init__(self, bridge: Bridge):
+        from config import conf
         self.bridge = bridge
-        self.agents = {}  # session_id -> Agent instance mapping
+        # session_id -> Agent instance, bounded by LRU and idle-TTL eviction
+        self.agents = AgentCache(
+            max_sessions=conf().get("agent_cache_max_sessions", 500),
+            idle_ttl=conf().get("agent_cache_idle_ttl", 3600),
+        )
+        self.agents.start_sweeper()
         self.default_agent = None  # For backward compatibility (no session_id)
         self.agent: Optional[Agent] = None
         self.scheduler_initialized = False
         
         # Create helper instances
         self.initializer = AgentInitializer(bridge, self)
+        self.agents.on_evict = self.initializer.release_agent
+
     def create_agent(self, system_prompt: str, tools: List = None, **kwargs) -> Agent:
         """
         Create the super agent with COW integration
@@ -273,6 +282,7 @@ class AgentBridge:
             max_steps=kwargs.get("max_steps", 15),
             output_mode=kwargs.get("output_mode", "logger"),
             workspace_dir=kwargs.get("workspace_dir"),  # Pass workspace for skills loading
+            skill_manager=kwargs.get("skill_manager"),  # Shared skill manager, if provided
             enable_skills=kwargs.get("enable_skills", True),  # Enable skills by default
             memory_manager=kwargs.get("memory_manager"),  # Pass memory manager
             max_context_tokens=kwargs.get("max_context_tokens"),
@@ -302,21 +312,21 @@ class AgentBridge:
                 self._init_default_agent()
             return self.default_agent
         
-        # Check if agent exists for this session
-        if session_id not in self.agents:
-            self._init_agent_for_session(session_id)
-        
-        return self.agents[session_id]
+        # Get cached agent, or build one (restoring history from ConversationStore)
+        return self.agents.get(session_id, self._init_agent_for_session)
     
     def _init_default_agent(self):
         """Initialize default super agent"""
         agent = self.initializer.initialize_agent(session_id=None)
         self.default_agent = agent
     
-    def _init_agent_for_session(self, session_id: str):
+    def _init_agent_for_session(self, session_id: str) -> Agent:
         """Initialize agent for a specific session"""
-        agent = self.initializer.initialize_agent(session_id=session_id)
-        self.agents[session_id] = agent
+        return self.initializer.initialize_agent(session_id=session_id)
+
+    def get_agent_cache_stats(self) -> dict:
+        """Resident agent count, evictions and rehydration latency"""
+        return self.agents.get_stats()
     
     def agent_reply(self, query: str, context: Context = None, 
                    on_event=None, clear_history: bool = False) -> Reply:
@@ -338,84 +348,96 @@ class AgentBridge:
             if context:
                 session_id = context.kwargs.get("session_id") or context.get("session_id")
             
-            # Get agent for this session (will auto-initialize if needed)
-            agent = self.get_agent(session_id=session_id)
+            # Get agent for this session (will auto-initialize if needed),
+            # pinned so it cannot be evicted while the run is in progress
+            if session_id is None:
+                agent = self.get_agent(session_id=None)
+            else:
+                agent = self.agents.acquire(session_id, self._init_agent_for_session)
             if not agent:
                 return Reply(ReplyType.ERROR, "Failed to initialize super agent")
-            
-            # Create event handler for logging and channel communication
-            event_handler = AgentEventHandler(context=context, original_callback=on_event)
-            
-            # Filter tools based on context
-            original_tools = agent.tools
-            filtered_tools = original_tools
-            
-            # If this is a scheduled task execution, exclude scheduler tool to prevent recursion
-            if context and context.get("is_scheduled_task"):
-                filtered_tools = [tool for tool in agent.tools if tool.name != "scheduler"]
-                agent.tools = filtered_tools
-                logger.info(f"[AgentBridge] Scheduled task execution: excluded scheduler tool ({len(filtered_tools)}/{len(original_tools)} tools)")
-            else:
-                # Attach context to scheduler tool if present
-                if context and agent.tools:
-                    for tool in agent.tools:
-                        if tool.name == "scheduler":
-                            try:
-                                from agent.tools.scheduler.integration import attach_scheduler_to_tool
-                                attach_scheduler_to_tool(tool, context)
-                            except Exception as e:
-                                logger.warning(f"[AgentBridge] Failed to attach context to scheduler: {e}")
-                            break
-            
-            # Pass channel_type to model so linkai requests carry it
-            if context and hasattr(agent, 'model'):
-                agent.model.channel_type = context.get("channel_type", "")
-
-            # Record message count before execution so we can diff new messages
-            with agent.messages_lock:
-                pre_run_len = len(agent.messages)
-
             try:
-                # Use agent's run_stream method with event handler
-                response = agent.run_stream(
-                    user_message=query,
-                    on_event=event_handler.handle_event,
-                    clear_history=clear_history
-                )
+                return self._run_agent(agent, query, context, session_id, on_event, clear_history)
             finally:
-                # Restore original tools
-                if context and context.get("is_scheduled_task"):
-                    agent.tools = original_tools
-
-                # Log execution summary
-                event_handler.log_summary()
-
-            # Persist new messages generated during this run
-            if session_id:
-                channel_type = (context.get("channel_type") or "") if context else ""
-                with agent.messages_lock:
-                    new_messages = agent.messages[pre_run_len:]
-                self._persist_messages(session_id, list(new_messages), channel_type)
-            
-            # Check if there are files to send (from read tool)
-            if hasattr(agent, 'stream_executor') and hasattr(agent.stream_executor, 'files_to_send'):
-                files_to_send = agent.stream_executor.files_to_send
-                if files_to_send:
-                    # Send the first file (for now, handle one file at a time)
-                    file_info = files_to_send[0]
-                    logger.info(f"[AgentBridge] Sending file: {file_info.get('path')}")
-                    
-                    # Clear files_to_send for next request
-                    agent.stream_executor.files_to_send = []
-                    
-                    # Return file reply based on file type
-                    return self._create_file_reply(file_info, response, context)
-            
-            return Reply(ReplyType.TEXT, response)
+                if session_id is not None:
+                    self.agents.release(session_id, agent)
             
         except Exception as e:
             logger.error(f"Agent reply error: {e}")
             return Reply(ReplyType.ERROR, f"Agent error: {str(e)}")
+
+    def _run_agent(self, agent: Agent, query: str, context: Optional[Context],
+                   session_id: Optional[str], on_event, clear_history: bool) -> Reply:
+        """Run one agent turn and persist the new messages"""
+        # Create event handler for logging and channel communication
+        event_handler = AgentEventHandler(context=context, original_callback=on_event)
+        
+        # Filter tools based on context
+        original_tools = agent.tools
+        filtered_tools = original_tools
+        
+        # If this is a scheduled task execution, exclude scheduler tool to prevent recursion
+        if context and context.get("is_scheduled_task"):
+            filtered_tools = [tool for tool in agent.tools if tool.name != "scheduler"]
+            agent.tools = filtered_tools
+            logger.info(f"[AgentBridge] Scheduled task execution: excluded scheduler tool ({len(filtered_tools)}/{len(original_tools)} tools)")
+        else:
+            # Attach context to scheduler tool if present
+            if context and agent.tools:
+                for tool in agent.tools:
+                    if tool.name == "scheduler":
+                        try:
+                            from agent.tools.scheduler.integration import attach_scheduler_to_tool
+                            attach_scheduler_to_tool(tool, context)
+                        except Exception as e:
+                            logger.warning(f"[AgentBridge] Failed to attach context to scheduler: {e}")
+                        break
+        
+        # Pass channel_type to model so linkai requests carry it
+        if context and hasattr(agent, 'model'):
+            agent.model.channel_type = context.get("channel_type", "")
+
+        # Record message count before execution so we can diff new messages
+        with agent.messages_lock:
+            pre_run_len = len(agent.messages)
+
+        try:
+            # Use agent's run_stream method with event handler
+            response = agent.run_stream(
+                user_message=query,
+                on_event=event_handler.handle_event,
+                clear_history=clear_history
+            )
+        finally:
+            # Restore original tools
+            if context and context.get("is_scheduled_task"):
+                agent.tools = original_tools
+
+            # Log execution summary
+            event_handler.log_summary()
+
+        # Persist new messages generated during this run
+        if session_id:
+            channel_type = (context.get("channel_type") or "") if context else ""
+            with agent.messages_lock:
+                new_messages = agent.messages[pre_run_len:]
+            self._persist_messages(session_id, list(new_messages), channel_type)
+        
+        # Check if there are files to send (from read tool)
+        if hasattr(agent, 'stream_executor') and hasattr(agent.stream_executor, 'files_to_send'):
+            files_to_send = agent.stream_executor.files_to_send
+            if files_to_send:
+                # Send the first file (for now, handle one file at a time)
+                file_info = files_to_send[0]
+                logger.info(f"[AgentBridge] Sending file: {file_info.get('path')}")
+                
+                # Clear files_to_send for next request
+                agent.stream_executor.files_to_send = []
+                
+                # Return file reply based on file type
+                return self._create_file_reply(file_info, response, context)
+        
+        return Reply(ReplyType.TEXT, response)
     
     def _create_file_reply(self, file_info: dict, text_response: str, context: Context = None) -> Reply:
         """
@@ -567,7 +589,7 @@ class AgentBridge:
         """
         if session_id in self.agents:
             logger.info(f"[AgentBridge] Clearing session: {session_id}")
-            del self.agents[session_id]
+            self.agents.remove(session_id)
     
     def clear_all_sessions(self):
         """Clear all agent sessions"""
@@ -595,7 +617,11 @@ class AgentBridge:
             load_dotenv(env_file, override=True)
             logger.info(f"[AgentBridge] Reloaded environment variables from {env_file}")
 
+        # Shared skills and prompt are rebuilt for agents created from now on
+        self.initializer.invalidate_template()
+
         refreshed_count = 0
+        refreshed_skill_managers = set()
 
         # Collect all agent instances to refresh
         agents_to_refresh = []
@@ -606,8 +632,11 @@ class AgentBridge:
 
         for label, agent in agents_to_refresh:
             # Refresh skills
-            if hasattr(agent, 'skill_manager') and agent.skill_manager:
+            # (agents built from the template share one skill manager)
+            if hasattr(agent, 'skill_manager') and agent.skill_manager \
+                    and id(agent.skill_manager) not in refreshed_skill_managers:
                 agent.skill_manager.refresh_skills()
+                refreshed_skill_managers.add(id(agent.skill_manager))
 
             # Refresh conditional tools (e.g. web_search depends on API keys)
             self._refresh_conditional_tools(agent)
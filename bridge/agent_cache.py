@@ -0,0 +1,328 @@
+"""
+Agent cache - bounded, evicting per-session Agent storage for AgentBridge
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from common.log import logger
+
+
+class _Entry:
+    __slots__ = ("agent", "last_used", "in_use")
+
+    def __init__(self, agent):
+        self.agent = agent
+        self.last_used = time.monotonic()
+        self.in_use = 0
+
+
+class AgentCache:
+    """
+    LRU + idle-TTL cache of per-session Agent instances.
+
+    Agents past max_sessions (least recently used first) or idle longer than
+    idle_ttl seconds are evicted and their resources released. Conversation
+    history lives in ConversationStore, so an evicted session is rebuilt
+    transparently by the factory on its next message. Agents that are in the
+    middle of a run (see acquire/release) are never evicted, and an explicit
+    remove()/clear()/remove_where() of such an agent defers closing it until
+    its last release().
+    """
+
+    def __init__(self, max_sessions: int = 500, idle_ttl: float = 3600,
+                 on_evict: Optional[Callable[[object], None]] = None):
+        """
+        :param max_sessions: Maximum resident agents, 0 for unbounded
+        :param idle_ttl: Seconds an agent may stay unused, 0 to disable
+        :param on_evict: Called with each evicted agent to free its resources
+                        (default: close its memory manager and drop history)
+        """
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.on_evict = on_evict or release_agent
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._building: Dict[str, threading.Lock] = {}
+        # Removed while pinned: session_id -> entries closed on their last release()
+        self._retired: Dict[str, List[_Entry]] = {}
+        self._lock = threading.Lock()
+
+        # Sessions evicted recently, to tell rehydrations from first loads
+        self._evicted: "OrderedDict[str, None]" = OrderedDict()
+        self._evicted_limit = max(1000, max_sessions * 4)
+
+        self.evictions = 0
+        self.expirations = 0
+        self.loads = 0
+        self.rehydrations = 0
+        self.total_rehydration_time = 0.0
+        self.last_rehydration_time = 0.0
+        self.max_rehydration_time = 0.0
+
+        self._sweeper: Optional[threading.Thread] = None
+        self._sweeper_stop = threading.Event()
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, session_id: str, factory: Callable[[str], object]):
+        """Return the agent for session_id, building it with factory on a miss"""
+        return self._get(session_id, factory, pin=False)
+
+    def acquire(self, session_id: str, factory: Callable[[str], object]):
+        """Like get, but pins the agent against eviction until release()"""
+        return self._get(session_id, factory, pin=True)
+
+    def release(self, session_id: str, agent=None) -> None:
+        """
+        Unpin an agent returned by acquire()
+
+        :param agent: The acquired agent; tells a removed (retired) agent apart
+                      from a newer one built for the same session
+        """
+        retired = None
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry and entry.in_use > 0 and (agent is None or entry.agent is agent):
+                entry.in_use -= 1
+                entry.last_used = time.monotonic()
+                self._entries.move_to_end(session_id)
+            else:
+                retired = self._release_retired(session_id, agent)
+            evicted = self._collect_evictions()
+        if retired is not None:
+            self._close_agent(session_id, retired)
+        self._close_all(evicted)
+
+    def items(self) -> List[Tuple[str, object]]:
+        """Snapshot of resident (session_id, agent) pairs"""
+        with self._lock:
+            return [(sid, entry.agent) for sid, entry in self._entries.items()]
+
+    def remove(self, session_id: str) -> bool:
+        """Drop a session's agent and release its resources"""
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            deferred = entry is not None and self._retire(session_id, entry)
+        if entry is None:
+            return False
+        if not deferred:
+            self._close_agent(session_id, entry.agent)
+        return True
+
+    def clear(self) -> int:
+        """Drop all agents and release their resources"""
+        with self._lock:
+            entries = list(self._entries.items())
+            self._entries.clear()
+            self._evicted.clear()
+            closing = [(sid, entry) for sid, entry in entries if not self._retire(sid, entry)]
+        for session_id, entry in closing:
+            self._close_agent(session_id, entry.agent)
+        return len(entries)
+
+    def remove_where(self, predicate: Callable[[object], bool]) -> int:
+        """Drop the agents matching predicate; pinned ones are closed on their last release()"""
+        with self._lock:
+            matched = [(sid, entry) for sid, entry in self._entries.items() if predicate(entry.agent)]
+            for session_id, _ in matched:
+                del self._entries[session_id]
+            closing = [(sid, entry) for sid, entry in matched if not self._retire(sid, entry)]
+        for session_id, entry in closing:
+            self._close_agent(session_id, entry.agent)
+        return len(matched)
+
+    def sweep(self) -> int:
+        """Evict idle and over-capacity agents now; returns the number evicted"""
+        with self._lock:
+            evicted = self._collect_evictions()
+        self._close_all(evicted)
+        return len(evicted)
+
+    def start_sweeper(self, interval: Optional[float] = None) -> None:
+        """Sweep idle agents periodically on a daemon thread"""
+        if self._sweeper is not None or self.idle_ttl <= 0:
+            return
+        interval = interval or max(1.0, min(self.idle_ttl / 2, 60.0))
+
+        def loop() -> None:
+            while not self._sweeper_stop.wait(interval):
+                try:
+                    self.sweep()
+                except Exception as e:
+                    logger.warning(f"[AgentCache] Sweep failed: {e}")
+
+        self._sweeper = threading.Thread(target=loop, name="agent-cache-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def stop_sweeper(self) -> None:
+        self._sweeper_stop.set()
+        self._sweeper = None
+
+    def get_stats(self) -> dict:
+        """Resident count, evictions and rehydration latency"""
+        with self._lock:
+            resident = len(self._entries)
+            in_use = sum(1 for entry in self._entries.values() if entry.in_use)
+        avg = self.total_rehydration_time / self.rehydrations if self.rehydrations else 0.0
+        return {
+            "resident": resident,
+            "in_use": in_use,
+            "max_sessions": self.max_sessions,
+            "idle_ttl": self.idle_ttl,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "loads": self.loads,
+            "rehydrations": self.rehydrations,
+            "rehydration_ms": {
+                "last": round(self.last_rehydration_time * 1000, 2),
+                "avg": round(avg * 1000, 2),
+                "max": round(self.max_rehydration_time * 1000, 2),
+            },
+        }
+
+    # Internal
+
+    def _get(self, session_id: str, factory: Callable[[str], object], pin: bool):
+        agent = self._lookup(session_id, pin)
+        if agent is not None:
+            return agent
+
+        # Build outside the cache lock; one builder per session
+        with self._lock:
+            build_lock = self._building.setdefault(session_id, threading.Lock())
+        with build_lock:
+            agent = self._lookup(session_id, pin)
+            if agent is not None:
+                return agent
+            try:
+                start = time.perf_counter()
+                agent = factory(session_id)
+                elapsed = time.perf_counter() - start
+            except Exception:
+                with self._lock:
+                    self._building.pop(session_id, None)
+                raise
+
+            with self._lock:
+                self._building.pop(session_id, None)
+                entry = _Entry(agent)
+                if pin:
+                    entry.in_use = 1
+                self._entries[session_id] = entry
+                self.loads += 1
+                if session_id in self._evicted:
+                    del self._evicted[session_id]
+                    self.rehydrations += 1
+                    self.total_rehydration_time += elapsed
+                    self.last_rehydration_time = elapsed
+                    self.max_rehydration_time = max(self.max_rehydration_time, elapsed)
+                    logger.debug(f"[AgentCache] Rehydrated session {session_id} in {elapsed * 1000:.1f}ms")
+                evicted = self._collect_evictions()
+        self._close_all(evicted)
+        return agent
+
+    def _lookup(self, session_id: str, pin: bool):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            if not entry.in_use and self._is_idle(entry, now):
+                # Expired: treat as a miss, the caller rebuilds it
+                del self._entries[session_id]
+                self._mark_evicted(session_id)
+                self.expirations += 1
+                expired = entry
+            else:
+                entry.last_used = now
+                if pin:
+                    entry.in_use += 1
+                self._entries.move_to_end(session_id)
+                return entry.agent
+        self._close_agent(session_id, expired.agent)
+        return None
+
+    def _is_idle(self, entry: _Entry, now: float) -> bool:
+        return self.idle_ttl > 0 and now - entry.last_used > self.idle_ttl
+
+    def _mark_evicted(self, session_id: str) -> None:
+        self._evicted[session_id] = None
+        self._evicted.move_to_end(session_id)
+        while len(self._evicted) > self._evicted_limit:
+            self._evicted.popitem(last=False)
+
+    def _collect_evictions(self) -> List[Tuple[str, object]]:
+        """Pop idle and over-capacity entries (caller holds the lock)"""
+        now = time.monotonic()
+        evicted = []
+        over = len(self._entries) - self.max_sessions if self.max_sessions > 0 else 0
+
+        # Entries are in LRU order, so idle ones are at the front
+        for session_id, entry in list(self._entries.items()):
+            if entry.in_use:
+                continue
+            if self._is_idle(entry, now):
+                self.expirations += 1
+            elif over > 0:
+                self.evictions += 1
+            else:
+                break
+            del self._entries[session_id]
+            self._mark_evicted(session_id)
+            evicted.append((session_id, entry.agent))
+            over -= 1
+        return evicted
+
+    def _retire(self, session_id: str, entry: _Entry) -> bool:
+        """Park a removed entry that is still pinned; True if its close is deferred (caller holds the lock)"""
+        if entry.in_use <= 0:
+            return False
+        self._retired.setdefault(session_id, []).append(entry)
+        return True
+
+    def _release_retired(self, session_id: str, agent) -> Optional[object]:
+        """Unpin a retired entry; returns its agent once it is due to be closed (caller holds the lock)"""
+        entries = self._retired.get(session_id)
+        if not entries:
+            return None
+        entry = next((e for e in entries if agent is None or e.agent is agent), None)
+        if entry is None:
+            return None
+        entry.in_use -= 1
+        if entry.in_use > 0:
+            return None
+        entries.remove(entry)
+        if not entries:
+            del self._retired[session_id]
+        return entry.agent
+
+    def _close_all(self, evicted: List[Tuple[str, object]]) -> None:
+        for session_id, agent in evicted:
+            self._close_agent(session_id, agent)
+        if evicted:
+            logger.debug(f"[AgentCache] Evicted {len(evicted)} agent(s), {len(self)} resident")
+
+    def _close_agent(self, session_id: str, agent) -> None:
+        try:
+            self.on_evict(agent)
+        except Exception as e:
+            logger.warning(f"[AgentCache] Failed to release agent for session {session_id}: {e}")
+
+
+def release_agent(agent) -> None:
+    """Release what an agent holds: memory manager, DB connections, history"""
+    memory_manager = getattr(agent, "memory_manager", None)
+    if memory_manager:
+        memory_manager.close()
+    lock = getattr(agent, "messages_lock", None)
+    if lock is not None:
+        with lock:
+            agent.messages = []
@@ -5,8 +5,9 @@ Agent Initializer - Handles agent initialization logic
 import os
 import asyncio
 import datetime
+import threading
 import time
-from typing import Optional, List
+from typing import Any, Dict, Optional, List
 
 from agent.protocol import Agent
 from agent.tools import ToolManager
@@ -14,6 +15,24 @@ from common.log import logger
 from common.utils import expand_path
 
 
+class AgentTemplate:
+    """
+    Session-independent agent parts, built once and shared read-only
+    """
+
+    def __init__(self, workspace_root: str, memory_manager=None, skill_manager=None,
+                 runtime_info: Optional[Dict[str, Any]] = None):
+        self.workspace_root = workspace_root
+        self.memory_manager = memory_manager
+        self.skill_manager = skill_manager
+        self.runtime_info = runtime_info
+        self.system_prompt = ""
+        self.fingerprint = None  # workspace files the prompt was built from
+        self.skills_fingerprint = None  # skills directories the skills were loaded from
+        self.agents = 0  # live agents built from this template
+        self.retired = False  # replaced by a template for another workspace
+
+
 class AgentInitializer:
     """
     Handles agent initialization including:
@@ -33,21 +52,156 @@ class AgentInitializer:
         """
         self.bridge = bridge
         self.agent_bridge = agent_bridge
+        self._template: Optional[AgentTemplate] = None
+        self._template_lock = threading.RLock()
     
     def initialize_agent(self, session_id: Optional[str] = None) -> Agent:
         """
         Initialize agent for a session
         
+        The expensive, session-independent parts (workspace, memory manager,
+        tool classes, skills and the static system prompt) come from a shared
+        template; each session only gets its own tool instances and history.
+        
         Args:
             session_id: Session ID (None for default agent)
         
         Returns:
             Initialized agent instance
         """
+        template = self._get_template(session_id)
+        try:
+            agent = self._create_agent(template, session_id)
+        except Exception:
+            self._release_template(template)
+            raise
+        agent.agent_template = template
+        return agent
+
+    def _create_agent(self, template: "AgentTemplate", session_id: Optional[str] = None) -> Agent:
+        """Build a session's agent from the shared template"""
+        from config import conf
+        
+        # Per-session tool instances (tools hold per-agent state such as model)
+        tools = self._load_tools(template.workspace_root, template.memory_manager, session_id)
+        
+        # Initialize scheduler if needed
+        self._initialize_scheduler(tools, session_id)
+        
+        # Get cost control parameters
+        max_steps = conf().get("agent_max_steps", 20)
+        max_context_tokens = conf().get("agent_max_context_tokens", 50000)
+        
+        # Create agent
+        agent = self.agent_bridge.create_agent(
+            system_prompt=template.system_prompt,
+            tools=tools,
+            max_steps=max_steps,
+            output_mode="logger",
+            workspace_dir=template.workspace_root,
+            skill_manager=template.skill_manager,
+            enable_skills=True,
+            # Storage and index are shared, memory flush state is per agent
+            memory_manager=template.memory_manager.for_session() if template.memory_manager else None,
+            max_context_tokens=max_context_tokens,
+            runtime_info=template.runtime_info  # Pass runtime_info for dynamic time updates
+        )
+
+        # Restore persisted conversation history for this session
+        if session_id:
+            self._restore_conversation_history(agent, session_id)
+
+        return agent
+
+    def release_agent(self, agent: Agent) -> None:
+        """
+        Release an agent's per-session resources (used on cache eviction).
+        
+        Resources shared through the template stay open for other sessions.
+        """
+        with agent.messages_lock:
+            agent.messages = []
+        template = getattr(agent, "agent_template", None)
+        agent.agent_template = None
+        memory_manager = getattr(agent, "memory_manager", None)
+        if memory_manager and (template is None or memory_manager is not template.memory_manager):
+            memory_manager.close()
+        if template:
+            self._release_template(template)
+
+    def invalidate_template(self) -> None:
+        """Force the shared skills and system prompt to be rebuilt for the next agent"""
+        with self._template_lock:
+            if self._template:
+                self._template.fingerprint = None
+
+    def _get_template(self, session_id: Optional[str] = None) -> "AgentTemplate":
+        """
+        Return the shared agent template, building or refreshing it as needed
+        
+        Memory system and tool classes are built once per workspace. Skills and
+        the system prompt are rebuilt only when the skills directories or the
+        workspace context files change on disk. The returned template counts
+        the caller's agent until release_agent().
+        """
         from config import conf
         
-        # Get workspace from config
         workspace_root = expand_path(conf().get("agent_workspace", "~/cow"))
+        with self._template_lock:
+            template = self._template
+            if template is None or template.workspace_root != workspace_root:
+                if template:
+                    self._retire_template(template)
+                template = self._build_template(workspace_root, session_id)
+                self._template = template
+            
+            skills_fingerprint = self._skills_fingerprint(template.skill_manager)
+            fingerprint = self._workspace_fingerprint(workspace_root)
+            if template.skills_fingerprint != skills_fingerprint:
+                if template.skill_manager and template.skills_fingerprint is not None:
+                    template.skill_manager.refresh_skills()
+                template.skills_fingerprint = skills_fingerprint
+                template.fingerprint = None
+            if template.fingerprint != fingerprint:
+                is_first = self._build_system_prompt(template, session_id)
+                # The first-conversation prompt is used once, the next agent gets a fresh one
+                template.fingerprint = None if is_first else fingerprint
+            template.agents += 1
+            return template
+
+    def _retire_template(self, template: "AgentTemplate") -> None:
+        """
+        Drop cached agents of a replaced template and close its shared resources
+        
+        Agents in the middle of a run keep the old memory manager until their
+        last release; it is closed once no agent built from it is left.
+        """
+        with self._template_lock:
+            template.retired = True
+            idle = template.agents == 0
+        if idle:
+            self._close_template(template)
+            return
+        removed = self.agent_bridge.agents.remove_where(
+            lambda agent: getattr(agent, "agent_template", None) is template)
+        logger.info(f"[AgentInitializer] Workspace changed, retired {removed} cached agent(s)")
+
+    def _release_template(self, template: "AgentTemplate") -> None:
+        with self._template_lock:
+            template.agents -= 1
+            due = template.retired and template.agents == 0
+        if due:
+            self._close_template(template)
+
+    @staticmethod
+    def _close_template(template: "AgentTemplate") -> None:
+        if template.memory_manager:
+            template.memory_manager.close()
+            logger.info(f"[AgentInitializer] Closed memory manager of workspace {template.workspace_root}")
+
+    def _build_template(self, workspace_root: str, session_id: Optional[str] = None) -> "AgentTemplate":
+        """Build the session-independent parts of an agent"""
+        start = time.time()
         
         # Migrate API keys
         self._migrate_config_to_env(workspace_root)
@@ -56,74 +210,98 @@ class AgentInitializer:
         self._load_env_file()
         
         # Initialize workspace
-        from agent.prompt import ensure_workspace, load_context_files, PromptBuilder
-        workspace_files = ensure_workspace(workspace_root, create_templates=True)
-        
-        if session_id is None:
-            logger.info(f"[AgentInitializer] Workspace initialized at: {workspace_root}")
+        from agent.prompt import ensure_workspace
+        ensure_workspace(workspace_root, create_templates=True)
+        logger.info(f"[AgentInitializer] Workspace initialized at: {workspace_root}")
         
         # Setup memory system
-        memory_manager, memory_tools = self._setup_memory_system(workspace_root, session_id)
+        memory_manager = self._setup_memory_system(workspace_root, session_id)
         
-        # Load tools
-        tools = self._load_tools(workspace_root, memory_manager, memory_tools, session_id)
+        # Load tool classes once; instances are created per session
+        ToolManager().load_tools()
         
-        # Initialize scheduler if needed
-        self._initialize_scheduler(tools, session_id)
+        # Initialize skill manager
+        skill_manager = self._initialize_skill_manager(workspace_root, session_id)
+        
+        template = AgentTemplate(
+            workspace_root=workspace_root,
+            memory_manager=memory_manager,
+            skill_manager=skill_manager,
+            runtime_info=self._get_runtime_info(workspace_root)
+        )
+        logger.info(f"[AgentInitializer] Agent template built in {(time.time() - start) * 1000:.0f}ms")
+        return template
+
+    def _build_system_prompt(self, template: "AgentTemplate", session_id: Optional[str] = None) -> bool:
+        """(Re)build the shared system prompt; returns whether it is the first-conversation prompt"""
+        from agent.prompt import ensure_workspace, load_context_files, PromptBuilder
+        from agent.prompt.workspace import is_first_conversation, mark_conversation_started
+        
+        workspace_root = template.workspace_root
+        ensure_workspace(workspace_root, create_templates=True)
         
         # Load context files
         context_files = load_context_files(workspace_root)
         
-        # Initialize skill manager
-        skill_manager = self._initialize_skill_manager(workspace_root, session_id)
-        
         # Check if first conversation
-        from agent.prompt.workspace import is_first_conversation, mark_conversation_started
         is_first = is_first_conversation(workspace_root)
         
+        # Tool list is rebuilt per agent at request time; this one only seeds the prompt
+        tools = self._load_tools(workspace_root, template.memory_manager, session_id)
+        
         # Build system prompt
         prompt_builder = PromptBuilder(workspace_dir=workspace_root, language="zh")
-        runtime_info = self._get_runtime_info(workspace_root)
-        
-        system_prompt = prompt_builder.build(
+        template.system_prompt = prompt_builder.build(
             tools=tools,
             context_files=context_files,
-            skill_manager=skill_manager,
-            memory_manager=memory_manager,
-            runtime_info=runtime_info,
+            skill_manager=template.skill_manager,
+            memory_manager=template.memory_manager,
+            runtime_info=template.runtime_info,
             is_first_conversation=is_first
         )
         
         if is_first:
             mark_conversation_started(workspace_root)
-        
-        # Get cost control parameters
+        logger.debug("[AgentInitializer] System prompt rebuilt")
+        return is_first
+
+    @staticmethod
+    def _workspace_fingerprint(workspace_root: str) -> tuple:
+        """Cheap change signature of the files and settings the system prompt is built from"""
         from config import conf
-        max_steps = conf().get("agent_max_steps", 20)
-        max_context_tokens = conf().get("agent_max_context_tokens", 50000)
-        
-        # Create agent
-        agent = self.agent_bridge.create_agent(
-            system_prompt=system_prompt,
-            tools=tools,
-            max_steps=max_steps,
-            output_mode="logger",
-            workspace_dir=workspace_root,
-            skill_manager=skill_manager,
-            enable_skills=True,
-            max_context_tokens=max_context_tokens,
-            runtime_info=runtime_info  # Pass runtime_info for dynamic time updates
+        from agent.prompt.workspace import (
+            DEFAULT_AGENT_FILENAME, DEFAULT_USER_FILENAME,
+            DEFAULT_RULE_FILENAME, DEFAULT_STATE_FILENAME
         )
         
-        # Attach memory manager
-        if memory_manager:
-            agent.memory_manager = memory_manager
-
-        # Restore persisted conversation history for this session
-        if session_id:
-            self._restore_conversation_history(agent, session_id)
+        parts = [conf().get("model"), str(conf().get("channel_type"))]
+        for filename in (DEFAULT_AGENT_FILENAME, DEFAULT_USER_FILENAME,
+                         DEFAULT_RULE_FILENAME, DEFAULT_STATE_FILENAME):
+            try:
+                stat = os.stat(os.path.join(workspace_root, filename))
+                parts.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                parts.append(None)
+        return tuple(parts)
 
-        return agent
+    @staticmethod
+    def _skills_fingerprint(skill_manager) -> Optional[tuple]:
+        """Change signature of the skills directories (markdown files and config)"""
+        if skill_manager is None:
+            return None
+        parts = []
+        for root_dir in (skill_manager.builtin_dir, skill_manager.custom_dir):
+            for dirpath, dirnames, filenames in os.walk(root_dir):
+                dirnames[:] = [d for d in dirnames
+                               if not d.startswith('.') and d not in ('node_modules', '__pycache__', 'venv')]
+                for filename in filenames:
+                    if filename.endswith(('.md', '.json')):
+                        try:
+                            stat = os.stat(os.path.join(dirpath, filename))
+                        except OSError:
+                            continue
+                        parts.append((dirpath, filename, stat.st_mtime_ns, stat.st_size))
+        return tuple(sorted(parts))
 
     def _restore_conversation_history(self, agent, session_id: str) -> None:
         """
@@ -177,14 +355,12 @@ class AgentInitializer:
         Setup memory system
         
         Returns:
-            (memory_manager, memory_tools) tuple
+            MemoryManager instance, or None if unavailable
         """
         memory_manager = None
-        memory_tools = []
         
         try:
             from agent.memory import MemoryManager, MemoryConfig, create_embedding_provider
-            from agent.tools import MemorySearchTool, MemoryGetTool
             from config import conf
             
             # Get OpenAI config
@@ -210,14 +386,9 @@ class AgentInitializer:
             memory_config = MemoryConfig(workspace_root=workspace_root)
             memory_manager = MemoryManager(memory_config, embedding_provider=embedding_provider)
             
-            # Sync memory
+            # Sync memory, then keep it in sync from file changes in the background
             self._sync_memory(memory_manager, session_id)
-            
-            # Create memory tools
-            memory_tools = [
-                MemorySearchTool(memory_manager),
-                MemoryGetTool(memory_manager)
-            ]
+            memory_manager.start_watcher()
             
             if session_id is None:
                 logger.info("[AgentInitializer] Memory system initialized")
@@ -225,7 +396,7 @@ class AgentInitializer:
         except Exception as e:
             logger.warning(f"[AgentInitializer] Memory system not available: {e}")
         
-        return memory_manager, memory_tools
+        return memory_manager
     
     def _sync_memory(self, memory_manager, session_id: Optional[str] = None):
         """Sync memory database"""
@@ -245,10 +416,11 @@ class AgentInitializer:
         except Exception as e:
             logger.warning(f"[AgentInitializer] Memory sync failed: {e}")
     
-    def _load_tools(self, workspace_root: str, memory_manager, memory_tools: List, session_id: Optional[str] = None):
-        """Load all tools"""
+    def _load_tools(self, workspace_root: str, memory_manager, session_id: Optional[str] = None):
+        """Create tool instances from the already loaded tool classes"""
         tool_manager = ToolManager()
-        tool_manager.load_tools()
+        if not tool_manager.tool_classes:
+            tool_manager.load_tools()
         
         tools = []
         file_config = {
@@ -284,7 +456,12 @@ class AgentInitializer:
                 logger.warning(f"[AgentInitializer] Failed to load tool {tool_name}: {e}")
         
         # Add memory tools
-        if memory_tools:
+        if memory_manager:
+            from agent.tools import MemorySearchTool, MemoryGetTool
+            memory_tools = [
+                MemorySearchTool(memory_manager),
+                MemoryGetTool(memory_manager)
+            ]
             tools.extend(memory_tools)
             if session_id is None:
                 logger.info(f"[AgentInitializer] Added {len(memory_tools)} memory tools")
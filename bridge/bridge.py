@@ -104,6 +104,30 @@ class Bridge(object):
     def fetch_reply_content(self, query, context: Context) -> Reply:
         return self.get_bot("chat").reply(query, context)
 
+    async def fetch_reply_content_async(self, query, context: Context, executor=None) -> Reply:
+        """
+        Async reply: awaits bot.reply_async if the bot has one, otherwise runs bot.reply in executor.
+        reply_async may return None for contexts it leaves to the sync reply.
+        """
+        bot = self.get_bot("chat")
+        if hasattr(bot, "reply_async"):
+            reply = await bot.reply_async(query, context)
+            if reply is not None:
+                return reply
+        from common.aio import run_sync
+        return await run_sync(bot.reply, query, context, executor=executor)
+
+    def prefetch_attachment(self, context: Context, path: str, msg=None) -> None:
+        """Let the chat bot start work on an attachment (e.g. uploading it) before the question arrives"""
+        if conf().get("agent", False):
+            return
+        try:
+            bot = self.get_bot("chat")
+            if hasattr(bot, "prefetch_attachment"):
+                bot.prefetch_attachment(context, path, msg)
+        except Exception as e:
+            logger.warning(f"[Bridge] prefetch attachment failed: {e}")
+
     def fetch_voice_to_text(self, voiceFile) -> Reply:
         return self.get_bot("voice_to_text").voiceToText(voiceFile)
 
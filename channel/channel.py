@@ -75,6 +75,16 @@ class Channel(object):
             # Normal mode
             return Bridge().fetch_reply_content(query, context)
 
+    async def build_reply_content_async(self, query, context: Context = None, executor=None) -> Reply:
+        """
+        Async variant of build_reply_content. Agent mode (and bots without
+        reply_async) run on the given executor.
+        """
+        from common.aio import run_sync
+        if conf().get("agent", False):
+            return await run_sync(self.build_reply_content, query, context, executor=executor)
+        return await Bridge().fetch_reply_content_async(query, context, executor=executor)
+
     def build_voice_to_text(self, voice_file) -> Reply:
         return Bridge().fetch_voice_to_text(voice_file)
 
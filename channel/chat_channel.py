@@ -1,15 +1,17 @@
+import asyncio
 import os
 import re
 import threading
 import time
-from asyncio import CancelledError
-from concurrent.futures import Future, ThreadPoolExecutor
+from collections import deque
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from queue import SimpleQueue
 
 from bridge.context import *
 from bridge.reply import *
 from channel.channel import Channel
-from common.dequeue import Dequeue
-from common import memory
+from common import aio, memory
+from common.aio import run_sync
 from plugins import *
 
 try:
@@ -17,8 +19,6 @@ try:
 except Exception as e:
     pass
 
-handler_pool = ThreadPoolExecutor(max_workers=8)  # 处理消息的线程池
-
 
 # 抽象类, 它包含了与消息通道无关的通用处理逻辑
 class ChatChannel(Channel):
@@ -31,9 +31,15 @@ class ChatChannel(Channel):
         # which caused contexts from one channel (e.g. Feishu) to be consumed
         # by another channel's consume() thread (e.g. Web), leading to errors
         # like "No request_id found in context".
-        self.futures = {}
-        self.sessions = {}
+        self.sessions = {}  # session_id -> _SessionState
         self.lock = threading.Lock()
+        self._ready = SimpleQueue()  # 有消息待处理的session_id，由produce和任务完成时通知；asyncio模式下还有任务完成回调
+        self._handler_pool = None  # 本channel独享的处理线程池，首次使用时按配置创建
+        self._pool_lock = threading.Lock()
+        self.max_pending = 0  # 待处理消息上限，超出则直接回复繁忙
+        self.pending = 0  # 已接收但尚未开始处理的消息数
+        self.execution_mode = "thread"  # thread: 线程池处理; asyncio: 共享事件循环上的协程处理
+        self.pool_stats = _PoolStats()
         _thread = threading.Thread(target=self.consume)
         _thread.setDaemon(True)
         _thread.start()
@@ -192,6 +198,75 @@ class ChatChannel(Channel):
             # reply的发送步骤
             self._send_reply(context, reply)
 
+    # asyncio执行模式：回复在共享事件循环上以协程处理，同步的bot和插件通过线程池桥接
+    async def _handle_async(self, context: Context):
+        if context is None or not context.content:
+            return
+        logger.debug("[chat_channel] handling context (async): {}".format(context))
+        reply = await self._generate_reply_async(context)
+
+        if reply and reply.content:
+            reply = await run_sync(self._decorate_reply, context, reply, executor=self.handler_pool)
+            await self._send_reply_async(context, reply)
+
+    async def _generate_reply_async(self, context: Context, reply: Reply = Reply()) -> Reply:
+        e_context = await run_sync(
+            PluginManager().emit_event,
+            EventContext(
+                Event.ON_HANDLE_CONTEXT,
+                {"channel": self, "context": context, "reply": reply},
+            ),
+            executor=self.handler_pool,
+        )
+        reply = e_context["reply"]
+        if not e_context.is_pass():
+            logger.debug("[chat_channel] type={}, content={}".format(context.type, context.content))
+            if context.type == ContextType.TEXT or context.type == ContextType.IMAGE_CREATE:  # 文字和图片消息
+                context["channel"] = e_context["channel"]
+                reply = await self.build_reply_content_async(context.content, context, executor=self.handler_pool)
+            else:
+                reply = await run_sync(self._build_non_text_reply, context, e_context, reply, executor=self.handler_pool)
+        return reply
+
+    async def _send_reply_async(self, context: Context, reply: Reply):
+        """与_send_reply流程一致，单条消息通过_send_async发送"""
+        if not (reply and reply.type):
+            return
+        e_context = await run_sync(
+            PluginManager().emit_event,
+            EventContext(
+                Event.ON_SEND_REPLY,
+                {"channel": self, "context": context, "reply": reply},
+            ),
+            executor=self.handler_pool,
+        )
+        reply = e_context["reply"]
+        if e_context.is_pass() or not (reply and reply.type):
+            return
+        logger.debug("[chat_channel] sending reply: {}, context: {}".format(reply, context))
+        if reply.type == ReplyType.TEXT:
+            # 先发文本，再逐个发送从文本中提取的图片/视频
+            media_replies = self._extract_media_replies(reply)
+            await self._send_async(reply, context)
+            for i, media_reply in enumerate(media_replies):
+                if i > 0:
+                    await asyncio.sleep(0.5)
+                await self._send_async(media_reply, context)
+        elif reply.type == ReplyType.IMAGE_URL and hasattr(reply, 'text_content') and reply.text_content:
+            await self._send_async(Reply(ReplyType.TEXT, reply.text_content), context)
+            await asyncio.sleep(0.3)
+            await self._send_async(reply, context)
+        else:
+            await self._send_async(reply, context)
+        await run_sync(self._send_post_reply_attachments, reply, context, executor=self.handler_pool)
+
+    async def _send_async(self, reply: Reply, context: Context):
+        """
+        异步发送单条回复，默认在线程池中调用_send。
+        渠道可重写为基于common.aio.get_http_session()的异步HTTP发送
+        """
+        await run_sync(self._send, reply, context, executor=self.handler_pool)
+
     def _generate_reply(self, context: Context, reply: Reply = Reply()) -> Reply:
         e_context = PluginManager().emit_event(
             EventContext(
@@ -205,48 +280,56 @@ class ChatChannel(Channel):
             if context.type == ContextType.TEXT or context.type == ContextType.IMAGE_CREATE:  # 文字和图片消息
                 context["channel"] = e_context["channel"]
                 reply = super().build_reply_content(context.content, context)
-            elif context.type in (ContextType.VOICE, ContextType.IMAGE, ContextType.FILE) and self._should_forward_to_molt():
-                context["channel"] = e_context["channel"]
-                reply = super().build_reply_content("", context)
-            elif context.type == ContextType.VOICE:  # 语音消息
-                cmsg = context["msg"]
-                cmsg.prepare()
-                file_path = context.content
-                wav_path = os.path.splitext(file_path)[0] + ".wav"
-                try:
-                    any_to_wav(file_path, wav_path)
-                except Exception as e:  # 转换失败，直接使用mp3，对于某些api，mp3也可以识别
-                    logger.warning("[chat_channel]any to wav error, use raw path. " + str(e))
-                    wav_path = file_path
-                # 语音识别
-                reply = super().build_voice_to_text(wav_path)
-                # 删除临时文件
-                try:
-                    os.remove(file_path)
-                    if wav_path != file_path:
-                        os.remove(wav_path)
-                except Exception as e:
-                    pass
-                    # logger.warning("[chat_channel]delete temp file error: " + str(e))
+            else:
+                reply = self._build_non_text_reply(context, e_context, reply)
+        return reply
 
-                if reply.type == ReplyType.TEXT:
-                    new_context = self._compose_context(ContextType.TEXT, reply.content, **context.kwargs)
-                    if new_context:
-                        reply = self._generate_reply(new_context)
-                    else:
-                        return
-            elif context.type == ContextType.IMAGE:  # 图片消息，当前仅做下载保存到本地的逻辑
-                memory.USER_IMAGE_CACHE[context["session_id"]] = {
-                    "path": context.content,
-                    "msg": context.get("msg")
-                }
-            elif context.type == ContextType.SHARING:  # 分享信息，当前无默认逻辑
-                pass
-            elif context.type == ContextType.FUNCTION or context.type == ContextType.FILE:  # 文件消息及函数调用等，当前无默认逻辑
+    def _build_non_text_reply(self, context: Context, e_context: EventContext, reply: Reply) -> Reply:
+        """语音、图片、文件等非文本消息的默认处理"""
+        if context.type in (ContextType.VOICE, ContextType.IMAGE, ContextType.FILE) and self._should_forward_to_molt():
+            context["channel"] = e_context["channel"]
+            reply = super().build_reply_content("", context)
+        elif context.type == ContextType.VOICE:  # 语音消息
+            cmsg = context["msg"]
+            cmsg.prepare()
+            file_path = context.content
+            wav_path = os.path.splitext(file_path)[0] + ".wav"
+            try:
+                any_to_wav(file_path, wav_path)
+            except Exception as e:  # 转换失败，直接使用mp3，对于某些api，mp3也可以识别
+                logger.warning("[chat_channel]any to wav error, use raw path. " + str(e))
+                wav_path = file_path
+            # 语音识别
+            reply = super().build_voice_to_text(wav_path)
+            # 删除临时文件
+            try:
+                os.remove(file_path)
+                if wav_path != file_path:
+                    os.remove(wav_path)
+            except Exception as e:
                 pass
-            else:
-                logger.warning("[chat_channel] unknown context type: {}".format(context.type))
-                return
+                # logger.warning("[chat_channel]delete temp file error: " + str(e))
+
+            if reply.type == ReplyType.TEXT:
+                new_context = self._compose_context(ContextType.TEXT, reply.content, **context.kwargs)
+                if new_context:
+                    reply = self._generate_reply(new_context)
+                else:
+                    return
+        elif context.type == ContextType.IMAGE:  # 图片消息，当前仅做下载保存到本地的逻辑
+            memory.USER_IMAGE_CACHE[context["session_id"]] = {
+                "path": context.content,
+                "msg": context.get("msg")
+            }
+            from bridge.bridge import Bridge
+            Bridge().prefetch_attachment(context, context.content, context.get("msg"))
+        elif context.type == ContextType.SHARING:  # 分享信息，当前无默认逻辑
+            pass
+        elif context.type == ContextType.FUNCTION or context.type == ContextType.FILE:  # 文件消息及函数调用等，当前无默认逻辑
+            pass
+        else:
+            logger.warning("[chat_channel] unknown context type: {}".format(context.type))
+            return
         return reply
 
     def _decorate_reply(self, context: Context, reply: Reply) -> Reply:
@@ -344,6 +427,29 @@ class ChatChannel(Channel):
         支持格式：[图片: /path/to/image.png], [视频: /path/to/video.mp4], ![](url), <img src="url">
         最多发送5个媒体文件
         """
+        media_replies = self._extract_media_replies(reply)
+        if media_replies:
+            # 先发送文本（保持原文本不变）
+            logger.info(f"[chat_channel] Sending text content before media: {reply.content[:100]}...")
+        # 没有媒体文件时正常发送文本
+        self._send(reply, context)
+        if not media_replies:
+            return
+        logger.info(f"[chat_channel] Text sent, now sending {len(media_replies)} media item(s)")
+
+        # 然后逐个发送媒体文件
+        for i, media_reply in enumerate(media_replies):
+            try:
+                # 发送媒体文件（添加小延迟避免频率限制）
+                if i > 0:
+                    time.sleep(0.5)
+                self._send(media_reply, context)
+                logger.info(f"[chat_channel] Sent media {i+1}/{len(media_replies)}: {media_reply.content[:50]}...")
+            except Exception as e:
+                logger.error(f"[chat_channel] Failed to send media {media_reply.content}: {e}")
+
+    def _extract_media_replies(self, reply: Reply) -> list:
+        """提取文本回复中的图片/视频，返回待发送的媒体Reply列表（最多5个）"""
         content = reply.content
         media_items = []  # [(url, type), ...]
         
@@ -371,52 +477,35 @@ class ChatChannel(Channel):
                 seen.add(url)
                 unique_items.append((url, mtype))
         media_items = unique_items[:5]
-        
         if media_items:
             logger.info(f"[chat_channel] Extracted {len(media_items)} media item(s) from reply")
-            
-            # 先发送文本（保持原文本不变）
-            logger.info(f"[chat_channel] Sending text content before media: {reply.content[:100]}...")
-            self._send(reply, context)
-            logger.info(f"[chat_channel] Text sent, now sending {len(media_items)} media item(s)")
-            
-            # 然后逐个发送媒体文件
-            for i, (url, media_type) in enumerate(media_items):
-                try:
-                    # 判断是本地文件还是URL
-                    if url.startswith(('http://', 'https://')):
-                        # 网络资源
-                        if media_type == 'video':
-                            # 视频使用 FILE 类型发送
-                            media_reply = Reply(ReplyType.FILE, url)
-                            media_reply.file_name = os.path.basename(url)
-                        else:
-                            # 图片使用 IMAGE_URL 类型
-                            media_reply = Reply(ReplyType.IMAGE_URL, url)
-                    elif os.path.exists(url):
-                        # 本地文件
-                        if media_type == 'video':
-                            # 视频使用 FILE 类型，转换为 file:// URL
-                            media_reply = Reply(ReplyType.FILE, f"file://{url}")
-                            media_reply.file_name = os.path.basename(url)
-                        else:
-                            # 图片使用 IMAGE_URL 类型，转换为 file:// URL
-                            media_reply = Reply(ReplyType.IMAGE_URL, f"file://{url}")
-                    else:
-                        logger.warning(f"[chat_channel] Media file not found or invalid URL: {url}")
-                        continue
-                    
-                    # 发送媒体文件（添加小延迟避免频率限制）
-                    if i > 0:
-                        time.sleep(0.5)
-                    self._send(media_reply, context)
-                    logger.info(f"[chat_channel] Sent {media_type} {i+1}/{len(media_items)}: {url[:50]}...")
-                    
-                except Exception as e:
-                    logger.error(f"[chat_channel] Failed to send {media_type} {url}: {e}")
-        else:
-            # 没有媒体文件，正常发送文本
-                self._send(reply, context)
+
+        media_replies = []
+        for url, media_type in media_items:
+            # 判断是本地文件还是URL
+            if url.startswith(('http://', 'https://')):
+                # 网络资源
+                if media_type == 'video':
+                    # 视频使用 FILE 类型发送
+                    media_reply = Reply(ReplyType.FILE, url)
+                    media_reply.file_name = os.path.basename(url)
+                else:
+                    # 图片使用 IMAGE_URL 类型
+                    media_reply = Reply(ReplyType.IMAGE_URL, url)
+            elif os.path.exists(url):
+                # 本地文件
+                if media_type == 'video':
+                    # 视频使用 FILE 类型，转换为 file:// URL
+                    media_reply = Reply(ReplyType.FILE, f"file://{url}")
+                    media_reply.file_name = os.path.basename(url)
+                else:
+                    # 图片使用 IMAGE_URL 类型，转换为 file:// URL
+                    media_reply = Reply(ReplyType.IMAGE_URL, f"file://{url}")
+            else:
+                logger.warning(f"[chat_channel] Media file not found or invalid URL: {url}")
+                continue
+            media_replies.append(media_reply)
+        return media_replies
 
     def _send(self, reply: Reply, context: Context, retry_cnt=0):
         try:
@@ -436,7 +525,7 @@ class ChatChannel(Channel):
     def _fail_callback(self, session_id, exception, **kwargs):  # 线程异常结束时的回调函数
         logger.exception("Worker return exception: {}".format(exception))
 
-    def _thread_pool_callback(self, session_id, **kwargs):
+    def _thread_pool_callback(self, session_id, job: "_Job", **kwargs):
         def func(worker: Future):
             try:
                 worker_exception = worker.exception()
@@ -448,71 +537,230 @@ class ChatChannel(Channel):
                 logger.info("Worker cancelled, session_id = {}".format(session_id))
             except Exception as e:
                 logger.exception("Worker raise exception: {}".format(e))
-            with self.lock:
-                self.sessions[session_id][1].release()
+            self._on_worker_done(session_id, worker, job)
 
         return func
 
+    @property
+    def handler_pool(self) -> ThreadPoolExecutor:
+        """处理消息的线程池，每个channel独立，大小可按channel_type配置"""
+        if self._handler_pool is None:
+            with self._pool_lock:
+                if self._handler_pool is None:
+                    workers, self.max_pending, self.execution_mode = self._pool_config()
+                    self._handler_pool = ThreadPoolExecutor(
+                        max_workers=workers,
+                        thread_name_prefix="{}-handler".format(self.channel_type or "channel"),
+                    )
+                    logger.debug("[chat_channel] {} handler pool: workers={}, max_pending={}, mode={}".format(
+                        self.channel_type, workers, self.max_pending, self.execution_mode))
+        return self._handler_pool
+
+    def _pool_config(self):
+        """(max_workers, max_pending, mode) for this channel: channel_worker_pools[channel_type] over the defaults"""
+        pool_conf = (conf().get("channel_worker_pools") or {}).get(self.channel_type) or {}
+        workers = pool_conf.get("max_workers", conf().get("channel_max_workers", 8))
+        max_pending = pool_conf.get("max_pending", conf().get("channel_max_pending", 1000))
+        mode = pool_conf.get("mode", conf().get("channel_execution_mode", "thread"))
+        if mode not in ("thread", "asyncio"):
+            logger.warning("[chat_channel] unknown channel_execution_mode '{}', using thread".format(mode))
+            mode = "thread"
+        return max(1, int(workers)), max(0, int(max_pending)), mode
+
     def produce(self, context: Context):
         session_id = context["session_id"]
+        is_command = context.type == ContextType.TEXT and context.content.startswith("#")
+        # Create the lazy pool (and load max_pending) outside self.lock
+        self.handler_pool
         with self.lock:
-            if session_id not in self.sessions:
-                self.sessions[session_id] = [
-                    Dequeue(),
-                    threading.BoundedSemaphore(conf().get("concurrency_in_session", 4)),
-                ]
-            if context.type == ContextType.TEXT and context.content.startswith("#"):
-                self.sessions[session_id][0].putleft(context)  # 优先处理管理命令
+            # 管理命令不受限流影响，保证#清除记忆等命令始终可用
+            if not is_command and 0 < self.max_pending <= self.pending:
+                self.pool_stats.rejected += 1
+                rejected = True
             else:
-                self.sessions[session_id][0].put(context)
-
-    # 消费者函数，单独线程，用于从消息队列中取出消息并处理
+                rejected = False
+                session = self.sessions.get(session_id)
+                if session is None:
+                    session = _SessionState(conf().get("concurrency_in_session", 4))
+                    self.sessions[session_id] = session
+                item = (context, time.monotonic())
+                if is_command:
+                    session.queue.appendleft(item)  # 优先处理管理命令
+                else:
+                    session.queue.append(item)
+                self.pending += 1
+                self._schedule(session_id, session)
+        if rejected:
+            logger.warning("[chat_channel] {} overloaded ({} pending), rejecting message from session {}".format(
+                self.channel_type, self.max_pending, session_id))
+            busy_reply = conf().get("channel_busy_reply", "当前消息较多，请稍后再试")
+            if busy_reply:
+                self._send(Reply(ReplyType.TEXT, busy_reply), context)
+
+    # 消费者函数，单独线程，从就绪队列取出有待处理消息且未达并发上限的session并派发
     def consume(self):
         while True:
-            with self.lock:
-                session_ids = list(self.sessions.keys())
-            for session_id in session_ids:
-                with self.lock:
-                    context_queue, semaphore = self.sessions[session_id]
-                if semaphore.acquire(blocking=False):  # 等线程处理完毕才能删除
-                    if not context_queue.empty():
-                        context = context_queue.get()
-                        logger.debug("[chat_channel] consume context: {}".format(context))
-                        future: Future = handler_pool.submit(self._handle, context)
-                        future.add_done_callback(self._thread_pool_callback(session_id, context=context))
-                        with self.lock:
-                            if session_id not in self.futures:
-                                self.futures[session_id] = []
-                            self.futures[session_id].append(future)
-                    elif semaphore._initial_value == semaphore._value + 1:  # 除了当前，没有任务再申请到信号量，说明所有任务都处理完毕
-                        with self.lock:
-                            self.futures[session_id] = [t for t in self.futures[session_id] if not t.done()]
-                            assert len(self.futures[session_id]) == 0, "thread pool error"
-                            del self.sessions[session_id]
-                    else:
-                        semaphore.release()
-            time.sleep(0.2)
+            item = self._ready.get()
+            try:
+                if callable(item):
+                    item()  # asyncio模式下的任务完成回调，在此线程执行以免在事件循环上争用self.lock
+                else:
+                    self._dispatch(item)
+            except Exception as e:
+                logger.exception("[chat_channel] dispatch error: {}".format(e))
+
+    def _schedule(self, session_id, session):
+        """Put a session on the ready queue if it has work and a free slot (caller holds self.lock)"""
+        if not session.scheduled and session.queue and session.running < session.limit:
+            session.scheduled = True
+            self._ready.put(session_id)
+
+    def _dispatch(self, session_id):
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                return
+            session.scheduled = False
+            while session.queue and session.running < session.limit:
+                context, enqueued_at = session.queue.popleft()
+                logger.debug("[chat_channel] consume context: {}".format(context))
+                session.running += 1
+                job = _Job(context, enqueued_at)
+                callback = self._thread_pool_callback(session_id, job=job, context=context)
+                if self.execution_mode == "asyncio":
+                    # 事件循环不限并发，提交即开始，此处直接出队计数，协程内无需获取self.lock
+                    self.pending -= 1
+                    job.started = True
+                    future: Future = aio.submit(self._run_handle_async(job))
+                    future.add_done_callback(lambda f, cb=callback: self._ready.put(lambda: cb(f)))
+                else:
+                    future: Future = self.handler_pool.submit(self._run_handle, job)
+                    future.add_done_callback(callback)
+                session.futures.add(future)
+
+    def _run_handle(self, job: "_Job"):
+        with self.lock:
+            self.pending -= 1
+            job.started = True
+        self.pool_stats.record_wait(time.monotonic() - job.enqueued_at)
+        self._handle(job.context)
+
+    async def _run_handle_async(self, job: "_Job"):
+        self.pool_stats.record_wait(time.monotonic() - job.enqueued_at)
+        await self._handle_async(job.context)
+
+    def _on_worker_done(self, session_id, worker: Future, job: "_Job"):
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None or worker not in session.futures:
+                return
+            session.futures.discard(worker)
+            if not job.started:
+                self.pending -= 1  # 未开始即被取消
+            session.running -= 1
+            if session.queue:
+                self._schedule(session_id, session)
+            elif session.running == 0:
+                # 所有任务都处理完毕，回收session
+                del self.sessions[session_id]
 
     # 取消session_id对应的所有任务，只能取消排队的消息和已提交线程池但未执行的任务
     def cancel_session(self, session_id):
         with self.lock:
-            if session_id in self.sessions:
-                for future in self.futures[session_id]:
-                    future.cancel()
-                cnt = self.sessions[session_id][0].qsize()
-                if cnt > 0:
-                    logger.info("Cancel {} messages in session {}".format(cnt, session_id))
-                self.sessions[session_id][0] = Dequeue()
+            session = self.sessions.get(session_id)
+            futures = self._drain(session_id, session) if session else []
+        self._cancel_futures(futures)
 
     def cancel_all_session(self):
+        futures = []
+        with self.lock:
+            for session_id, session in self.sessions.items():
+                futures.extend(self._drain(session_id, session))
+        self._cancel_futures(futures)
+
+    def _drain(self, session_id, session):
+        """Drop queued messages and return in-flight futures (caller holds self.lock)"""
+        cnt = len(session.queue)
+        if cnt > 0:
+            logger.info("Cancel {} messages in session {}".format(cnt, session_id))
+        session.queue.clear()
+        self.pending -= cnt
+        return list(session.futures)
+
+    def get_pool_stats(self) -> dict:
+        """队列深度、等待时间和拒绝次数等线程池指标"""
         with self.lock:
-            for session_id in self.sessions:
-                for future in self.futures[session_id]:
-                    future.cancel()
-                cnt = self.sessions[session_id][0].qsize()
-                if cnt > 0:
-                    logger.info("Cancel {} messages in session {}".format(cnt, session_id))
-                self.sessions[session_id][0] = Dequeue()
+            submitted = sum(session.running for session in self.sessions.values())
+            queued = sum(len(session.queue) for session in self.sessions.values())
+            stats = {
+                "channel_type": self.channel_type,
+                "mode": self.execution_mode,
+                "max_workers": self._handler_pool._max_workers if self._handler_pool else 0,
+                "max_pending": self.max_pending,
+                "queue_depth": self.pending,
+                "running": submitted - (self.pending - queued),
+                "sessions": len(self.sessions),
+            }
+        stats.update(self.pool_stats.snapshot())
+        return stats
+
+    @staticmethod
+    def _cancel_futures(futures):
+        # 在锁外取消：cancel()会同步执行完成回调，回调中需要获取self.lock
+        for future in futures:
+            future.cancel()
+
+
+class _PoolStats:
+    """Admission and queue wait counters of a channel's handler pool"""
+
+    def __init__(self):
+        self.rejected = 0
+        self.handled = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_wait = 0.0
+
+    def record_wait(self, wait: float):
+        self.handled += 1
+        self.total_wait += wait
+        self.last_wait = wait
+        if wait > self.max_wait:
+            self.max_wait = wait
+
+    def snapshot(self) -> dict:
+        avg = self.total_wait / self.handled if self.handled else 0.0
+        return {
+            "handled": self.handled,
+            "rejected": self.rejected,
+            "wait_ms": {
+                "last": round(self.last_wait * 1000, 2),
+                "avg": round(avg * 1000, 2),
+                "max": round(self.max_wait * 1000, 2),
+            },
+        }
+
+
+class _Job:
+    """A dispatched message; started is set once it has left the pending count"""
+    __slots__ = ("context", "enqueued_at", "started")
+
+    def __init__(self, context: Context, enqueued_at: float):
+        self.context = context
+        self.enqueued_at = enqueued_at
+        self.started = False
+
+
+class _SessionState:
+    """Pending messages and in-flight workers of one session"""
+    __slots__ = ("queue", "limit", "running", "scheduled", "futures")
+
+    def __init__(self, limit: int):
+        self.queue = deque()  # (context, enqueued_at)
+        self.limit = max(1, limit)
+        self.running = 0  # 已提交线程池的任务数
+        self.scheduled = False  # 是否已在就绪队列中
+        self.futures = set()
 
 
 def check_prefix(content, prefix_list):
@@ -11,11 +11,13 @@
 @Date 2023/11/19
 """
 
+import asyncio
 import json
 import logging
 import os
 import ssl
 import threading
+import time
 # -*- coding=utf-8 -*-
 import uuid
 
@@ -28,6 +30,7 @@ from bridge.reply import Reply, ReplyType
 from channel.chat_channel import ChatChannel, check_prefix
 from channel.feishu.feishu_message import FeishuMessage
 from common import utils
+from common.aio import AIOHTTP_AVAILABLE, aiohttp, get_http_session, run_sync
 from common.expired_dict import ExpiredDict
 from common.log import logger
 from common.singleton import singleton
@@ -51,6 +54,9 @@ except ImportError:
 
 @singleton
 class FeiShuChanel(ChatChannel):
+    # 流式卡片两次更新的最小间隔（秒），飞书限制单条消息每秒最多编辑5次
+    STREAM_UPDATE_INTERVAL = 0.5
+
     feishu_app_id = conf().get('feishu_app_id')
     feishu_app_secret = conf().get('feishu_app_secret')
     feishu_token = conf().get('feishu_token')
@@ -319,12 +325,16 @@ class FeiShuChanel(ChatChannel):
             no_need_at=True
         )
         if context:
+            if conf().get("feishu_stream_reply", False):
+                context["on_event"] = self._make_stream_callback(context)
             self.produce(context)
         logger.debug(f"[FeiShu] query={feishu_msg.content}, type={feishu_msg.ctype}")
 
     def send(self, reply: Reply, context: Context):
+        if self._finish_stream_card(reply, context):
+            logger.info(f"[FeiShu] stream card finished")
+            return
         msg = context.get("msg")
-        is_group = context["isgroup"]
         if msg:
             access_token = msg.access_token
         else:
@@ -385,13 +395,62 @@ class FeiShuChanel(ChatChannel):
                 msg_type = "file"
                 content_key = "file_key"
 
-        # Check if we can reply to an existing message (need msg_id)
-        can_reply = is_group and msg and hasattr(msg, 'msg_id') and msg.msg_id
-
         # Build content JSON
         content_json = json.dumps(reply_content) if content_key is None else json.dumps({content_key: reply_content})
         logger.debug(f"[FeiShu] Sending message: msg_type={msg_type}, content={content_json[:200]}")
 
+        res = self._post_message(context, headers, msg_type, content_json)
+        if res.get("code") == 0:
+            logger.info(f"[FeiShu] send message success")
+        else:
+            logger.error(f"[FeiShu] send message failed, code={res.get('code')}, msg={res.get('msg')}")
+
+    def _post_message(self, context: Context, headers: dict, msg_type: str, content_json: str) -> dict:
+        url, params, data = self._message_request(context, msg_type, content_json)
+        res = requests.post(url=url, headers=headers, params=params, json=data, timeout=(5, 10))
+        return res.json()
+
+    async def _send_async(self, reply: Reply, context: Context, retry_cnt=0):
+        """
+        asyncio模式下文本消息通过共享aiohttp连接池发送；
+        流式卡片、图片和文件需要上传等同步逻辑，仍在线程池中走send
+        """
+        if (not AIOHTTP_AVAILABLE or context.get("stream_card")
+                or reply.type in (ReplyType.IMAGE_URL, ReplyType.FILE)):
+            await super()._send_async(reply, context)
+            return
+        try:
+            msg = context.get("msg")
+            if msg:
+                access_token = msg.access_token
+            else:
+                access_token = await run_sync(self.fetch_access_token, executor=self.handler_pool)
+            headers = {
+                "Authorization": "Bearer " + access_token,
+                "Content-Type": "application/json",
+            }
+            logger.debug(f"[FeiShu] sending reply (async), type={context.type}, content={reply.content[:100]}...")
+            url, params, data = self._message_request(context, "text", json.dumps({"text": reply.content}))
+            session = await get_http_session()
+            timeout = aiohttp.ClientTimeout(sock_connect=5, sock_read=10)
+            async with session.post(url, headers=headers, params=params, json=data, timeout=timeout) as res:
+                res = await res.json(content_type=None)
+            if res.get("code") == 0:
+                logger.info(f"[FeiShu] send message success")
+            else:
+                logger.error(f"[FeiShu] send message failed, code={res.get('code')}, msg={res.get('msg')}")
+        except Exception as e:
+            logger.error("[FeiShu] sendMsg error: {}".format(e))
+            if retry_cnt < 2:
+                await asyncio.sleep(3 + 3 * retry_cnt)
+                await self._send_async(reply, context, retry_cnt + 1)
+
+    def _message_request(self, context: Context, msg_type: str, content_json: str):
+        """(url, params, body) of a send or reply message request"""
+        msg = context.get("msg")
+        # Check if we can reply to an existing message (need msg_id)
+        can_reply = context["isgroup"] and msg and hasattr(msg, 'msg_id') and msg.msg_id
+
         if can_reply:
             # 群聊中回复已有消息
             url = f"https://open.feishu.cn/open-apis/im/v1/messages/{msg.msg_id}/reply"
@@ -399,22 +458,82 @@ class FeiShuChanel(ChatChannel):
                 "msg_type": msg_type,
                 "content": content_json
             }
-            res = requests.post(url=url, headers=headers, json=data, timeout=(5, 10))
-        else:
-            # 发送新消息（私聊或群聊中无msg_id的情况，如定时任务）
-            url = "https://open.feishu.cn/open-apis/im/v1/messages"
-            params = {"receive_id_type": context.get("receive_id_type") or "open_id"}
-            data = {
-                "receive_id": context.get("receiver"),
-                "msg_type": msg_type,
-                "content": content_json
-            }
-            res = requests.post(url=url, headers=headers, params=params, json=data, timeout=(5, 10))
-        res = res.json()
-        if res.get("code") == 0:
-            logger.info(f"[FeiShu] send message success")
-        else:
-            logger.error(f"[FeiShu] send message failed, code={res.get('code')}, msg={res.get('msg')}")
+            return url, None, data
+        # 发送新消息（私聊或群聊中无msg_id的情况，如定时任务）
+        url = "https://open.feishu.cn/open-apis/im/v1/messages"
+        params = {"receive_id_type": context.get("receive_id_type") or "open_id"}
+        data = {
+            "receive_id": context.get("receiver"),
+            "msg_type": msg_type,
+            "content": content_json
+        }
+        return url, params, data
+
+    def _make_stream_callback(self, context: Context):
+        """
+        构造 on_event 回调：bot 流式输出时先发一张卡片，再按间隔更新卡片内容，
+        最终回复到达时由 send() 把完整内容写回同一张卡片
+        """
+        card = _StreamCard()
+        context["stream_card"] = card
+
+        def on_event(event: dict):
+            event_type = event.get("type")
+            if event_type == "message_update":
+                delta = event.get("data", {}).get("delta", "")
+                if not delta:
+                    return
+                with card.lock:
+                    card.parts.append(delta)
+                    if card.finished or time.monotonic() - card.last_update < self.STREAM_UPDATE_INTERVAL:
+                        return
+                    self._render_stream_card(card, context, "".join(card.parts))
+            elif event_type == "tool_execution_start":
+                # 工具调用前的思考文本不再展示，只保留当前这一段输出
+                with card.lock:
+                    card.parts = []
+
+        return on_event
+
+    def _finish_stream_card(self, reply: Reply, context: Context) -> bool:
+        """把最终文本写回流式卡片；没有可用卡片时返回 False，走普通发送"""
+        card = context.get("stream_card")
+        if not card or reply.type not in (ReplyType.TEXT, ReplyType.INFO, ReplyType.ERROR):
+            return False
+        with card.lock:
+            if card.finished or not card.message_id:
+                return False
+            card.finished = True
+            return self._render_stream_card(card, context, reply.content)
+
+    def _render_stream_card(self, card, context: Context, text: str) -> bool:
+        """首次发送卡片，之后更新同一张卡片（调用方持有 card.lock）"""
+        msg = context.get("msg")
+        access_token = msg.access_token if msg else self.fetch_access_token()
+        headers = {
+            "Authorization": "Bearer " + access_token,
+            "Content-Type": "application/json",
+        }
+        content_json = json.dumps({
+            "config": {"wide_screen_mode": True, "update_multi": True},
+            "elements": [{"tag": "markdown", "content": text}],
+        })
+        card.last_update = time.monotonic()
+        try:
+            if card.message_id:
+                url = f"https://open.feishu.cn/open-apis/im/v1/messages/{card.message_id}"
+                res = requests.patch(url=url, headers=headers, json={"content": content_json}, timeout=(5, 10)).json()
+            else:
+                res = self._post_message(context, headers, "interactive", content_json)
+                if res.get("code") == 0:
+                    card.message_id = res.get("data", {}).get("message_id")
+        except Exception as e:
+            logger.warning(f"[FeiShu] stream card update failed: {e}")
+            return False
+        if res.get("code") != 0:
+            logger.warning(f"[FeiShu] stream card update failed, code={res.get('code')}, msg={res.get('msg')}")
+            return False
+        return True
 
     def fetch_access_token(self) -> str:
         url = "https://open.feishu.cn/open-apis/auth/v3/tenant_access_token/internal/"
@@ -773,6 +892,18 @@ class FeiShuChanel(ChatChannel):
         return context
 
 
+class _StreamCard:
+    """一次回复对应的流式卡片状态"""
+    __slots__ = ("lock", "parts", "message_id", "last_update", "finished")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.parts = []
+        self.message_id = None
+        self.last_update = 0.0
+        self.finished = False
+
+
 class FeishuController:
     """
     HTTP服务器控制器，用于webhook模式
@@ -197,7 +197,8 @@ class WebChannel(ChatChannel):
             if use_sse:
                 context["on_event"] = self._make_sse_callback(request_id)
 
-            threading.Thread(target=self.produce, args=(context,)).start()
+            # produce只入队不阻塞，无需为每个请求单独起线程
+            self.produce(context)
 
             return json.dumps({"status": "success", "request_id": request_id, "stream": use_sse})
 
@@ -234,9 +234,9 @@ class WechatComAppChannel(ChatChannel):
                 # 步骤2: 上传到企业微信临时素材库
                 logger.info("[wechatcom] 📤 步骤2: 开始上传文件到企业微信临时素材库...")
                 with open(file_path, 'rb') as f:
-                    file_data = io.BytesIO(f.read())
+                    # 直接上传文件句柄，不把整个文件读进内存
                     filename = os.path.basename(file_path)
-                    media_id = self._upload_temp_media_from_bytesio(file_data, "file", filename)
+                    media_id = self._upload_temp_media_from_bytesio(f, "file", filename)
                     logger.info("[wechatcom] ✅ 步骤2: 文件临时素材上传成功，media_id: {}".format(media_id))
 
                 # 步骤3: 发送文件消息
@@ -279,7 +279,7 @@ class WechatComAppChannel(ChatChannel):
 
     def _upload_temp_media_from_bytesio(self, file_data, file_type, filename=None):
         """
-        从BytesIO对象上传临时素材到企业微信，获取media_id
+        从BytesIO或已打开的文件对象上传临时素材到企业微信，获取media_id
         参考您提供的app.py中的upload_temp_media方法
         """
         import requests
@@ -315,10 +315,9 @@ class WechatComAppChannel(ChatChannel):
         logger.info("[wechatcom] 📋 上传参数: type={}, filename={}, mime_type={}".format(file_type, filename, mime_type))
         logger.info("[wechatcom] 🌐 API地址: {}".format(url))
 
-        # 确保BytesIO指针在开始位置
+        # 支持BytesIO或已打开的文件对象，确保指针在开始位置
+        data_size = fsize(file_data)
         file_data.seek(0)
-        data_size = len(file_data.getvalue())
-        file_data.seek(0)  # 重置指针
 
         logger.info("[wechatcom] 📊 文件数据大小: {} bytes".format(data_size))
 
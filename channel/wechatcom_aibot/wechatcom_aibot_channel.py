@@ -69,6 +69,8 @@ class WechatComAIBotChannel(ChatChannel):
         # 存储每个 cache_key 对应的 stream_id {cache_key: stream_id}
         self.stream_ids = {}
         self.stream_lock = threading.Lock()
+        # bot 流式生成的部分文本 {cache_key: [delta, ...]}，刷新请求时先返回已生成的内容
+        self.stream_partial = {}
 
     def _compose_context(self, ctype, content, **kwargs):
         """
@@ -188,6 +190,34 @@ class WechatComAIBotChannel(ChatChannel):
         logger.exception(f"[wechatcom_aibot] Fail to generate reply, receiver={receiver}, exception={exception}")
         if receiver in self.running:
             self.running.remove(receiver)
+        with self.stream_lock:
+            self.stream_partial.pop(receiver, None)
+
+    def _make_stream_callback(self, cache_key):
+        """构造 on_event 回调，把 bot 的流式输出累积起来，供流式消息刷新时返回"""
+
+        def on_event(event: dict):
+            event_type = event.get("type")
+            if event_type == "message_update":
+                delta = event.get("data", {}).get("delta", "")
+                if delta:
+                    with self.stream_lock:
+                        self.stream_partial.setdefault(cache_key, []).append(delta)
+            elif event_type == "tool_execution_start":
+                # 工具调用前的思考文本不再展示，只保留当前这一段输出
+                with self.stream_lock:
+                    self.stream_partial.pop(cache_key, None)
+
+        return on_event
+
+    def _get_stream_partial(self, cache_key):
+        """已生成的部分文本（去除 markdown 符号，与最终回复保持一致）"""
+        with self.stream_lock:
+            parts = self.stream_partial.get(cache_key)
+            if not parts:
+                return ""
+            content = "".join(parts)
+        return remove_markdown_symbol(content)
 
     def _generate_stream_id(self):
         """生成唯一的 stream_id"""
@@ -434,13 +464,16 @@ class Query:
                         channel.running.remove(cache_key)
                     if cache_key in channel.stream_ids:
                         del channel.stream_ids[cache_key]
+                    with channel.stream_lock:
+                        channel.stream_partial.pop(cache_key, None)
 
                     # 返回完整内容，finish=true
                     return channel._create_stream_reply(aibot_msg.stream_id, True, final_content, msg_dict, nonce, timestamp)
                 else:
-                    # Dify 还在处理中，返回空内容，finish=false
-                    logger.info(f"[wechatcom_aibot] Dify still processing, returning empty stream message")
-                    return channel._create_stream_reply(aibot_msg.stream_id, False, "", msg_dict, nonce, timestamp)
+                    # Dify 还在处理中，返回已生成的部分内容，finish=false
+                    partial_content = channel._get_stream_partial(cache_key)
+                    logger.info(f"[wechatcom_aibot] Dify still processing, returning partial stream message, length={len(partial_content)}")
+                    return channel._create_stream_reply(aibot_msg.stream_id, False, partial_content, msg_dict, nonce, timestamp)
 
             # 新请求（用户发送消息）
             # 判断条件：不是流式消息刷新 且 不是重复的msgid 且 不在处理中
@@ -478,11 +511,18 @@ class Query:
                             "msg": aibot_msg
                         }
                         logger.info(f"[wechatcom_aibot] Image cached for session {session_id}: {aibot_msg.image_path}")
+                        from bridge.bridge import Bridge
+                        Bridge().prefetch_attachment(context, aibot_msg.image_path, aibot_msg)
                     else:
                         logger.info(f"[wechatcom_aibot] No image in this message")
 
                     # 智能机器人不需要在回复中添加 @用户名
                     context["no_need_at"] = True
+                    if channel.enable_stream:
+                        # 让 bot 边生成边把文本推给流式消息刷新请求
+                        with channel.stream_lock:
+                            channel.stream_partial.pop(cache_key, None)
+                        context["on_event"] = channel._make_stream_callback(cache_key)
                     channel.running.add(cache_key)
                     logger.info(f"[wechatcom_aibot] Added {cache_key} to running set, producing context...")
                     channel.produce(context)
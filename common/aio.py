@@ -0,0 +1,71 @@
+"""
+Shared asyncio runtime for the channel layer
+
+A single event loop runs on a daemon thread for the whole process. Async
+channel pipelines schedule coroutines on it, sync code (bots, plugins) is
+bridged in through an executor, and async HTTP calls share one pooled
+aiohttp session.
+"""
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import Executor
+from typing import Optional
+
+from common.log import logger
+
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    aiohttp = None
+    AIOHTTP_AVAILABLE = False
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+_http_session = None
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Return the shared event loop, starting its thread on first use"""
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def run():
+                    asyncio.set_event_loop(loop)
+                    loop.call_soon(ready.set)
+                    loop.run_forever()
+
+                threading.Thread(target=run, name="asyncio-loop", daemon=True).start()
+                ready.wait()
+                _loop = loop
+                logger.debug("[aio] shared event loop started")
+    return _loop
+
+
+def submit(coro):
+    """Schedule a coroutine on the shared loop from any thread; returns a concurrent Future"""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+async def run_sync(func, *args, executor: Optional[Executor] = None, **kwargs):
+    """Run blocking code in an executor so it does not stall the loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+
+async def get_http_session():
+    """Shared aiohttp session (connection pool) bound to the running loop"""
+    global _http_session
+    if not AIOHTTP_AVAILABLE:
+        raise RuntimeError("aiohttp is not installed")
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=0, limit_per_host=256, ttl_dns_cache=300),
+        )
+    return _http_session
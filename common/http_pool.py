@@ -0,0 +1,61 @@
+"""
+进程内共享的 HTTP 连接池
+
+按名称复用 requests.Session：同一 host 的请求复用 keep-alive 连接，
+不必每次都重新建立 TCP/TLS 连接。连接池大小可通过配置调整：
+- http_pool_connections: 缓存连接池的 host 数量
+- http_pool_maxsize: 每个 host 保持的最大连接数
+"""
+
+import threading
+from typing import Dict, Optional, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from common.log import logger
+from config import conf
+
+_sessions: Dict[str, requests.Session] = {}
+_lock = threading.Lock()
+
+
+def get_session(name: str = "default", max_retries: Optional[Union[int, Retry]] = None) -> requests.Session:
+    """
+    获取共享 Session，首次调用时创建
+
+    :param name: 连接池名称，不同用途（如不同的重试策略）使用不同名称
+    :param max_retries: 重试策略，仅在首次创建时生效
+    """
+    session = _sessions.get(name)
+    if session is None:
+        with _lock:
+            session = _sessions.get(name)
+            if session is None:
+                session = _build_session(max_retries)
+                _sessions[name] = session
+                logger.debug(f"[HttpPool] created session '{name}'")
+    return session
+
+
+def close_all() -> None:
+    """关闭所有共享 Session，释放连接"""
+    with _lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
+
+
+def _build_session(max_retries) -> requests.Session:
+    adapter = HTTPAdapter(
+        max_retries=max_retries if max_retries is not None else 0,
+        pool_connections=conf().get("http_pool_connections", 20),
+        pool_maxsize=conf().get("http_pool_maxsize", 32),
+        pool_block=False,  # 连接用尽时临时新建连接而不是阻塞等待
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
@@ -0,0 +1,121 @@
+"""
+提示词缓存（prompt caching）相关的请求布局与用量统计
+
+- Claude：在工具定义、系统提示词的静态部分和对话末尾插入 cache_control 断点
+- OpenAI 兼容接口：服务端按前缀自动缓存，只需保证前缀字节稳定
+  （工具和静态系统提示词在前，随时间变化的运行时信息在最后）
+- normalize_usage：把各家 usage 统一为缓存命中 / 未命中的输入 tokens
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import conf
+
+# 系统提示词最后的运行时信息（当前时间等）每次运行都会变化，不参与缓存
+RUNTIME_SECTION_MARKER = "\n## 运行时信息"
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+# Claude 单个请求最多 4 个断点：工具 1 个、系统提示词 1 个、消息 2 个
+MAX_MESSAGE_BREAKPOINTS = 2
+
+
+def is_enabled() -> bool:
+    return conf().get("agent_prompt_cache", True)
+
+
+def split_system_prompt(system_prompt: str) -> Tuple[str, str]:
+    """
+    拆分系统提示词为 (静态前缀, 动态运行时信息)
+
+    :param system_prompt: 完整系统提示词
+    :return: 静态部分和动态部分，没有运行时信息时动态部分为空字符串
+    """
+    index = system_prompt.rfind(RUNTIME_SECTION_MARKER)
+    if index <= 0:
+        return system_prompt, ""
+    return system_prompt[:index], system_prompt[index:]
+
+
+def apply_claude_cache_control(system: Optional[str], tools: Optional[List[Dict[str, Any]]],
+                               messages: List[Dict[str, Any]]):
+    """
+    为 Claude Messages API 请求插入 cache_control 断点
+
+    断点依次位于：最后一个工具定义、系统提示词静态部分、最后一条消息、
+    在此之前最近的一条用户消息（上一次调用的末尾附近）。传入的对象不会被修改，
+    对话历史中不会残留断点。
+
+    :return: (system, tools, messages)，system 为 content block 列表
+    """
+    if tools:
+        tools = list(tools)
+        tools[-1] = dict(tools[-1], cache_control=CACHE_CONTROL)
+
+    if system:
+        static, dynamic = split_system_prompt(system)
+        system = [{"type": "text", "text": static, "cache_control": CACHE_CONTROL}]
+        if dynamic.strip():
+            system.append({"type": "text", "text": dynamic})
+
+    messages = list(messages)
+    marked = 0
+    for i in range(len(messages) - 1, -1, -1):
+        if marked >= MAX_MESSAGE_BREAKPOINTS:
+            break
+        if marked and messages[i].get("role") != "user":
+            continue
+        message = _with_cache_control(messages[i])
+        if message is not None:
+            messages[i] = message
+            marked += 1
+    return system, tools, messages
+
+
+def _with_cache_control(message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """返回最后一个 content block 带断点的消息副本，无法加断点时返回 None"""
+    content = message.get("content")
+    if isinstance(content, str):
+        if not content:
+            return None
+        return dict(message, content=[{"type": "text", "text": content, "cache_control": CACHE_CONTROL}])
+    if not isinstance(content, list) or not content:
+        return None
+    last = content[-1]
+    if not isinstance(last, dict) or last.get("type") in ("thinking", "redacted_thinking"):
+        return None
+    if last.get("type") == "text" and not last.get("text"):
+        return None
+    return dict(message, content=content[:-1] + [dict(last, cache_control=CACHE_CONTROL)])
+
+
+def normalize_usage(usage: Dict[str, Any]) -> Dict[str, int]:
+    """
+    统一各家 usage 格式
+
+    支持 OpenAI（prompt_tokens_details.cached_tokens）、DeepSeek（prompt_cache_hit_tokens）
+    和 Claude（input_tokens 不含缓存部分，另有 cache_read / cache_creation）
+
+    :return: input_tokens 为完整输入 tokens（含缓存命中部分），cached_tokens 为缓存命中部分
+    """
+    def _int(value):
+        try:
+            return int(value or 0)
+        except (TypeError, ValueError):
+            return 0
+
+    if "prompt_tokens" in usage:
+        input_tokens = _int(usage.get("prompt_tokens"))
+        details = usage.get("prompt_tokens_details") or {}
+        cached = _int(details.get("cached_tokens")) or _int(usage.get("prompt_cache_hit_tokens"))
+        output_tokens = _int(usage.get("completion_tokens"))
+    else:
+        cached = _int(usage.get("cache_read_input_tokens"))
+        input_tokens = _int(usage.get("input_tokens")) + cached + _int(usage.get("cache_creation_input_tokens"))
+        output_tokens = _int(usage.get("output_tokens"))
+    return {
+        "input_tokens": input_tokens,
+        "cached_tokens": cached,
+        "cache_creation_tokens": _int(usage.get("cache_creation_input_tokens")),
+        "output_tokens": output_tokens,
+    }
@@ -0,0 +1,181 @@
+"""
+线程安全的 TTL + LRU 缓存
+
+- get/put 均为 O(1)：OrderedDict 维护最近使用顺序，过期在读取时惰性判断
+- 同时按条目数和字节数限制容量，超出时淘汰最久未使用的条目
+- 条目可带 tag（如 session_id），按 tag 失效只触及该 tag 下的条目
+- 统计命中、未命中、淘汰、过期次数
+"""
+
+import io
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Set
+
+
+class _Entry:
+    __slots__ = ("value", "expires_at", "size", "tag")
+
+    def __init__(self, value, expires_at, size, tag):
+        self.value = value
+        self.expires_at = expires_at
+        self.size = size
+        self.tag = tag
+
+
+class TTLCache:
+    def __init__(self, max_items: int = 1000, max_bytes: int = 0, ttl: float = 300):
+        """
+        :param max_items: 最大条目数，0 表示不限制
+        :param max_bytes: 最大总字节数（估算），0 表示不限制
+        :param ttl: 默认存活秒数，0 表示永不过期
+        """
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._tags: Dict[Hashable, Set[Hashable]] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and not self._expired(entry, time.monotonic())
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if self._expired(entry, time.monotonic()):
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def put(self, key, value, ttl: Optional[float] = None, size: Optional[int] = None,
+            tag: Optional[Hashable] = None) -> bool:
+        """
+        写入缓存，返回是否写入成功（单个条目超过 max_bytes 时不缓存）
+
+        :param ttl: 本条目的存活秒数，默认使用构造时的 ttl
+        :param size: 本条目的字节数，默认估算
+        :param tag: 分组标记，可通过 invalidate_tag 批量失效
+        """
+        ttl = self.ttl if ttl is None else ttl
+        size = estimate_size(value) if size is None else size
+        if self.max_bytes and size > self.max_bytes:
+            return False
+        expires_at = time.monotonic() + ttl if ttl > 0 else None
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = _Entry(value, expires_at, size, tag)
+            self._bytes += size
+            if tag is not None:
+                self._tags.setdefault(tag, set()).add(key)
+            self._evict()
+        return True
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._remove(key)
+        return default if entry is None else entry.value
+
+    def invalidate_tag(self, tag: Hashable) -> int:
+        """删除某个 tag 下的所有条目，返回删除数量"""
+        with self._lock:
+            keys = self._tags.pop(tag, None)
+            if not keys:
+                return 0
+            for key in keys:
+                entry = self._data.pop(key, None)
+                if entry is not None:
+                    self._bytes -= entry.size
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._tags.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "items": len(self._data),
+                "bytes": self._bytes,
+                "max_items": self.max_items,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    # 以下方法调用方需持有锁
+
+    @staticmethod
+    def _expired(entry: _Entry, now: float) -> bool:
+        return entry.expires_at is not None and now >= entry.expires_at
+
+    def _remove(self, key) -> Optional[_Entry]:
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return None
+        self._bytes -= entry.size
+        if entry.tag is not None:
+            keys = self._tags.get(entry.tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[entry.tag]
+        return entry
+
+    def _evict(self) -> None:
+        while self._data and (
+            (self.max_items and len(self._data) > self.max_items)
+            or (self.max_bytes and self._bytes > self.max_bytes)
+        ):
+            key, entry = next(iter(self._data.items()))
+            self._remove(key)
+            if self._expired(entry, time.monotonic()):
+                self.expirations += 1
+            else:
+                self.evictions += 1
+
+
+def estimate_size(value, _depth: int = 0) -> int:
+    """粗略估算对象占用的字节数，用于 max_bytes 限制"""
+    if isinstance(value, (str, bytes, bytearray)):
+        return sys.getsizeof(value)
+    if isinstance(value, io.BytesIO):
+        return value.getbuffer().nbytes
+    if _depth >= 3:
+        return sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            estimate_size(k, _depth + 1) + estimate_size(v, _depth + 1) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(estimate_size(v, _depth + 1) for v in value)
+    if hasattr(value, "__dict__"):
+        return sys.getsizeof(value) + estimate_size(vars(value), _depth + 1)
+    return sys.getsizeof(value)
@@ -189,6 +189,7 @@ available_setting = {
     "feishu_token": "",  # 飞书 verification token
     "feishu_bot_name": "",  # 飞书机器人的名字
     "feishu_event_mode": "websocket",  # 飞书事件接收模式: webhook(HTTP服务器) 或 websocket(长连接)
+    "feishu_stream_reply": False,  # 是否以卡片形式流式输出回复（先发卡片，生成过程中持续更新内容）
     # 钉钉配置
     "dingtalk_client_id": "",  # 钉钉机器人Client ID
     "dingtalk_client_secret": "",  # 钉钉机器人Client Secret
@@ -242,6 +243,12 @@ available_setting = {
     "dify_image_timeout": 180,             # 图片生成任务超时时间（秒）
     "dify_conversation_max_messages": 5,   # 会话最大消息数
     "dify_error_reply": "抱歉，我暂时遇到了一些问题，请您稍后重试~",  # 错误回复消息
+    "dify_cache_ttl": 300,                 # 回复缓存有效期（秒）
+    "dify_cache_max_items": 1000,          # 回复缓存最大条目数
+    "dify_cache_max_bytes": 52428800,      # 回复缓存最大字节数（估算，默认50MB）
+    "dify_download_max_size": 104857600,   # 下载Dify返回的图片/文件的大小上限（字节，默认100MB），0为不限
+    "http_pool_connections": 20,           # 共享HTTP连接池缓存的host数量
+    "http_pool_maxsize": 32,               # 共享HTTP连接池每个host保持的keep-alive连接数
     "molt_api_base": "http://localhost:3000",  # Molt API基础URL
     "molt_api_key": "",                   # Molt API密钥
     "molt_agent_id": "main",             # Molt agent ID
@@ -262,6 +269,17 @@ available_setting = {
     "agent_max_context_tokens": 50000,  # Agent模式下最大上下文tokens
     "agent_max_context_turns": 30,  # Agent模式下最大上下文记忆轮次
     "agent_max_steps": 15,  # Agent模式下单次运行最大决策步数
+    "agent_parallel_tool_workers": 8,  # 同一轮中只读工具（read/ls/web_search/memory_search等）并行执行的线程池大小，1为串行执行
+    "agent_prompt_cache": True,  # Agent模式下启用提示词缓存：Claude插入cache_control断点，OpenAI官方接口返回缓存命中用量
+    "channel_max_workers": 8,  # 每个channel处理消息的线程数
+    "channel_max_pending": 1000,  # 每个channel排队等待处理的消息上限，超出则回复繁忙提示，0为不限
+    "channel_execution_mode": "thread",  # 消息处理模式：thread(线程池) 或 asyncio(协程，适合大量并发的慢速流式回复)
+    "channel_worker_pools": {},  # 按channel_type覆盖上述配置，如 {"feishu": {"max_workers": 16, "max_pending": 2000}}
+    "channel_busy_reply": "当前消息较多，请稍后再试",  # 超出排队上限时的回复，为空则不回复
+    "agent_cache_max_sessions": 500,  # Agent模式下常驻内存的会话Agent上限，超过按LRU淘汰，0为不限
+    "agent_cache_idle_ttl": 3600,  # 会话Agent空闲多少秒后淘汰（历史可从会话存储恢复），0为关闭
+    "conversation_max_age_days": 30,  # Agent会话历史保留天数，超过则清理
+    "conversation_cleanup_interval_hours": 24,  # 会话历史后台清理间隔（小时），0为关闭
 }
 
 
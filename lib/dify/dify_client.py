@@ -3,15 +3,29 @@ import json
 import time
 import requests
 from typing import Optional, Dict, Any, List
-from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
+from common.http_pool import get_session
 from common.log import logger
 
+# Dify API 的重试策略
+DIFY_RETRY = Retry(
+    total=3,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=["HEAD", "GET", "OPTIONS", "POST"],  # 新版本使用allowed_methods
+    backoff_factor=1
+)
+
+
+def get_dify_session() -> requests.Session:
+    """Dify API、文件上传和媒体下载共用的连接池"""
+    return get_session("dify", max_retries=DIFY_RETRY)
+
 
 class DifyClient:
     """Dify API客户端基类"""
 
-    def __init__(self, api_key: str, api_base: str = "https://api.dify.ai/v1", timeout: int = 300):
+    def __init__(self, api_key: str, api_base: str = "https://api.dify.ai/v1", timeout: int = 300,
+                 session: Optional[requests.Session] = None):
         self.api_key = api_key
         self.api_base = api_base.rstrip('/')
         self.headers = {
@@ -19,20 +33,9 @@ class DifyClient:
             'Content-Type': 'application/json'
         }
 
-        # 创建带重试机制的session
-        self.session = requests.Session()
-
-        # 配置重试策略
-        retry_strategy = Retry(
-            total=3,
-            status_forcelist=[429, 500, 502, 503, 504],
-            allowed_methods=["HEAD", "GET", "OPTIONS", "POST"],  # 新版本使用allowed_methods
-            backoff_factor=1
-        )
-
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        self.session.mount("http://", adapter)
-        self.session.mount("https://", adapter)
+        # 默认使用进程内共享的带重试连接池，所有客户端复用 keep-alive 连接
+        self._shared_session = session is None
+        self.session = session or get_dify_session()
 
         # 设置可配置的超时时间
         self.timeout = timeout
@@ -144,8 +147,8 @@ class DifyClient:
             return False
 
     def close(self):
-        """关闭session"""
-        if hasattr(self, 'session'):
+        """关闭session（共享连接池不随客户端关闭）"""
+        if hasattr(self, 'session') and not self._shared_session:
             self.session.close()
 
 
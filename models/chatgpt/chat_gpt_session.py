@@ -1,3 +1,5 @@
+import functools
+
 from models.session_manager import Session
 from common.log import logger
 from common import const
@@ -18,6 +20,12 @@ class ChatGPTSession(Session):
         self.model = model
         self.reset()
 
+    def reset(self):
+        super().reset()
+        # 与 messages 一一对应的 (message, content, tokens)，用于增量计算 token
+        self._token_counts = []
+        self._total_tokens = 0
+
     def discard_exceeding(self, max_tokens, cur_tokens=None):
         precise = True
         try:
@@ -29,11 +37,11 @@ class ChatGPTSession(Session):
             logger.debug("Exception when counting tokens precisely for query: {}".format(e))
         while cur_tokens > max_tokens:
             if len(self.messages) > 2:
-                self.messages.pop(1)
+                self._pop_message(1, precise)
             elif len(self.messages) == 2 and self.messages[1]["role"] == "assistant":
-                self.messages.pop(1)
+                self._pop_message(1, precise)
                 if precise:
-                    cur_tokens = self.calc_tokens()
+                    cur_tokens = self._total_tokens + _reply_priming_tokens(self.model)
                 else:
                     cur_tokens = cur_tokens - max_tokens
                 break
@@ -44,55 +52,114 @@ class ChatGPTSession(Session):
                 logger.debug("max_tokens={}, total_tokens={}, len(messages)={}".format(max_tokens, cur_tokens, len(self.messages)))
                 break
             if precise:
-                cur_tokens = self.calc_tokens()
+                cur_tokens = self._total_tokens + _reply_priming_tokens(self.model)
             else:
                 cur_tokens = cur_tokens - max_tokens
         return cur_tokens
 
     def calc_tokens(self):
-        return num_tokens_from_messages(self.messages, self.model)
+        self._sync_token_counts()
+        return self._total_tokens + _reply_priming_tokens(self.model)
 
+    def _sync_token_counts(self):
+        """
+        使缓存与 messages 对齐，每条消息只在首次出现时编码一次。
+        messages 可能被外部直接修改（如 bot 追加或删除消息），此处只比较对象引用，
+        仅对新增或内容被替换的消息重新编码
+        """
+        counts = self._token_counts
+        messages = self.messages
+        if len(counts) == len(messages) and all(
+                c[0] is m and c[1] is m.get("content") for c, m in zip(counts, messages)):
+            return
+        cached = {id(c[0]): c for c in counts}
+        synced = []
+        for message in messages:
+            c = cached.get(id(message))
+            if c is None or c[0] is not message or c[1] is not message.get("content"):
+                c = (message, message.get("content"), num_tokens_from_message(message, self.model))
+            synced.append(c)
+        self._token_counts = synced
+        self._total_tokens = sum(c[2] for c in synced)
 
-# refer to https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
-def num_tokens_from_messages(messages, model):
-    """Returns the number of tokens used by a list of messages."""
+    def _pop_message(self, index, precise=True):
+        self.messages.pop(index)
+        # 计数不可用时缓存可能未对齐，留待下次 calc_tokens 重建
+        if precise and len(self._token_counts) == len(self.messages) + 1:
+            self._total_tokens -= self._token_counts.pop(index)[2]
+
+
+_CHARACTER_MODELS = ["wenxin", "xunfei"]
+
+_GPT_35_MODELS = ["gpt-3.5-turbo-0301", "gpt-35-turbo", "gpt-3.5-turbo-1106", "moonshot", const.LINKAI_35]
+
+_GPT_4_MODELS = ["gpt-4-0314", "gpt-4-0613", "gpt-4-32k", "gpt-4-32k-0613", "gpt-3.5-turbo-0613",
+                 "gpt-3.5-turbo-16k", "gpt-3.5-turbo-16k-0613", "gpt-35-turbo-16k", "gpt-4-turbo-preview",
+                 "gpt-4-1106-preview", const.GPT4_TURBO_PREVIEW, const.GPT4_VISION_PREVIEW, const.GPT4_TURBO_01_25,
+                 const.GPT_4o, const.GPT_4O_0806, const.GPT_4o_MINI, const.LINKAI_4o, const.LINKAI_4_TURBO, const.GPT_5, const.GPT_5_MINI, const.GPT_5_NANO]
+
+
+def _by_character(model):
+    return model in _CHARACTER_MODELS or model.startswith(const.GEMINI)
+
+
+@functools.lru_cache(maxsize=None)
+def _resolve_model(model):
+    """将模型名归一到 gpt-3.5-turbo 或 gpt-4 的计数规则"""
+    if model in _GPT_35_MODELS or model.startswith("claude-3"):
+        return "gpt-3.5-turbo"
+    if model in _GPT_4_MODELS or model == "gpt-4":
+        return "gpt-4"
+    if model != "gpt-3.5-turbo":
+        logger.debug(f"num_tokens_from_messages() is not implemented for model {model}. Returning num tokens assuming gpt-3.5-turbo.")
+    return "gpt-3.5-turbo"
 
-    if model in ["wenxin", "xunfei"] or model.startswith(const.GEMINI):
-        return num_tokens_by_character(messages)
 
+@functools.lru_cache(maxsize=None)
+def _get_encoding(model):
+    """按模型缓存 tiktoken 编码对象，避免每次计数都重新查找"""
     import tiktoken
 
-    if model in ["gpt-3.5-turbo-0301", "gpt-35-turbo", "gpt-3.5-turbo-1106", "moonshot", const.LINKAI_35]:
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo")
-    elif model in ["gpt-4-0314", "gpt-4-0613", "gpt-4-32k", "gpt-4-32k-0613", "gpt-3.5-turbo-0613",
-                   "gpt-3.5-turbo-16k", "gpt-3.5-turbo-16k-0613", "gpt-35-turbo-16k", "gpt-4-turbo-preview",
-                   "gpt-4-1106-preview", const.GPT4_TURBO_PREVIEW, const.GPT4_VISION_PREVIEW, const.GPT4_TURBO_01_25,
-                   const.GPT_4o, const.GPT_4O_0806, const.GPT_4o_MINI, const.LINKAI_4o, const.LINKAI_4_TURBO, const.GPT_5, const.GPT_5_MINI, const.GPT_5_NANO]:
-        return num_tokens_from_messages(messages, model="gpt-4")
-    elif model.startswith("claude-3"):
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo")
     try:
-        encoding = tiktoken.encoding_for_model(model)
+        return tiktoken.encoding_for_model(model)
     except KeyError:
         logger.debug("Warning: model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def _reply_priming_tokens(model):
+    # every reply is primed with <|start|>assistant<|message|>
+    return 0 if _by_character(model) else 3
+
+
+def num_tokens_from_message(message, model):
+    """Returns the number of tokens used by a single message, excluding reply priming."""
+    if _by_character(model):
+        return len(message["content"])
+
+    model = _resolve_model(model)
+    encoding = _get_encoding(model)
     if model == "gpt-3.5-turbo":
         tokens_per_message = 4  # every message follows <|start|>{role/name}\n{content}<|end|>\n
         tokens_per_name = -1  # if there's a name, the role is omitted
-    elif model == "gpt-4":
+    else:
         tokens_per_message = 3
         tokens_per_name = 1
-    else:
-        logger.debug(f"num_tokens_from_messages() is not implemented for model {model}. Returning num tokens assuming gpt-3.5-turbo.")
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo")
-    num_tokens = 0
-    for message in messages:
-        num_tokens += tokens_per_message
-        for key, value in message.items():
-            num_tokens += len(encoding.encode(value))
-            if key == "name":
-                num_tokens += tokens_per_name
-    num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
+    num_tokens = tokens_per_message
+    for key, value in message.items():
+        num_tokens += len(encoding.encode(value))
+        if key == "name":
+            num_tokens += tokens_per_name
+    return num_tokens
+
+
+# refer to https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
+def num_tokens_from_messages(messages, model):
+    """Returns the number of tokens used by a list of messages."""
+    if _by_character(model):
+        return num_tokens_by_character(messages)
+    num_tokens = sum(num_tokens_from_message(message, model) for message in messages)
+    num_tokens += _reply_priming_tokens(model)
     return num_tokens
 
 
@@ -10,7 +10,7 @@ from models.bot import Bot
 from models.session_manager import SessionManager
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
-from common import const
+from common import const, prompt_cache
 from common.log import logger
 from config import conf
 
@@ -253,6 +253,14 @@ class ClaudeAPIBot(Bot, OpenAIImage):
         if tools:
             request_params["tools"] = tools
 
+        if prompt_cache.is_enabled():
+            system, tools, request_params["messages"] = prompt_cache.apply_claude_cache_control(
+                system_prompt, tools, claude_messages)
+            if system:
+                request_params["system"] = system
+            if tools:
+                request_params["tools"] = tools
+
         try:
             if stream:
                 return self._handle_stream_response(request_params)
@@ -341,15 +349,25 @@ class ClaudeAPIBot(Bot, OpenAIImage):
                     "finish_reason": claude_response.get("stop_reason", "stop")
                 }
             ],
-            "usage": {
-                "prompt_tokens": usage.get("input_tokens", 0),
-                "completion_tokens": usage.get("output_tokens", 0),
-                "total_tokens": usage.get("input_tokens", 0) + usage.get("output_tokens", 0)
-            }
+            "usage": self._format_usage(usage)
         }
 
         return formatted_response
 
+    @staticmethod
+    def _format_usage(usage):
+        """Claude usage -> OpenAI usage; Claude's input_tokens excludes cache reads and writes"""
+        cached = usage.get("cache_read_input_tokens") or 0
+        prompt_tokens = (usage.get("input_tokens") or 0) + cached + (usage.get("cache_creation_input_tokens") or 0)
+        completion_tokens = usage.get("output_tokens") or 0
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached},
+            "cache_creation_input_tokens": usage.get("cache_creation_input_tokens") or 0,
+        }
+
     def _handle_stream_response(self, request_params):
         """Handle streaming Claude API response using HTTP requests"""
         # Prepare headers
@@ -366,6 +384,7 @@ class ClaudeAPIBot(Bot, OpenAIImage):
         tool_uses_map = {}  # {index: {id, name, input}}
         current_tool_use_index = -1
         stop_reason = None  # Track stop reason from Claude
+        usage = {}  # input usage arrives in message_start, output_tokens in message_delta
 
         try:
             # Make streaming HTTP request
@@ -405,7 +424,10 @@ class ClaudeAPIBot(Bot, OpenAIImage):
                             event = json.loads(line)
                             event_type = event.get("type")
 
-                            if event_type == "content_block_start":
+                            if event_type == "message_start":
+                                usage.update(event.get("message", {}).get("usage") or {})
+
+                            elif event_type == "content_block_start":
                                 # New content block
                                 block = event.get("content_block", {})
                                 if block.get("type") == "tool_use":
@@ -441,6 +463,8 @@ class ClaudeAPIBot(Bot, OpenAIImage):
                                         tool_uses_map[current_tool_use_index]["input"] += delta.get("partial_json", "")
 
                             elif event_type == "message_delta":
+                                usage.update(event.get("usage") or {})
+
                                 # Extract stop_reason from delta
                                 delta = event.get("delta", {})
                                 if "stop_reason" in delta:
@@ -476,6 +500,15 @@ class ClaudeAPIBot(Bot, OpenAIImage):
                             elif event_type == "message_stop":
                                 # Final event - log completion
                                 logger.debug(f"[Claude] Stream completed with stop_reason: {stop_reason}")
+                                if usage:
+                                    # OpenAI-style usage chunk (empty choices, as with stream_options.include_usage)
+                                    yield {
+                                        "object": "chat.completion.chunk",
+                                        "created": int(time.time()),
+                                        "model": request_params["model"],
+                                        "choices": [],
+                                        "usage": self._format_usage(usage)
+                                    }
 
                         except json.JSONDecodeError:
                             continue
@@ -108,6 +108,12 @@ class OpenAICompatibleBot:
             # Make API call with proper configuration
             api_key = api_config.get('api_key')
             api_base = api_config.get('api_base')
+
+            # Ask for a final usage chunk (incl. cached prompt tokens) when streaming.
+            # Only the official endpoint is known to accept stream_options; other
+            # compatible providers still report usage if they send it by default.
+            if stream and "api.openai.com" in (api_base or "api.openai.com"):
+                request_params["stream_options"] = {"include_usage": True}
             
             if stream:
                 return self._handle_stream_response(request_params, api_key, api_base)